@@ -0,0 +1,258 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pytz
+
+from metrics import STORAGE_ERRORS, STORAGE_LATENCY
+from quota import BULK, CRITICAL, NORMAL, REQUEST_DEADLINE, REQUEST_PRIORITY
+
+logger = logging.getLogger(__name__)
+
+# Приоритет запросов метода в квоте Google Sheets API (см. quota.SheetsGovernor); остальные — NORMAL
+METHOD_PRIORITIES = {
+    "save_registration": CRITICAL,
+    "append_registrations": CRITICAL,
+    "mark_reminder_sent": CRITICAL,
+    "mark_reminders_sent": CRITICAL,
+    "get_all_exams_for_reminders": BULK,
+    "get_unique_telegram_ids": BULK,
+    "archive_registrations": BULK,
+    # Удаление идёт под row_lock, которого ждут регистрации и напоминания: резерв квоты ему доступен
+    "delete_archived_rows": CRITICAL,
+}
+
+# Вызовы, удаляющие строки листа "Записи". Их не прерывают ни таймаут, ни отмена: поток продолжил бы удалять
+# строки, а row_lock освободился бы раньше, и номера строк в очереди напоминаний разошлись бы с таблицей
+UNINTERRUPTIBLE_METHODS = {"delete_archived_rows"}
+
+
+class AsyncGoogleSheets:
+    """
+    Асинхронный фасад над хранилищем (GoogleSheets или SQLiteStorage).
+    Блокирующие вызовы (HTTP-запросы gspread, SQLite) выполняются в ограниченном пуле потоков,
+    чтобы медленный ответ Google не останавливал polling и диалоги других пользователей.
+
+    С тёплым снимком (snapshot.WarmSnapshot) расписание и предстоящие записи до подключения
+    хранилища берутся из снимка, а после подключения — снова из хранилища, обновляя снимок.
+    """
+
+    def __init__(self, sheets, snapshot=None):
+        self.sheets = sheets
+        self.snapshot = snapshot
+        # Хранилище ещё не подключено, чтения идут из загруженного снимка
+        self.warm = False
+        # Сколько запросов к Google Sheets может выполняться одновременно
+        self.max_concurrency = max(1, int(os.getenv("SHEETS_MAX_CONCURRENCY", "4")))
+        # Таймаут одного вызова (ожидание очереди + сам запрос), в секундах
+        self.timeout = float(os.getenv("SHEETS_TIMEOUT", "30"))
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency,
+            thread_name_prefix="sheets",
+        )
+        self._semaphore = None
+        self._row_lock = None
+
+        # Кэш расписания: время жизни в секундах (0 — без кэша, только склейка одновременных запросов)
+        self.slots_ttl = float(os.getenv("SLOTS_CACHE_TTL", "60"))
+        self._slots = None
+        self._slots_loaded_at = 0.0
+        self._slots_generation = 0
+        self._slots_refresh = None
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Семафор создаётся лениво, уже внутри работающего event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    @property
+    def row_lock(self) -> asyncio.Lock:
+        """
+        Номера строк листа "Записи" не меняются, пока удерживается эта блокировка.
+        Её берут все, кто получает номер строки и потом пишет по нему (напоминания, дозапись журнала),
+        и перенос в архив, который удаляет строки и сдвигает номера.
+        """
+        # Как и семафор, создаётся лениво внутри работающего event loop
+        if self._row_lock is None:
+            self._row_lock = asyncio.Lock()
+        return self._row_lock
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        priority = METHOD_PRIORITIES.get(func.__name__, NORMAL)
+        uninterruptible = func.__name__ in UNINTERRUPTIBLE_METHODS
+        # run_in_executor не передаёт contextvars в поток: приоритет и срок передаём через копию контекста.
+        # После срока (таймаута вызывающего) поток не ждёт квоту и не повторяет запрос
+        context = contextvars.copy_context()
+        context.run(REQUEST_PRIORITY.set, priority)
+        context.run(REQUEST_DEADLINE.set, None if uninterruptible else time.monotonic() + self.timeout)
+        call = functools.partial(context.run, func, *args, **kwargs)
+
+        async def run_limited():
+            if priority >= BULK:
+                # Запросы BULK ждут квоту, ещё не заняв поток пула: иначе, ожидая резерва,
+                # они держали бы потоки, нужные регистрациям и флагам напоминаний
+                await self.wait_for_quota(priority)
+            async with self._get_semaphore():
+                return await loop.run_in_executor(self._executor, call)
+
+        started = time.perf_counter()
+        try:
+            if uninterruptible:
+                return await self._run_to_completion(run_limited())
+            return await asyncio.wait_for(run_limited(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            STORAGE_ERRORS.inc(method=func.__name__)
+            logger.error(f"Таймаут запроса к Google Sheets ({func.__name__}, {self.timeout} с)")
+            raise
+        except Exception:
+            STORAGE_ERRORS.inc(method=func.__name__)
+            raise
+        finally:
+            STORAGE_LATENCY.observe(time.perf_counter() - started, method=func.__name__)
+
+    @staticmethod
+    async def _run_to_completion(coroutine):
+        """Дождаться вызова до конца; отмена вызывающего передаётся дальше только после его завершения"""
+        task = asyncio.ensure_future(coroutine)
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            await asyncio.wait({task})
+            raise
+
+    async def wait_for_quota(self, priority: int = BULK):
+        """
+        Дождаться, пока квоты чтения хватит на запрос этого приоритета (токены не расходуются).
+        Ожидание идёт в event loop, а не в потоке пула; хранилище без квоты (SQLite) не ждёт
+        """
+        governor = getattr(self.sheets, "governor", None)
+        if governor is None:
+            return
+        while True:
+            delay = governor.admission_delay("read", priority)
+            if delay <= 0:
+                return
+            await asyncio.sleep(min(delay, 1.0))
+
+    async def initialize(self):
+        return await self._run(self.sheets.initialize)
+
+    async def load_snapshot(self) -> bool:
+        """
+        Загрузить снимок с диска до подключения хранилища.
+        True — снимок загружен, до успешного initialize() чтения обслуживаются из него
+        """
+        if self.snapshot is None or not await asyncio.to_thread(self.snapshot.load):
+            return False
+        self.warm = True
+        self._slots = self.snapshot.slots
+        self._slots_loaded_at = 0.0
+        return True
+
+    def end_warm_start(self):
+        """
+        Хранилище подключено: дальше чтения идут в него.
+        Вызывается под row_lock вместе со сбросом очереди напоминаний, построенной по номерам строк из снимка
+        """
+        if not self.warm:
+            return
+        self.warm = False
+        logger.info("Хранилище подключено, данные снимка заменяются данными хранилища")
+        # Расписание из снимка отдаётся, пока в фоне читается свежее
+        if self._slots is not None:
+            self._start_slots_refresh()
+
+    async def save_registration(self, user_data: dict):
+        return await self._run(self.sheets.save_registration, user_data)
+
+    async def append_registrations(self, rows: list):
+        return await self._run(self.sheets.append_registrations, rows)
+
+    async def get_exam_slots(self):
+        """
+        Слоты из кэша. Устаревший кэш отдаётся сразу, а обновление идёт в фоне;
+        одновременные запросы на обновление склеиваются в один запрос к таблице.
+        """
+        if self._slots is not None and (self.slots_ttl > 0 or self.warm):
+            # До подключения хранилища обновлять расписание неоткуда
+            if not self.warm and time.monotonic() - self._slots_loaded_at >= self.slots_ttl:
+                self._start_slots_refresh()
+            return self._future_slots(self._slots)
+
+        slots = await asyncio.shield(self._start_slots_refresh())
+        return self._future_slots(slots)
+
+    def invalidate_slots(self):
+        """Сброс кэша расписания (например, после правки листа "Даты экзаменов")"""
+        self._slots = None
+        self._slots_generation += 1
+        self._slots_refresh = None
+        logger.info("Кэш расписания сброшен")
+
+    def _start_slots_refresh(self) -> asyncio.Task:
+        if self._slots_refresh is None or self._slots_refresh.done():
+            self._slots_refresh = asyncio.create_task(self._refresh_slots(self._slots_generation))
+            self._slots_refresh.add_done_callback(self._on_slots_refresh_done)
+        return self._slots_refresh
+
+    async def _refresh_slots(self, generation: int):
+        slots = await self._run(self.sheets.get_exam_slots)
+        # Результат запроса, начатого до сброса кэша, не сохраняем
+        if generation == self._slots_generation:
+            self._slots = slots
+            self._slots_loaded_at = time.monotonic()
+        if self.snapshot is not None:
+            self.snapshot.update_slots(slots)
+        return slots
+
+    @staticmethod
+    def _on_slots_refresh_done(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Не удалось обновить кэш расписания: {task.exception()}")
+
+    def _future_slots(self, slots):
+        # Пока кэш жив, часть слотов могла уже пройти
+        now = datetime.now(pytz.UTC).astimezone(self.sheets.timezone)
+        return [slot for slot in slots if slot["exam_datetime"] >= now]
+
+    async def get_all_exams_for_reminders(self):
+        if self.warm:
+            return self.snapshot.upcoming_exams()
+        exams = await self._run(self.sheets.get_all_exams_for_reminders)
+        if self.snapshot is not None:
+            self.snapshot.update_exams(exams)
+        return exams
+
+    async def get_unique_telegram_ids(self):
+        return await self._run(self.sheets.get_unique_telegram_ids)
+
+    async def archive_registrations(self, cutoff: datetime) -> list:
+        return await self._run(self.sheets.archive_registrations, cutoff)
+
+    async def delete_archived_rows(self, archived: list) -> list:
+        return await self._run(self.sheets.delete_archived_rows, archived)
+
+    def _require_connected(self):
+        # Номера строк из снимка могли устареть: писать по ним в таблицу нельзя.
+        # Отметки восстановит сверка с журналом доставки после подключения
+        if self.warm:
+            raise RuntimeError("Хранилище ещё не подключено (работаем по снимку)")
+
+    async def mark_reminder_sent(self, row_number: int, reminder_type: str):
+        self._require_connected()
+        return await self._run(self.sheets.mark_reminder_sent, row_number, reminder_type)
+
+    async def mark_reminders_sent(self, items: list) -> dict:
+        self._require_connected()
+        return await self._run(self.sheets.mark_reminders_sent, items)
+
+    def shutdown(self):
+        """Остановка пула потоков (незавершённые запросы дорабатывают в фоне)"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,93 @@
+"""Общие функции бенчмарков: изоляция окружения, перцентили и запись результатов"""
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def isolate_environment() -> str:
+    """
+    Направить все локальные базы бота во временный каталог и отключить внешние подключения.
+    Вызывается до импорта bot: load_dotenv не перезаписывает уже заданные переменные.
+    """
+    workdir = tempfile.mkdtemp(prefix="ege-bot-bench-")
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": "123456:BENCHMARK",
+        "STORAGE_BACKEND": "sheets",
+        "GOOGLE_SHEET_ID": "",
+        "SQLITE_STORAGE_PATH": os.path.join(workdir, "storage.db"),
+        "REGISTRATIONS_JOURNAL_PATH": os.path.join(workdir, "registrations_journal.db"),
+        "REGISTRATIONS_FLUSH_MAX_BACKOFF": "0",
+        "BROADCAST_DB_PATH": os.path.join(workdir, "broadcasts.db"),
+        "REMINDER_LEDGER_PATH": os.path.join(workdir, "reminder_ledger.db"),
+        "RECIPIENTS_DB_PATH": os.path.join(workdir, "recipients.db"),
+        "CONVERSATION_STORE_PATH": "",
+        "WARM_SNAPSHOT_PATH": "",
+        "LEADER_LEASE_PATH": "",
+        "METRICS_PORT": "",
+        "TELEGRAM_PROXY_URL": "",
+        "TELEGRAM_PROXY_POOL_HOST": "",
+    })
+    # Квота Google Sheets по умолчанию не ограничивает бенчмарк; реальную можно задать в окружении
+    os.environ.setdefault("SHEETS_READ_QUOTA", "1000000")
+    os.environ.setdefault("SHEETS_WRITE_QUOTA", "1000000")
+    os.environ.setdefault("SHEETS_BACKOFF_BASE", "0.05")
+    return workdir
+
+
+def percentiles(samples: list, points: tuple = (50, 95, 99)) -> dict:
+    """Перцентили выборки (в тех же единицах), метод ближайшего ранга"""
+    if not samples:
+        return {f"p{point}": None for point in points}
+    ordered = sorted(samples)
+    result = {}
+    for point in points:
+        rank = max(0, min(len(ordered) - 1, math.ceil(point / 100 * len(ordered)) - 1))
+        result[f"p{point}"] = ordered[rank]
+    return result
+
+
+def latency_summary(seconds: list) -> dict:
+    """Сводка по задержкам в миллисекундах"""
+    summary = {key: round(value * 1000, 3) if value is not None else None for key, value in percentiles(seconds).items()}
+    summary["max"] = round(max(seconds) * 1000, 3) if seconds else None
+    summary["count"] = len(seconds)
+    return summary
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(kind: str, config: dict, results: dict, output: str | None = None) -> str:
+    """Сохранить результаты в JSON (по умолчанию benchmarks/results/<kind>-<время>.json)"""
+    payload = {
+        "kind": kind,
+        "timestamp": datetime.now().astimezone().isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": config,
+        "results": results,
+    }
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{kind}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    return output
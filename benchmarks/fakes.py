@@ -0,0 +1,388 @@
+"""
+Заглушки Google Sheets и Telegram Bot для бенчмарков и нагрузочных тестов.
+Хранят данные в памяти и позволяют задать задержку, долю ошибок и долю ответов 429.
+"""
+import asyncio
+import itertools
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytz
+from gspread.exceptions import APIError, WorksheetNotFound
+from gspread.utils import a1_range_to_grid_range
+from telegram.error import NetworkError, RetryAfter
+from telegram.request import BaseRequest
+
+from mirror import RegistrationsMirror
+from sheets import GoogleSheets
+from storage import EXAMPLE_SCHEDULE_ROWS, REGISTRATION_HEADERS, SCHEDULE_HEADERS
+
+TIMEZONE = pytz.timezone("Asia/Novosibirsk")
+
+
+class FaultInjector:
+    """
+    Задержка и сбои для заглушек.
+    latency — средняя задержка вызова (сек), jitter — разброс вокруг неё (доля от latency),
+    error_rate — доля вызовов с ошибкой, rate_limit_rate — доля вызовов с ответом 429.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.2, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, retry_after: float = 1.0, seed: int | None = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.rate_limited = 0
+
+    def draw(self) -> tuple:
+        """Задержка вызова и тип сбоя (None, "error" или "rate_limit")"""
+        with self._lock:
+            self.calls += 1
+            delay = self.latency * (1 + self._random.uniform(-self.jitter, self.jitter)) if self.latency else 0.0
+            roll = self._random.random()
+            if roll < self.rate_limit_rate:
+                self.rate_limited += 1
+                return delay, "rate_limit"
+            if roll < self.rate_limit_rate + self.error_rate:
+                self.errors += 1
+                return delay, "error"
+            return delay, None
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "errors": self.errors, "rate_limited": self.rate_limited}
+
+
+class _FakeResponse:
+    """Ответ HTTP в том виде, в каком его разбирает gspread.exceptions.APIError"""
+
+    def __init__(self, code: int, status: str, message: str):
+        self.status_code = code
+        self._payload = {"error": {"code": code, "status": status, "message": message}}
+        self.text = message
+
+    def json(self):
+        return self._payload
+
+
+class FakeWorksheet:
+    """Лист gspread в памяти: чтение, добавление строк и пакетное обновление ячеек"""
+
+    def __init__(self, title: str, values: list | None = None, faults: FaultInjector | None = None,
+                 sheet_id: int = 0):
+        self.title = title
+        self.id = sheet_id
+        self.values = [list(row) for row in (values or [])]
+        self.faults = faults or FaultInjector()
+        self._lock = threading.Lock()
+        self.requests = 0
+        # quota.SheetsGovernor: если задан, вызовы проходят через квоту и повторы, как запросы GovernedClient
+        self.governor = None
+
+    def _request(self, kind: str = "read", idempotent: bool = True):
+        if self.governor is not None:
+            self.governor.execute(kind, self._call, idempotent=idempotent)
+        else:
+            self._call()
+
+    def _call(self):
+        # Вызовы gspread синхронные и идут из пула потоков, поэтому и задержка блокирующая
+        delay, fault = self.faults.draw()
+        self.requests += 1
+        if delay:
+            time.sleep(delay)
+        if fault == "rate_limit":
+            raise APIError(_FakeResponse(429, "RESOURCE_EXHAUSTED", "Quota exceeded (fake)"))
+        if fault == "error":
+            raise APIError(_FakeResponse(503, "UNAVAILABLE", "The service is currently unavailable (fake)"))
+
+    def _slice(self, a1_range: str) -> list:
+        grid = a1_range_to_grid_range(a1_range.split("!")[-1])
+        start_row = grid.get("startRowIndex", 0)
+        end_row = grid.get("endRowIndex", len(self.values))
+        start_col = grid.get("startColumnIndex", 0)
+        end_col = grid.get("endColumnIndex")
+        rows = []
+        for row in self.values[start_row:end_row]:
+            cells = row[start_col:end_col]
+            # Как и API, не возвращаем пустые ячейки в конце строки
+            while cells and cells[-1] == "":
+                cells.pop()
+            rows.append(cells)
+        while rows and not rows[-1]:
+            rows.pop()
+        return rows
+
+    def get_all_values(self):
+        self._request()
+        with self._lock:
+            return [list(row) for row in self.values]
+
+    def get_all_records(self):
+        values = self.get_all_values()
+        if not values:
+            return []
+        headers = values[0]
+        return [dict(zip(headers, row + [""] * (len(headers) - len(row)))) for row in values[1:]]
+
+    def get(self, a1_range: str):
+        self._request()
+        with self._lock:
+            return self._slice(a1_range)
+
+    def batch_get(self, ranges: list):
+        self._request()
+        with self._lock:
+            return [self._slice(a1_range) for a1_range in ranges]
+
+    def append_row(self, row: list):
+        return self.append_rows([row])
+
+    def append_rows(self, rows: list):
+        self._request("write", idempotent=False)
+        with self._lock:
+            first = len(self.values) + 1
+            self.values.extend([str(value) for value in row] for row in rows)
+            last = len(self.values)
+        width = max((len(row) for row in rows), default=1)
+        return {"updates": {"updatedRange": f"'{self.title}'!A{first}:{_column_letter(width)}{last}"}}
+
+    def batch_update(self, data: list):
+        self._request("write")
+        with self._lock:
+            for item in data:
+                grid = a1_range_to_grid_range(item["range"].split("!")[-1])
+                for row_offset, row in enumerate(item["values"]):
+                    row_index = grid.get("startRowIndex", 0) + row_offset
+                    while len(self.values) <= row_index:
+                        self.values.append([])
+                    for col_offset, value in enumerate(row):
+                        col_index = grid.get("startColumnIndex", 0) + col_offset
+                        target = self.values[row_index]
+                        target.extend([""] * (col_index + 1 - len(target)))
+                        target[col_index] = str(value)
+
+    def update_cell(self, row: int, col: int, value):
+        self.batch_update([{"range": f"{_column_letter(col)}{row}", "values": [[value]]}])
+
+
+def _column_letter(col: int) -> str:
+    letters = ""
+    while col:
+        col, remainder = divmod(col - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+class FakeSpreadsheet:
+    def __init__(self, faults: FaultInjector | None = None, governor=None):
+        self.faults = faults or FaultInjector()
+        self.governor = governor
+        self._worksheets = {}
+
+    def worksheet(self, title: str) -> FakeWorksheet:
+        if title not in self._worksheets:
+            raise WorksheetNotFound(title)
+        return self._worksheets[title]
+
+    def worksheets(self) -> list:
+        return list(self._worksheets.values())
+
+    def add_worksheet(self, title: str, rows: int = 1000, cols: int = 26) -> FakeWorksheet:
+        sheet = FakeWorksheet(title, faults=self.faults, sheet_id=len(self._worksheets))
+        sheet.governor = self.governor
+        self._worksheets[title] = sheet
+        return sheet
+
+    def batch_update(self, body: dict):
+        """Поддерживается только deleteDimension по строкам (перенос записей в архив)"""
+        sheets_by_id = {sheet.id: sheet for sheet in self._worksheets.values()}
+        for request in body.get("requests", []):
+            grid = request["deleteDimension"]["range"]
+            sheet = sheets_by_id[grid["sheetId"]]
+            sheet._request("write", idempotent=False)
+            with sheet._lock:
+                del sheet.values[grid["startIndex"]:grid["endIndex"]]
+
+
+def upcoming_schedule_rows(days: int = 14, times: tuple = ("10:00", "12:00", "14:00")) -> list:
+    """Расписание на ближайшие дни в формате листа «Даты экзаменов»"""
+    today = datetime.now(TIMEZONE).date()
+    zoom, contact = EXAMPLE_SCHEDULE_ROWS[0][2], EXAMPLE_SCHEDULE_ROWS[0][3]
+    return [
+        [(today + timedelta(days=day)).strftime("%d.%m.%Y"), slot_time, zoom, contact]
+        for day in range(1, days + 1)
+        for slot_time in times
+    ]
+
+
+def registration_rows(count: int, spread_days: float = 30.0, past_share: float = 0.5, seed: int = 1) -> list:
+    """
+    Синтетические строки листа «Записи»: past_share строк — с прошедшими экзаменами,
+    остальные равномерно распределены на spread_days дней вперёд.
+    """
+    rnd = random.Random(seed)
+    now = datetime.now(TIMEZONE).replace(second=0, microsecond=0)
+    rows = []
+    for index in range(count):
+        offset = timedelta(minutes=rnd.randint(1, int(spread_days * 24 * 60)))
+        exam_at = now - offset if rnd.random() < past_share else now + offset
+        rows.append([
+            (exam_at - timedelta(days=3)).strftime("%d.%m.%Y %H:%M:%S"),
+            str(100000000 + index),
+            f"student_{index}",
+            f"Студент Номер{index}",
+            rnd.choice(["ОГЭ", "ЕГЭ Проф", "ЕГЭ База"]),
+            rnd.choice(["Суббота", "Воскресенье"]),
+            exam_at.strftime("%H:%M"),
+            exam_at.strftime("%d.%m.%Y %H:%M"),
+            rnd.choice(["Василина", "Анна"]),
+            "Нет",
+            "Нет",
+        ])
+    return rows
+
+
+def make_google_sheets(registrations: list | None = None, schedule: list | None = None,
+                       faults: FaultInjector | None = None) -> GoogleSheets:
+    """
+    GoogleSheets, подключённый к таблице в памяти (без авторизации и сети).
+    Запросы к листам проходят через квоту sheets.governor (SHEETS_READ_QUOTA / SHEETS_WRITE_QUOTA)
+    """
+    sheets = GoogleSheets()
+    spreadsheet = FakeSpreadsheet(faults, governor=sheets.governor)
+    worksheet = spreadsheet.add_worksheet("Записи")
+    worksheet.values = [list(REGISTRATION_HEADERS)] + [list(row) for row in (registrations or [])]
+    schedule_worksheet = spreadsheet.add_worksheet("Даты экзаменов")
+    schedule_worksheet.values = [list(SCHEDULE_HEADERS)] + [
+        list(row) for row in (schedule if schedule is not None else upcoming_schedule_rows())
+    ]
+
+    sheets.spreadsheet = spreadsheet
+    sheets.worksheet = worksheet
+    sheets.schedule_worksheet = schedule_worksheet
+    sheets.registrations = RegistrationsMirror(worksheet, GoogleSheets.MIRROR_COLUMNS, start_row=sheets._mirror_start_row())
+    # Таблица в памяти уже «подключена»: фоновое подключение хранилища в bot.connect_storage проходит сразу
+    sheets.initialize = lambda: None
+    return sheets
+
+
+class FakeBot:
+    """
+    Telegram Bot в памяти: send_message / edit_message_text с задержкой, сбоями и RetryAfter.
+    Подходит и как bot для BroadcastEngine / ReminderScheduler, и для приёма ответов обработчиков.
+    """
+
+    def __init__(self, faults: FaultInjector | None = None):
+        self.faults = faults or FaultInjector()
+        self._message_ids = itertools.count(1)
+        self.sent = 0
+        self.edited = 0
+
+    async def _request(self):
+        delay, fault = self.faults.draw()
+        if delay:
+            await asyncio.sleep(delay)
+        if fault == "rate_limit":
+            raise RetryAfter(self.faults.retry_after)
+        if fault == "error":
+            raise NetworkError("Fake network error")
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await self._request()
+        self.sent += 1
+        return SimpleNamespace(message_id=next(self._message_ids), chat_id=chat_id, text=text)
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        await self._request()
+        self.edited += 1
+        return SimpleNamespace(message_id=message_id, chat_id=chat_id, text=text)
+
+
+class FakeTelegramRequest(BaseRequest):
+    """
+    Транспорт Bot API в памяти: настоящий Application и ExtBot работают как обычно,
+    но HTTP-запросы не уходят в сеть. Ответы имеют формат Bot API, сбои — те же коды, что у Telegram
+    (429 с retry_after, 502). Последнее сообщение бота в каждом чате запоминается,
+    чтобы виртуальные пользователи могли нажимать предложенные кнопки.
+    """
+
+    BOT_USER = {"id": 999999, "is_bot": True, "first_name": "Benchmark", "username": "benchmark_bot"}
+
+    def __init__(self, faults: FaultInjector | None = None):
+        self.faults = faults or FaultInjector()
+        self._message_ids = itertools.count(1)
+        # chat_id -> (message_id, текст, reply_markup) последнего сообщения бота
+        self.last_messages = {}
+        self.calls = {}
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _message(self, parameters: dict, message_id=None) -> dict:
+        chat_id = int(parameters["chat_id"])
+        reply_markup = parameters.get("reply_markup")
+        if isinstance(reply_markup, str):
+            reply_markup = json.loads(reply_markup)
+        text = parameters.get("text", "")
+        message_id = int(message_id or next(self._message_ids))
+        self.last_messages[chat_id] = (message_id, text, reply_markup)
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": self.BOT_USER,
+            "text": text,
+        }
+        if reply_markup:
+            message["reply_markup"] = reply_markup
+        return message
+
+    async def do_request(self, url: str, method: str, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None) -> tuple:
+        endpoint = url.rsplit("/", 1)[-1]
+        self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+        parameters = request_data.parameters if request_data else {}
+
+        if endpoint not in ("getMe", "getUpdates", "deleteWebhook", "setWebhook", "close", "logOut"):
+            delay, fault = self.faults.draw()
+            if delay:
+                await asyncio.sleep(delay)
+            if fault == "rate_limit":
+                body = {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": "Too Many Requests: retry after 1",
+                    "parameters": {"retry_after": self.faults.retry_after},
+                }
+                return 429, json.dumps(body).encode("utf-8")
+            if fault == "error":
+                return 502, json.dumps({"ok": False, "error_code": 502, "description": "Bad Gateway"}).encode("utf-8")
+
+        if endpoint == "getMe":
+            result = self.BOT_USER
+        elif endpoint == "getUpdates":
+            result = []
+        elif endpoint == "sendMessage":
+            result = self._message(parameters)
+        elif endpoint == "editMessageText":
+            result = self._message(parameters, parameters.get("message_id"))
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}, ensure_ascii=False).encode("utf-8")
@@ -0,0 +1,359 @@
+"""
+Нагрузочный тест диалога записи: N виртуальных студентов проходят
+/start → тип экзамена → слот → преподаватель → имя через настоящий Application (ConversationHandler,
+JobQueue, журнал регистраций), а Telegram и Google Sheets заменены заглушками в памяти.
+
+Студенты приходят равномерно-случайно в течение --ramp-up секунд и «думают» между шагами
+(распределение --think-dist со средним --think-mean). Задержка шага — от постановки Update в очередь
+до окончания его обработки, то есть с учётом ожидания в очереди приложения.
+
+Пример:
+    python -m benchmarks.loadtest --students 2000 --ramp-up 30 --think-mean 3
+    python -m benchmarks.loadtest --students 500 --telegram-latency 0.1 --sheets-latency 0.5 --sheets-429-rate 0.02
+
+Результаты (p50/p95/p99 по шагам, доля ошибок, пиковая память) пишутся в JSON, как и у benchmarks.run.
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import math
+import random
+import resource
+import time
+import tracemalloc
+
+from benchmarks.common import isolate_environment, latency_summary, write_results
+
+WORKDIR = isolate_environment()
+
+from telegram import Update  # noqa: E402
+from telegram.ext import ApplicationBuilder, TypeHandler  # noqa: E402
+
+import bot  # noqa: E402  (окружение должно быть настроено до импорта)
+from async_sheets import AsyncGoogleSheets  # noqa: E402
+from benchmarks.fakes import (  # noqa: E402
+    FakeTelegramRequest,
+    FaultInjector,
+    make_google_sheets,
+    upcoming_schedule_rows,
+)
+from journal import RegistrationJournal  # noqa: E402
+from messages import (  # noqa: E402
+    TEXT_CHOOSE_EXAM_TYPE,
+    TEXT_CHOOSE_SLOT,
+    TEXT_CHOOSE_TEACHER,
+    TEXT_ENTER_FULL_NAME,
+    TEXT_NO_SLOTS,
+    TEXT_SAVE_ERROR,
+    TEXT_SCHEDULE_LOAD_ERROR,
+    TEXT_SESSION_EXPIRED,
+    TEXT_SLOT_UNAVAILABLE,
+)
+
+STEPS = ("start", "exam_type", "slot", "teacher", "name")
+
+# Какой ответ бота ожидается после шага (None — любой, кроме сообщений об ошибке)
+EXPECTED_REPLIES = {
+    "start": TEXT_CHOOSE_EXAM_TYPE,
+    "exam_type": TEXT_CHOOSE_SLOT,
+    "slot": TEXT_CHOOSE_TEACHER,
+    "teacher": TEXT_ENTER_FULL_NAME,
+    "name": None,
+}
+ERROR_REPLIES = {TEXT_NO_SLOTS, TEXT_SAVE_ERROR, TEXT_SCHEDULE_LOAD_ERROR, TEXT_SESSION_EXPIRED, TEXT_SLOT_UNAVAILABLE}
+
+# Кнопка, которую нажимает студент на шаге
+BUTTON_PREFIXES = {"exam_type": "exam_", "slot": "slot_", "teacher": "teacher_"}
+
+FIRST_USER_ID = 500000000
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.update_ids = itertools.count(1)
+        self.telegram = FakeTelegramRequest(
+            FaultInjector(
+                latency=args.telegram_latency,
+                error_rate=args.telegram_error_rate,
+                rate_limit_rate=args.telegram_429_rate,
+                seed=args.seed,
+            )
+        )
+        self.sheets_faults = FaultInjector(
+            latency=args.sheets_latency,
+            error_rate=args.sheets_error_rate,
+            rate_limit_rate=args.sheets_429_rate,
+            seed=args.seed + 1,
+        )
+        # update_id -> future, который завершается после обработки Update приложением
+        self._waiters = {}
+        # update_id -> исключение из обработчика
+        self._handler_errors = {}
+        self.latencies = {step: [] for step in STEPS}
+        self.errors = {step: {} for step in STEPS}
+        self.attempts = {step: 0 for step in STEPS}
+        self.completed = 0
+
+    # --- Приложение ---
+
+    def build(self):
+        storage = make_google_sheets(schedule=upcoming_schedule_rows(), faults=self.sheets_faults)
+        bot.storage = storage
+        bot.sheets = AsyncGoogleSheets(storage)
+        bot.journal = RegistrationJournal()
+
+        builder = (
+            ApplicationBuilder()
+            .token("123456:BENCHMARK")
+            .request(self.telegram)
+            .get_updates_request(FakeTelegramRequest())
+        )
+        application = bot.build_application(builder)
+        # Обработчик в отдельной группе срабатывает после ConversationHandler — это сигнал окончания обработки
+        application.add_handler(TypeHandler(Update, self._on_processed), group=1)
+        application.add_error_handler(self._on_error)
+        return application
+
+    async def _on_processed(self, update: Update, context):
+        waiter = self._waiters.get(update.update_id)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(time.perf_counter())
+
+    async def _on_error(self, update, context):
+        if isinstance(update, Update):
+            self._handler_errors[update.update_id] = context.error
+
+    # --- Синтетические Update ---
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": "Студент", "username": f"student_{user_id}"}
+
+    def _message_update(self, user_id: int, text: str) -> dict:
+        message = {
+            "message_id": next(self.update_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": next(self.update_ids), "message": message}
+
+    def _callback_update(self, user_id: int, data: str) -> dict:
+        message_id, text, _ = self.telegram.last_messages[user_id]
+        update_id = next(self.update_ids)
+        return {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": FakeTelegramRequest.BOT_USER,
+                    "text": text,
+                },
+            },
+        }
+
+    def _choose_button(self, user_id: int, prefix: str) -> str | None:
+        last = self.telegram.last_messages.get(user_id)
+        markup = last[2] if last else None
+        if not markup:
+            return None
+        options = [
+            button["callback_data"]
+            for row in markup.get("inline_keyboard", [])
+            for button in row
+            if str(button.get("callback_data", "")).startswith(prefix)
+        ]
+        return self.random.choice(options) if options else None
+
+    def _think_time(self) -> float:
+        mean = self.args.think_mean
+        if mean <= 0:
+            return 0.0
+        if self.args.think_dist == "fixed":
+            return mean
+        if self.args.think_dist == "exp":
+            return self.random.expovariate(1 / mean)
+        # Логнормальное распределение с заданным средним: mean = exp(mu + sigma^2 / 2)
+        sigma = 0.6
+        return self.random.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma)
+
+    # --- Сценарий студента ---
+
+    async def _step(self, application, step: str, user_id: int, payload: dict) -> bool:
+        self.attempts[step] += 1
+        update = Update.de_json(payload, application.bot)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[update.update_id] = waiter
+        started = time.perf_counter()
+        await application.update_queue.put(update)
+        try:
+            finished = await asyncio.wait_for(waiter, timeout=self.args.step_timeout)
+        except asyncio.TimeoutError:
+            self._error(step, "timeout")
+            return False
+        finally:
+            self._waiters.pop(update.update_id, None)
+        self.latencies[step].append(finished - started)
+
+        error = self._handler_errors.pop(update.update_id, None)
+        if error is not None:
+            self._error(step, type(error).__name__)
+            return False
+
+        reply = self.telegram.last_messages.get(user_id, (None, None, None))[1]
+        expected = EXPECTED_REPLIES[step]
+        if (expected is not None and reply != expected) or reply in ERROR_REPLIES:
+            self._error(step, "unexpected_reply")
+            return False
+        return True
+
+    def _error(self, step: str, kind: str):
+        self.errors[step][kind] = self.errors[step].get(kind, 0) + 1
+
+    async def student(self, application, index: int, arrival: float):
+        await asyncio.sleep(arrival)
+        user_id = FIRST_USER_ID + index
+
+        if not await self._step(application, "start", user_id, self._message_update(user_id, "/start")):
+            return
+        for step in ("exam_type", "slot", "teacher"):
+            await asyncio.sleep(self._think_time())
+            data = self._choose_button(user_id, BUTTON_PREFIXES[step])
+            if data is None:
+                self.attempts[step] += 1
+                self._error(step, "no_button")
+                return
+            if not await self._step(application, step, user_id, self._callback_update(user_id, data)):
+                return
+        await asyncio.sleep(self._think_time())
+        if await self._step(application, "name", user_id, self._message_update(user_id, f"Студент Номер{index}")):
+            self.completed += 1
+
+    # --- Запуск ---
+
+    async def run(self) -> dict:
+        args = self.args
+        application = self.build()
+        rss_before_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if args.tracemalloc:
+            tracemalloc.start()
+
+        await application.initialize()
+        await bot.post_init(application)
+        await application.start()
+
+        arrivals = sorted(self.random.uniform(0, args.ramp_up) for _ in range(args.students))
+        started = time.perf_counter()
+        await asyncio.gather(*(self.student(application, index, arrival) for index, arrival in enumerate(arrivals)))
+        elapsed = time.perf_counter() - started
+        conversations_left = len(bot.conversations)
+
+        # Дописываем журнал в «таблицу», чтобы проверить, что все записи дошли
+        flush_started = time.perf_counter()
+        # (фоновая задача flush_registrations может выполняться в это же время — тогда просто ждём её)
+        while bot.journal.pending_count() and time.perf_counter() - flush_started < args.step_timeout:
+            await bot.journal.flush()
+            await asyncio.sleep(0.05)
+        flush_seconds = time.perf_counter() - flush_started
+        journal_pending = bot.journal.pending_count()
+        sheet_rows = len(bot.storage.worksheet.values) - 1
+
+        await application.stop()
+        await bot.post_shutdown(application)
+        await application.shutdown()
+
+        tracemalloc_peak = None
+        if args.tracemalloc:
+            _, tracemalloc_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        rss_peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        steps = {}
+        for step in STEPS:
+            failed = sum(self.errors[step].values())
+            steps[step] = {
+                "latency_ms": latency_summary(self.latencies[step]),
+                "attempts": self.attempts[step],
+                "errors": self.errors[step],
+                "error_rate": round(failed / self.attempts[step], 4) if self.attempts[step] else None,
+            }
+
+        return {
+            "students": args.students,
+            "completed_registrations": self.completed,
+            "completion_rate": round(self.completed / args.students, 4) if args.students else None,
+            "seconds": round(elapsed, 3),
+            "registrations_per_second": round(self.completed / elapsed, 2) if elapsed else None,
+            "steps": steps,
+            "final_flush_seconds": round(flush_seconds, 3),
+            "journal_pending": journal_pending,
+            "sheet_rows": sheet_rows,
+            "conversations_left": conversations_left,
+            "memory": {
+                "rss_peak_mb": round(rss_peak_kb / 1024, 1),
+                "rss_before_mb": round(rss_before_kb / 1024, 1),
+                "tracemalloc_peak_mb": round(tracemalloc_peak / 1024 / 1024, 1) if tracemalloc_peak else None,
+            },
+            "telegram_calls": dict(self.telegram.calls),
+            "telegram_faults": self.telegram.faults.stats(),
+            "sheets_faults": self.sheets_faults.stats(),
+        }
+
+
+def print_summary(results: dict):
+    print(
+        f"Студентов: {results['students']}, записались: {results['completed_registrations']} "
+        f"за {results['seconds']} с ({results['registrations_per_second']} в секунду)"
+    )
+    print(f"{'шаг':<10} {'p50, мс':>10} {'p95, мс':>10} {'p99, мс':>10} {'ошибки':>8}")
+    for step, data in results["steps"].items():
+        latency = data["latency_ms"]
+        print(
+            f"{step:<10} {latency['p50'] or 0:>10.1f} {latency['p95'] or 0:>10.1f} {latency['p99'] or 0:>10.1f} "
+            f"{(data['error_rate'] or 0) * 100:>7.2f}%"
+        )
+    print(f"Пиковая память (RSS): {results['memory']['rss_peak_mb']} МБ")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест диалога записи на заглушках Telegram и Google Sheets")
+    parser.add_argument("--students", type=int, default=1000, help="число виртуальных студентов")
+    parser.add_argument("--ramp-up", type=float, default=10.0, help="за сколько секунд приходят все студенты")
+    parser.add_argument("--think-mean", type=float, default=1.0, help="среднее время раздумий между шагами, с")
+    parser.add_argument("--think-dist", choices=("lognormal", "exp", "fixed"), default="lognormal")
+    parser.add_argument("--step-timeout", type=float, default=60.0, help="сколько ждать обработки шага, с")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="задержка Bot API, с")
+    parser.add_argument("--telegram-error-rate", type=float, default=0.0, help="доля ответов 502 от Bot API")
+    parser.add_argument("--telegram-429-rate", type=float, default=0.0, help="доля ответов 429 от Bot API")
+    parser.add_argument("--sheets-latency", type=float, default=0.2, help="задержка запроса к таблице, с")
+    parser.add_argument("--sheets-error-rate", type=float, default=0.0, help="доля ошибок таблицы")
+    parser.add_argument("--sheets-429-rate", type=float, default=0.0, help="доля ответов 429 от таблицы")
+    parser.add_argument("--tracemalloc", action="store_true", help="дополнительно считать пик памяти Python (медленнее)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="файл для результатов JSON")
+    parser.add_argument("--log-level", default="WARNING")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.getLogger().setLevel(args.log_level)
+    results = asyncio.run(LoadTest(args).run())
+    print_summary(results)
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "log_level")}
+    print(f"Результаты: {write_results('loadtest', config, results, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
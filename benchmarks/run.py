@@ -0,0 +1,275 @@
+"""
+Офлайн-бенчмарки бота на заглушках Google Sheets и Telegram.
+
+Измеряется:
+- registrations — регистрации в секунду через name_input и скорость дозаписи журнала в таблицу;
+- reminder_scan — время get_all_exams_for_reminders и пересборки очереди напоминаний на 1k/10k/100k строк;
+- broadcast — скорость /announce_new_exam (рассылка через BroadcastEngine).
+
+Пример:
+    python -m benchmarks.run
+    python -m benchmarks.run --only reminder_scan --sizes 1000,10000
+    python -m benchmarks.run --sheets-latency 0.3 --sheets-error-rate 0.02 --telegram-429-rate 0.01
+
+Результаты пишутся в JSON (benchmarks/results/bench-<время>.json или --output) для сравнения между версиями.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+from types import SimpleNamespace
+
+from benchmarks.common import isolate_environment, latency_summary, write_results
+
+WORKDIR = isolate_environment()
+
+import bot  # noqa: E402  (окружение должно быть настроено до импорта)
+from async_sheets import AsyncGoogleSheets  # noqa: E402
+from broadcast import BroadcastEngine  # noqa: E402
+from benchmarks.fakes import (  # noqa: E402
+    FakeBot,
+    FaultInjector,
+    make_google_sheets,
+    registration_rows,
+    upcoming_schedule_rows,
+)
+from journal import RegistrationJournal  # noqa: E402
+from scheduler import ReminderScheduler  # noqa: E402
+
+ADMIN_ID = 1
+
+
+class _FakeJob:
+    def schedule_removal(self):
+        pass
+
+
+class _FakeJobQueue:
+    """Очередь задач, которая ничего не запускает (для пересборки очереди напоминаний)"""
+
+    def run_once(self, callback, when, name=None, job_kwargs=None):
+        return _FakeJob()
+
+
+def _message(user_id: int, text: str, replies: list):
+    async def reply_text(reply, **kwargs):
+        replies.append(reply)
+
+    user = SimpleNamespace(id=user_id, username=f"student_{user_id}", first_name="Студент")
+    message = SimpleNamespace(text=text, reply_text=reply_text, chat=SimpleNamespace(id=user_id))
+    return SimpleNamespace(
+        effective_user=user,
+        effective_chat=SimpleNamespace(id=user_id),
+        message=message,
+    )
+
+
+def _sheets_faults(args) -> FaultInjector:
+    return FaultInjector(
+        latency=args.sheets_latency,
+        error_rate=args.sheets_error_rate,
+        rate_limit_rate=args.sheets_429_rate,
+        seed=args.seed,
+    )
+
+
+def _telegram_faults(args) -> FaultInjector:
+    return FaultInjector(
+        latency=args.telegram_latency,
+        error_rate=args.telegram_error_rate,
+        rate_limit_rate=args.telegram_429_rate,
+        retry_after=1,
+        seed=args.seed,
+    )
+
+
+async def bench_registrations(args) -> dict:
+    """name_input для N пользователей с готовым состоянием диалога, затем дозапись журнала в таблицу"""
+    sheets_faults = _sheets_faults(args)
+    storage = make_google_sheets(schedule=upcoming_schedule_rows(), faults=sheets_faults)
+    async_sheets = AsyncGoogleSheets(storage)
+    journal = RegistrationJournal(path=os.path.join(WORKDIR, f"journal-{time.monotonic_ns()}.db"))
+    journal.initialize(async_sheets)
+    bot.storage, bot.sheets, bot.journal = storage, async_sheets, journal
+
+    slot = upcoming_schedule_rows()[0]
+    context = SimpleNamespace(job_queue=None, bot=FakeBot())
+    latencies = []
+    replies = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def register(user_id: int):
+        state = bot.conversations.start(user_id)
+        state.update({
+            "exam_type": "ОГЭ",
+            "display": f"{slot[0]} {slot[1]}",
+            "day_name": "Суббота",
+            "time": slot[1],
+            "exam_datetime": f"{slot[0]} {slot[1]}",
+            "zoom": slot[2],
+            "contact": slot[3],
+            "teacher": "Василина",
+        })
+        async with semaphore:
+            started = time.perf_counter()
+            await bot.name_input(_message(user_id, f"Студент Номер{user_id}", replies), context)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(register(1000 + index) for index in range(args.registrations)))
+    handler_seconds = time.perf_counter() - started
+
+    # Дозапись журнала: повторяем, пока не уйдут все строки (ошибки таблицы повторяются без паузы)
+    flush_started = time.perf_counter()
+    flush_passes = 0
+    while journal.pending_count() and flush_passes < args.registrations * 10:
+        flush_passes += 1
+        await journal.flush()
+    flush_seconds = time.perf_counter() - flush_started
+    pending = journal.pending_count()
+
+    journal.close()
+    async_sheets.shutdown()
+    return {
+        "registrations": args.registrations,
+        "concurrency": args.concurrency,
+        "handler_seconds": round(handler_seconds, 4),
+        "handler_registrations_per_second": round(args.registrations / handler_seconds, 1),
+        "handler_latency_ms": latency_summary(latencies),
+        "flush_seconds": round(flush_seconds, 4),
+        "flush_rows_per_second": round((args.registrations - pending) / flush_seconds, 1) if flush_seconds else None,
+        "flush_passes": flush_passes,
+        "rows_not_flushed": pending,
+        "sheet_rows": len(storage.worksheet.values) - 1,
+        "sheets_faults": sheets_faults.stats(),
+    }
+
+
+async def bench_reminder_scan(args) -> dict:
+    """get_all_exams_for_reminders и пересборка очереди напоминаний для разных размеров листа"""
+    results = {}
+    for size in args.sizes:
+        storage = make_google_sheets(registration_rows(size, seed=args.seed))
+        async_sheets = AsyncGoogleSheets(storage)
+
+        started = time.perf_counter()
+        exams = storage.get_all_exams_for_reminders()
+        cold_seconds = time.perf_counter() - started
+
+        warm = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            storage.get_all_exams_for_reminders()
+            warm.append(time.perf_counter() - started)
+
+        scheduler = ReminderScheduler()
+        scheduler.initialize(async_sheets, FakeBot(), _FakeJobQueue())
+        await scheduler.start()
+        started = time.perf_counter()
+        scheduled = await scheduler.rebuild()
+        rebuild_seconds = time.perf_counter() - started
+
+        async_sheets.shutdown()
+        results[str(size)] = {
+            "rows": size,
+            "upcoming_exams": len(exams),
+            "cold_scan_seconds": round(cold_seconds, 4),
+            "warm_scan_ms": latency_summary(warm),
+            "rebuild_seconds": round(rebuild_seconds, 4),
+            "scheduled_reminders": scheduled,
+        }
+        print(f"reminder_scan: {size} строк — {cold_seconds:.2f} с")
+    return results
+
+
+async def bench_broadcast(args) -> dict:
+    """/announce_new_exam от администратора до завершения рассылки"""
+    telegram_faults = _telegram_faults(args)
+    storage = make_google_sheets(registration_rows(args.recipients, seed=args.seed))
+    async_sheets = AsyncGoogleSheets(storage)
+    fake_bot = FakeBot(telegram_faults)
+    os.environ["BROADCAST_RATE"] = str(args.broadcast_rate)
+    os.environ["BROADCAST_CONCURRENCY"] = str(args.concurrency)
+    os.environ["ADMIN_TELEGRAM_IDS"] = str(ADMIN_ID)
+    engine = BroadcastEngine(path=os.path.join(WORKDIR, f"broadcasts-{time.monotonic_ns()}.db"))
+    engine.initialize(fake_bot)
+    bot.sheets, bot.broadcasts = async_sheets, engine
+    await bot.leader.renew()
+
+    replies = []
+    started = time.perf_counter()
+    await bot.announce_new_exam(_message(ADMIN_ID, "/announce_new_exam", replies), SimpleNamespace(job_queue=None))
+    while engine.is_running():
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+
+    stats = await asyncio.to_thread(engine.stats, 1)
+    await engine.shutdown()
+    async_sheets.shutdown()
+    return {
+        "recipients": stats.get("total", 0),
+        "rate_limit": args.broadcast_rate,
+        "concurrency": args.concurrency,
+        "seconds": round(elapsed, 4),
+        "messages_per_second": round(stats.get("total", 0) / elapsed, 1) if elapsed else None,
+        "statuses": {key: value for key, value in stats.items() if key != "total"},
+        "telegram_faults": telegram_faults.stats(),
+        "admin_replies": replies,
+    }
+
+
+BENCHMARKS = {
+    "registrations": bench_registrations,
+    "reminder_scan": bench_reminder_scan,
+    "broadcast": bench_broadcast,
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарки бота на заглушках Google Sheets и Telegram")
+    parser.add_argument("--only", default=",".join(BENCHMARKS), help="какие бенчмарки запускать (через запятую)")
+    parser.add_argument("--output", help="файл для результатов JSON")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--registrations", type=int, default=1000, help="число регистраций через name_input")
+    parser.add_argument("--concurrency", type=int, default=50, help="одновременных обработчиков / отправок")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="размеры листа «Записи» для reminder_scan")
+    parser.add_argument("--repeat", type=int, default=5, help="повторов тёплого чтения в reminder_scan")
+    parser.add_argument("--recipients", type=int, default=2000, help="получателей рассылки")
+    parser.add_argument("--broadcast-rate", type=float, default=0, help="BROADCAST_RATE (0 — без ограничения)")
+    parser.add_argument("--sheets-latency", type=float, default=0.05, help="задержка запроса к таблице, с")
+    parser.add_argument("--sheets-error-rate", type=float, default=0.0, help="доля ошибок таблицы")
+    parser.add_argument("--sheets-429-rate", type=float, default=0.0, help="доля ответов 429 от таблицы")
+    parser.add_argument("--telegram-latency", type=float, default=0.03, help="задержка запроса к Telegram, с")
+    parser.add_argument("--telegram-error-rate", type=float, default=0.0, help="доля сетевых ошибок Telegram")
+    parser.add_argument("--telegram-429-rate", type=float, default=0.0, help="доля ответов RetryAfter от Telegram")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+    args.sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    args.only = [name.strip() for name in args.only.split(",") if name.strip()]
+    unknown = set(args.only) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"неизвестные бенчмарки: {', '.join(sorted(unknown))}")
+    return args
+
+
+async def run(args) -> dict:
+    results = {}
+    for name in args.only:
+        started = time.perf_counter()
+        results[name] = await BENCHMARKS[name](args)
+        print(f"{name}: готово за {time.perf_counter() - started:.1f} с")
+    return results
+
+
+def main():
+    args = parse_args()
+    logging.getLogger().setLevel(args.log_level)
+    results = asyncio.run(run(args))
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "log_level")}
+    path = write_results("bench", config, results, args.output)
+    print(f"Результаты: {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,12 @@
+import asyncio
 import logging
 import os
 import random
+import re
+import time
+from datetime import datetime
+
+import pytz
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application,
@@ -10,11 +16,33 @@ from telegram.ext import (
     MessageHandler,
     ContextTypes,
     ConversationHandler,
+    PersistenceInput,
+    PicklePersistence,
     filters,
 )
 from dotenv import load_dotenv
 from sheets import GoogleSheets
+from sqlite_storage import SQLiteStorage, SheetsSync
+from async_sheets import AsyncGoogleSheets
 from scheduler import ReminderScheduler
+from journal import RegistrationJournal
+from broadcast import BroadcastEngine
+from conversation_store import ConversationStore
+from leader import LeaderLease
+from ledger import DeliveryLedger
+from recipients import RecipientIndex
+from seats import SeatCounter
+from snapshot import WarmSnapshot
+from proxy_pool import ProxyPool, ProxyPoolRequest
+from update_processor import ChatOrderedUpdateProcessor
+from metrics import (
+    CONVERSATIONS_ACTIVE,
+    IS_LEADER,
+    PROXY_ADMITTED,
+    SHEETS_QUOTA_HEADROOM,
+    MetricsServer,
+    observe_handler,
+)
 from messages import (
     TEXT_CANCELLED,
     TEXT_CHOOSE_EXAM_TYPE,
@@ -26,6 +54,8 @@ from messages import (
     TEXT_NO_SLOTS,
     TEXT_SAVE_ERROR,
     TEXT_SCHEDULE_LOAD_ERROR,
+    TEXT_SESSION_EXPIRED,
+    TEXT_SLOT_FULL,
     TEXT_SLOT_UNAVAILABLE,
     registration_message_text,
 )
@@ -43,12 +73,64 @@ logger = logging.getLogger(__name__)
 # Состояния диалога
 EXAM_TYPE, EXAM_SLOT, TEACHER, NAME = range(4)
 
-# Инициализация Google Sheets
-sheets = GoogleSheets()
+# Сколько неактивных чатов показывать в /inactive_chats
+INACTIVE_CHATS_SHOWN = 30
+
+# Соединения к Bot API сверх параллельных обновлений, напоминаний и рассылок (проверки прокси, прогресс, админ-команды)
+TELEGRAM_CONNECTION_HEADROOM = 8
+
+# Паузы между попытками подключить хранилище при старте (сек): от первой до максимальной, удваиваясь
+STORAGE_CONNECT_RETRY = 5
+STORAGE_CONNECT_MAX_RETRY = 300
+
+# Хранилище: Google Sheets (по умолчанию) или локальная SQLite-база,
+# которая зеркалируется в Google Sheets для организаторов (если задан GOOGLE_SHEET_ID).
+# Обработчики работают с хранилищем через асинхронный фасад
+google_sheets = GoogleSheets()
+if os.getenv("STORAGE_BACKEND", "sheets").strip().lower() == "sqlite":
+    storage = SQLiteStorage()
+    sheets_sync = SheetsSync(storage, google_sheets) if google_sheets.sheet_id else None
+else:
+    storage = google_sheets
+    sheets_sync = None
+# Снимок расписания и предстоящих записей: бот стартует по нему, не дожидаясь хранилища
+warm_snapshot = WarmSnapshot()
+sheets = AsyncGoogleSheets(storage, snapshot=warm_snapshot)
 scheduler = ReminderScheduler()
-
-# Данные пользователей (временное хранилище)
-user_data = {}
+# Журнал доставки напоминаний: защищает от повторной отправки при сбоях записи флагов в таблицу
+reminder_ledger = DeliveryLedger()
+# Регистрации сначала пишутся в локальный журнал, в таблицу — в фоне
+journal = RegistrationJournal()
+# Массовые рассылки идут в фоне и переживают перезапуск
+broadcasts = BroadcastEngine()
+# Получатели рассылок: пополняется при регистрации, заблокировавшие бота пропускаются
+recipients = RecipientIndex()
+# Занятые места в слотах с ограниченной вместимостью (колонка «Мест» листа "Даты экзаменов")
+seats = SeatCounter()
+
+# Пул прокси Telegram API (настраивается в main(), если задан TELEGRAM_PROXY_POOL_*)
+proxy_pool = ProxyPool()
+
+# Обновления разных пользователей обрабатываются параллельно, одного пользователя — по очереди
+update_processor = ChatOrderedUpdateProcessor()
+
+# При нескольких экземплярах бота напоминания, рассылки и синхронизацию ведёт только лидер
+leader = LeaderLease()
+
+# Незавершённые диалоги записи (с TTL, лимитом и необязательным сохранением на диск)
+conversations = ConversationStore()
+
+# Метрики в формате Prometheus на METRICS_PORT (если задан)
+metrics_server = MetricsServer()
+
+# Фоновые задачи запуска (подключение хранилища): отменяются при остановке бота
+background_tasks = set()
+CONVERSATIONS_ACTIVE.set_function(lambda: len(conversations))
+IS_LEADER.set_function(lambda: int(leader.is_leader))
+PROXY_ADMITTED.set_function(lambda: {(stat["label"],): int(stat["admitted"]) for stat in proxy_pool.stats()})
+SHEETS_QUOTA_HEADROOM.set_function(
+    lambda: {(kind,): info["available"] for kind, info in google_sheets.governor.headroom().items()}
+)
 
 
 def get_exam_type_reply_markup() -> InlineKeyboardMarkup:
@@ -81,18 +163,18 @@ def get_admin_ids() -> set[int]:
     return admin_ids
 
 
-def build_proxy_url() -> str | None:
+def build_proxy_urls() -> list:
     """
-    Возвращает URL прокси:
-    1) TELEGRAM_PROXY_URL, если задан явно;
-    2) иначе собирает из настроек пула.
+    Возвращает список URL прокси:
+    1) [TELEGRAM_PROXY_URL], если задан явно;
+    2) иначе TELEGRAM_PROXY_POOL_SIZE случайных портов пула (ими управляет ProxyPool).
     """
     proxy_scheme = os.getenv("TELEGRAM_PROXY_SCHEME", "socks5").strip() or "socks5"
     direct_proxy_url = os.getenv("TELEGRAM_PROXY_URL", "").strip()
     if direct_proxy_url:
         if "://" not in direct_proxy_url:
-            return f"{proxy_scheme}://{direct_proxy_url}"
-        return direct_proxy_url
+            return [f"{proxy_scheme}://{direct_proxy_url}"]
+        return [direct_proxy_url]
 
     pool_login = os.getenv("TELEGRAM_PROXY_POOL_LOGIN", "").strip()
     pool_password = os.getenv("TELEGRAM_PROXY_POOL_PASSWORD", "").strip()
@@ -101,7 +183,7 @@ def build_proxy_url() -> str | None:
     port_end_raw = os.getenv("TELEGRAM_PROXY_POOL_PORT_END", "").strip()
 
     if not all([pool_login, pool_password, pool_host, port_start_raw, port_end_raw]):
-        return None
+        return []
 
     try:
         port_start = int(port_start_raw)
@@ -112,8 +194,57 @@ def build_proxy_url() -> str | None:
     if port_start > port_end:
         raise ValueError("TELEGRAM_PROXY_POOL_PORT_START не может быть больше PORT_END")
 
-    selected_port = random.randint(port_start, port_end)
-    return f"{proxy_scheme}://{pool_login}:{pool_password}@{pool_host}:{selected_port}"
+    ports = range(port_start, port_end + 1)
+    selected_ports = random.sample(ports, min(proxy_pool.size, len(ports)))
+    return [f"{proxy_scheme}://{pool_login}:{pool_password}@{pool_host}:{port}" for port in selected_ports]
+
+
+def telegram_connection_pool_size() -> int:
+    """
+    Размер пула HTTP-соединений к Bot API: TELEGRAM_CONNECTION_POOL_SIZE или
+    по соединению на каждое параллельное обновление, напоминание и сообщение рассылки плюс запас
+    """
+    configured = os.getenv("TELEGRAM_CONNECTION_POOL_SIZE", "").strip()
+    if configured:
+        return max(1, int(configured))
+    return (
+        update_processor.max_concurrent_updates
+        + scheduler.concurrency
+        + broadcasts.concurrency
+        + TELEGRAM_CONNECTION_HEADROOM
+    )
+
+
+def build_webhook_settings() -> dict:
+    """
+    Параметры application.run_webhook из переменных окружения:
+    WEBHOOK_URL — публичный адрес (https), WEBHOOK_LISTEN/WEBHOOK_PORT/WEBHOOK_PATH — где слушает встроенный сервер,
+    WEBHOOK_SECRET_TOKEN — секрет, который Telegram присылает в заголовке X-Telegram-Bot-Api-Secret-Token.
+    """
+    webhook_url = os.getenv("WEBHOOK_URL", "").strip()
+    if not webhook_url:
+        raise ValueError("WEBHOOK_URL не установлен (обязателен при BOT_MODE=webhook)")
+
+    try:
+        port = int(os.getenv("WEBHOOK_PORT", "8080"))
+        max_connections = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+    except ValueError as exc:
+        raise ValueError("WEBHOOK_PORT и WEBHOOK_MAX_CONNECTIONS должны быть числами") from exc
+
+    secret_token = os.getenv("WEBHOOK_SECRET_TOKEN", "").strip() or None
+    if secret_token and not re.fullmatch(r"[A-Za-z0-9_-]{1,256}", secret_token):
+        raise ValueError("WEBHOOK_SECRET_TOKEN: допустимы 1-256 символов A-Z, a-z, 0-9, _ и -")
+    if not secret_token:
+        logger.warning("WEBHOOK_SECRET_TOKEN не задан — запросы к webhook не проверяются")
+
+    return {
+        "listen": os.getenv("WEBHOOK_LISTEN", "0.0.0.0").strip() or "0.0.0.0",
+        "port": port,
+        "url_path": os.getenv("WEBHOOK_PATH", "telegram").strip().strip("/"),
+        "webhook_url": webhook_url,
+        "secret_token": secret_token,
+        "max_connections": max_connections,
+    }
 
 
 async def send_exam_type_choice_message(
@@ -123,7 +254,7 @@ async def send_exam_type_choice_message(
     query=None,
 ) -> int:
     """Общий вход в сценарий записи: выбор типа экзамена"""
-    user_data[user_id] = {}
+    conversations.start(user_id)
     reply_markup = get_exam_type_reply_markup()
 
     if query is not None:
@@ -136,12 +267,14 @@ async def send_exam_type_choice_message(
     return EXAM_TYPE
 
 
+@observe_handler
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Начало диалога - выбор типа экзамена"""
     user_id = update.effective_user.id
     return await send_exam_type_choice_message(user_id=user_id, message=update.message)
 
 
+@observe_handler
 async def register_button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Запуск записи по inline-кнопке без /start"""
     query = update.callback_query
@@ -150,6 +283,7 @@ async def register_button_callback(update: Update, context: ContextTypes.DEFAULT
     return await send_exam_type_choice_message(user_id=user_id, query=query)
 
 
+@observe_handler
 async def announce_new_exam(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Админ-команда для массового уведомления о новой записи"""
     user_id = update.effective_user.id
@@ -160,7 +294,10 @@ async def announce_new_exam(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return
 
     try:
-        recipient_ids = sheets.get_unique_telegram_ids()
+        if not await asyncio.to_thread(recipients.count):
+            # Первая рассылка: индекс получателей заполняется из истории записей
+            await recipients.merge(await sheets.get_unique_telegram_ids())
+        recipient_ids = await asyncio.to_thread(recipients.active_ids)
     except Exception as e:
         logger.error(f"Ошибка при получении получателей для рассылки: {e}", exc_info=True)
         await update.message.reply_text("Не удалось получить список получателей из таблицы.")
@@ -170,49 +307,123 @@ async def announce_new_exam(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("В истории записей пока нет получателей для рассылки.")
         return
 
-    success_count = 0
-    failed_count = 0
-    reply_markup = get_register_button_reply_markup()
-
-    for recipient_id in recipient_ids:
-        try:
-            await context.bot.send_message(
-                chat_id=recipient_id,
-                text=TEXT_NEW_EXAM_ANNOUNCEMENT,
-                reply_markup=reply_markup,
-            )
-            success_count += 1
-        except Exception as e:
-            failed_count += 1
-            logger.warning(f"Не удалось отправить уведомление пользователю {recipient_id}: {e}")
+    if await broadcasts.has_unfinished():
+        await update.message.reply_text("Предыдущая рассылка ещё не завершена.")
+        return
 
-    await update.message.reply_text(
-        "Рассылка завершена.\n"
-        f"Успешно: {success_count}\n"
-        f"С ошибкой: {failed_count}"
+    # Рассылка идёт в фоне, прогресс обновляется в отдельном сообщении.
+    # На экземпляре-не-лидере рассылка только сохраняется, отправку подхватит лидер
+    await broadcasts.start(
+        update.effective_chat.id, TEXT_NEW_EXAM_ANNOUNCEMENT, recipient_ids, launch=leader.is_leader
     )
 
 
-async def exam_type_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Обработка выбора типа экзамена"""
-    query = update.callback_query
-    await query.answer()
-    
-    user_id = query.from_user.id
-    exam_type = query.data.replace("exam_", "")
-    
-    # Маппинг для читаемости
-    exam_types = {
-        "oge": "ОГЭ",
-        "ege_prof": "ЕГЭ Проф",
-        "ege_base": "ЕГЭ База"
-    }
-    
-    user_data[user_id]["exam_type"] = exam_types.get(exam_type, exam_type)
-    
-    # Получаем доступные слоты из таблицы
+@observe_handler
+async def inactive_chats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Админ-команда: чаты, исключённые из рассылок (бот заблокирован или чат не найден)"""
+    if update.effective_user.id not in get_admin_ids():
+        await update.message.reply_text("У вас нет доступа к этой команде.")
+        return
+
+    rows = await asyncio.to_thread(recipients.inactive)
+    if not rows:
+        await update.message.reply_text("Неактивных получателей нет.")
+        return
+
+    lines = [f"Неактивных получателей: {len(rows)}"]
+    for chat_id, inactive_at, reason in rows[:INACTIVE_CHATS_SHOWN]:
+        marked_at = datetime.fromtimestamp(inactive_at, pytz.UTC).astimezone(storage.timezone).strftime("%d.%m.%Y %H:%M")
+        lines.append(f"{chat_id} — {marked_at}: {reason}")
+    if len(rows) > INACTIVE_CHATS_SHOWN:
+        lines.append(f"… и ещё {len(rows) - INACTIVE_CHATS_SHOWN}")
+    lines.append("Вернуть в рассылки: /reset_inactive_chats (все) или /reset_inactive_chats <id> ...")
+    await update.message.reply_text("\n".join(lines))
+
+
+@observe_handler
+async def reset_inactive_chats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Админ-команда: вернуть в рассылки все неактивные чаты или перечисленные через пробел"""
+    if update.effective_user.id not in get_admin_ids():
+        await update.message.reply_text("У вас нет доступа к этой команде.")
+        return
+
     try:
-        slots = sheets.get_exam_slots()
+        chat_ids = [int(arg) for arg in context.args] if context.args else None
+    except ValueError:
+        await update.message.reply_text("Укажите Telegram ID числами через пробел.")
+        return
+
+    count = await recipients.reset_inactive(chat_ids)
+    await update.message.reply_text(f"Возвращено в рассылки: {count}")
+
+
+@observe_handler
+async def sheets_quota(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Админ-команда: остаток квоты Google Sheets API и очередь ожидающих запросов"""
+    if update.effective_user.id not in get_admin_ids():
+        await update.message.reply_text("У вас нет доступа к этой команде.")
+        return
+
+    names = {"read": "Чтение", "write": "Запись"}
+    lines = ["Квота Google Sheets API:"]
+    for kind, info in google_sheets.governor.headroom().items():
+        line = f"{names.get(kind, kind)}: {info['available']:.0f} из {info['capacity']:.0f} в минуту, ждут {info['waiting']}"
+        if info["paused_for"] > 0:
+            line += f", пауза после 429 ещё {info['paused_for']:.0f} с"
+        lines.append(line)
+    await update.message.reply_text("\n".join(lines))
+
+
+@observe_handler
+async def proxy_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Админ-команда: задержки и ошибки прокси пула"""
+    if update.effective_user.id not in get_admin_ids():
+        await update.message.reply_text("У вас нет доступа к этой команде.")
+        return
+
+    stats = proxy_pool.stats()
+    if not stats:
+        await update.message.reply_text("Пул прокси не используется.")
+        return
+
+    def ms(value):
+        return f"{value * 1000:.0f}" if value is not None else "—"
+
+    lines = ["Прокси: задержка p50/p95, мс; запросов; ошибок"]
+    for stat in stats:
+        status = "в работе" if stat["admitted"] else f"исключён ещё {stat['ejected_for']:.0f} с"
+        lines.append(
+            f"{stat['label']} — {status}: {ms(stat['p50'])}/{ms(stat['p95'])}; "
+            f"{stat['requests']}; {stat['failures']}"
+        )
+        if stat["last_error"] and not stat["admitted"]:
+            lines.append(f"  последняя ошибка: {stat['last_error']}")
+    await update.message.reply_text("\n".join(lines))
+
+
+@observe_handler
+async def refresh_slots(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Админ-команда: сбросить кэш расписания после правки листа «Даты экзаменов»"""
+    if update.effective_user.id not in get_admin_ids():
+        await update.message.reply_text("У вас нет доступа к этой команде.")
+        return
+
+    sheets.invalidate_slots()
+    await seats.rebuild()
+    try:
+        slots = await sheets.get_exam_slots()
+    except Exception as e:
+        logger.error(f"Ошибка при обновлении расписания: {e}", exc_info=True)
+        await update.message.reply_text("Кэш сброшен, но загрузить расписание не удалось.")
+        return
+
+    await update.message.reply_text(f"Расписание обновлено. Доступных слотов: {len(slots)}")
+
+
+async def show_slots(query, text: str) -> int:
+    """Показать свободные слоты кнопками; в callback_data — дата и время слота, а не его номер в расписании"""
+    try:
+        slots = await sheets.get_exam_slots()
     except Exception as e:
         logger.error(f"Ошибка получения слотов: {e}")
         await query.edit_message_text(
@@ -220,6 +431,11 @@ async def exam_type_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
         return ConversationHandler.END
     
+    # Заполненные слоты не показываем
+    if any(slot["capacity"] is not None for slot in slots):
+        await seats.ensure_loaded()
+        slots = [slot for slot in slots if seats.has_room(slot)]
+    
     if not slots:
         await query.edit_message_text(
             TEXT_NO_SLOTS
@@ -227,42 +443,86 @@ async def exam_type_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return ConversationHandler.END
     
     keyboard = [
-        [InlineKeyboardButton(slot["display"], callback_data=f"slot_{slot['index']}")]
+        [InlineKeyboardButton(slot["display"], callback_data=f"slot_{slot['datetime_str']}")]
         for slot in slots
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    user_data[user_id]["_slots"] = slots
-    
     await query.edit_message_text(
-        TEXT_CHOOSE_SLOT,
+        text,
         reply_markup=reply_markup
     )
     
     return EXAM_SLOT
 
 
+@observe_handler
+async def exam_type_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Обработка выбора типа экзамена"""
+    query = update.callback_query
+    await query.answer()
+    
+    user_id = query.from_user.id
+    exam_type = query.data.replace("exam_", "")
+    
+    # Маппинг для читаемости
+    exam_types = {
+        "oge": "ОГЭ",
+        "ege_prof": "ЕГЭ Проф",
+        "ege_base": "ЕГЭ База"
+    }
+    
+    state = conversations.get(user_id)
+    if state is None:
+        await query.edit_message_text(TEXT_SESSION_EXPIRED)
+        return ConversationHandler.END
+    
+    state["exam_type"] = exam_types.get(exam_type, exam_type)
+    
+    return await show_slots(query, TEXT_CHOOSE_SLOT)
+
+
+@observe_handler
 async def slot_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обработка выбора слота (дата и время)"""
     query = update.callback_query
     await query.answer()
     
     user_id = query.from_user.id
-    slot_index = int(query.data.replace("slot_", ""))
+    slot_key = query.data.replace("slot_", "", 1)
     
-    slots = user_data[user_id].get("_slots", [])
-    slot = next((s for s in slots if s["index"] == slot_index), None)
+    state = conversations.get(user_id)
+    if state is None:
+        await query.edit_message_text(TEXT_SESSION_EXPIRED)
+        return ConversationHandler.END
+    
+    # Слот ищем по дате и времени в общем (кэшированном) расписании: номер строки после
+    # обновления расписания мог достаться другому слоту, копия списка в диалоге не хранится
+    try:
+        slots = await sheets.get_exam_slots()
+    except Exception as e:
+        logger.error(f"Ошибка получения слотов: {e}")
+        await query.edit_message_text(TEXT_SCHEDULE_LOAD_ERROR)
+        return ConversationHandler.END
+    slot = next((s for s in slots if s["datetime_str"] == slot_key), None)
     
     if not slot:
-        await query.edit_message_text(TEXT_SLOT_UNAVAILABLE)
+        # Слота больше нет (или кнопка из старой версии бота) — предлагаем выбрать заново
+        return await show_slots(query, TEXT_SLOT_UNAVAILABLE)
+    
+    # После перезапуска диалог продолжается раньше, чем построены счётчики мест: дожидаемся их.
+    # Если построить не удалось, свободно ли место — неизвестно; его проверит резервирование при сохранении записи
+    if slot["capacity"] is not None and await seats.ensure_loaded() and not seats.has_room(slot):
+        await query.edit_message_text(TEXT_SLOT_FULL)
         return ConversationHandler.END
     
-    user_data[user_id]["slot"] = slot
-    user_data[user_id]["day_name"] = slot["day_name"]
-    user_data[user_id]["time"] = slot["time"]
-    user_data[user_id]["exam_datetime"] = slot["datetime_str"]
-    user_data[user_id]["zoom"] = slot["zoom"]
-    user_data[user_id]["contact"] = slot["contact"]
+    state["display"] = slot["display"]
+    state["day_name"] = slot["day_name"]
+    state["time"] = slot["time"]
+    state["exam_datetime"] = slot["datetime_str"]
+    state["zoom"] = slot["zoom"]
+    state["contact"] = slot["contact"]
+    state["capacity"] = slot["capacity"]
     
     keyboard = [
         [InlineKeyboardButton("Анастасия", callback_data="teacher_anastasia")],
@@ -278,6 +538,7 @@ async def slot_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     return TEACHER
 
 
+@observe_handler
 async def teacher_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обработка выбора преподавателя"""
     query = update.callback_query
@@ -292,7 +553,12 @@ async def teacher_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         "vasilina": "Василина"
     }
     
-    user_data[user_id]["teacher"] = teachers.get(teacher, teacher)
+    state = conversations.get(user_id)
+    if state is None:
+        await query.edit_message_text(TEXT_SESSION_EXPIRED)
+        return ConversationHandler.END
+    
+    state["teacher"] = teachers.get(teacher, teacher)
     
     await query.edit_message_text(
         TEXT_ENTER_FULL_NAME
@@ -301,6 +567,7 @@ async def teacher_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     return NAME
 
 
+@observe_handler
 async def name_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обработка ввода имени и фамилии"""
     user_id = update.effective_user.id
@@ -312,29 +579,54 @@ async def name_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         )
         return NAME
     
-    user_data[user_id]["full_name"] = full_name
-    user_data[user_id]["telegram_id"] = user_id
-    user_data[user_id]["telegram_username"] = update.effective_user.username or ""
+    state = conversations.get(user_id)
+    if state is None:
+        await update.message.reply_text(TEXT_SESSION_EXPIRED)
+        return ConversationHandler.END
+    
+    state["full_name"] = full_name
+    state["telegram_id"] = user_id
+    state["telegram_username"] = update.effective_user.username or ""
     
-    # Дата и время берутся из выбранного слота (уже сохранены в user_data)
+    # Дата и время берутся из выбранного слота (уже сохранены в состоянии диалога)
     
-    # Сохраняем в Google Sheets
+    # Место занимается до записи в журнал: проверка и бронь выполняются без переключения задач,
+    # поэтому одновременные регистрации не переполнят слот
+    slot_key = state.get("exam_datetime", "")
+    if state.get("capacity") is not None:
+        await seats.ensure_loaded()
+    if not seats.reserve(slot_key, state.get("capacity")):
+        conversations.pop(user_id)
+        await update.message.reply_text(TEXT_SLOT_FULL)
+        return ConversationHandler.END
+    
+    # Фиксируем запись в локальном журнале; в Google Sheets она уйдёт в фоне
     try:
-        sheets.save_registration(user_data[user_id])
-        logger.info(f"Данные пользователя {user_id} сохранены в Google Sheets")
+        row = storage.build_registration_row(state)
+        await journal.append(row)
+        logger.info(f"Данные пользователя {user_id} записаны в журнал регистраций")
     except Exception as e:
-        logger.error(f"Ошибка при сохранении в Google Sheets: {e}")
+        seats.release(slot_key)
+        logger.error(f"Ошибка при сохранении в журнал регистраций: {e}")
         await update.message.reply_text(
             TEXT_SAVE_ERROR
         )
         return ConversationHandler.END
     
+    # Получатель рассылок; если не получилось — его добавит сверка с таблицей
+    try:
+        await recipients.add(user_id)
+    except Exception as e:
+        logger.error(f"Ошибка обновления индекса получателей рассылок: {e}")
+    
+    if context.job_queue:
+        context.job_queue.run_once(journal.flush, 0, name="flush_registrations_now")
+    
     # Формируем сообщение после регистрации
-    slot = user_data[user_id].get("slot", {})
-    date_str = slot.get("display", user_data[user_id].get("exam_datetime", ""))
-    zoom_link = user_data[user_id].get("zoom", "https://us06web.zoom.us/j/9709286191")
-    contact = user_data[user_id].get("contact", "@vasilina45")
-    day_name = user_data[user_id].get("day_name", "")
+    date_str = state.get("display", state.get("exam_datetime", ""))
+    zoom_link = state.get("zoom", "https://us06web.zoom.us/j/9709286191")
+    contact = state.get("contact", "@vasilina45")
+    day_name = state.get("day_name", "")
 
     registration_message = registration_message_text(
         date_str=date_str,
@@ -352,39 +644,274 @@ async def name_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     )
 
     # Очищаем временные данные
-    del user_data[user_id]
+    conversations.pop(user_id)
 
     return ConversationHandler.END
 
 
+def schedule_flushed_registration(row_number: int, row: list) -> None:
+    """Поставить напоминания для регистрации, которая только что попала в таблицу"""
+    exam = storage.exam_from_row(row_number, row)
+    if exam is not None:
+        scheduler.schedule_exam(exam)
+
+
+@observe_handler
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Отмена диалога"""
     user_id = update.effective_user.id
-    if user_id in user_data:
-        del user_data[user_id]
+    conversations.pop(user_id)
     
     await update.message.reply_text(TEXT_CANCELLED)
     return ConversationHandler.END
 
 
-def main():
-    """Запуск бота"""
-    token = os.getenv("TELEGRAM_BOT_TOKEN")
-    if not token:
-        raise ValueError("TELEGRAM_BOT_TOKEN не установлен в переменных окружения")
+async def sync_recipients(context=None) -> None:
+    """Добавить в индекс получателей Telegram ID из истории записей (ручные правки, другие экземпляры)"""
+    try:
+        await recipients.merge(await sheets.get_unique_telegram_ids())
+    except Exception as e:
+        logger.error(f"Ошибка сверки получателей рассылок с таблицей: {e}")
 
-    # Прокси для регионов с ограниченным доступом к Telegram API
-    proxy_url = build_proxy_url()
-    if not proxy_url:
-        logger.warning(
-            "Прокси не задан. Укажите TELEGRAM_PROXY_URL или параметры TELEGRAM_PROXY_POOL_*"
+
+async def archive_registrations(context) -> None:
+    """Перенос записей на давно прошедшие экзамены из листа "Записи" в архивные листы (задача лидера)"""
+    cutoff = datetime.now(pytz.UTC) - google_sheets.archive_after
+    # Чтение листа и копирование в архив строки не сдвигают и идут без row_lock, квота — тоже до него
+    await sheets.wait_for_quota()
+    try:
+        archived = await sheets.archive_registrations(cutoff)
+    except Exception as e:
+        logger.error(f"Ошибка копирования записей в архив: {e}", exc_info=True)
+        return
+    if not archived:
+        return
+
+    # Пока строки удаляются, напоминания и дозапись журнала ждут: номера строк сдвигаются.
+    # Удаление не прерывается по таймауту, поэтому row_lock держится, пока оно действительно не закончится
+    async with sheets.row_lock:
+        try:
+            deleted_rows = await sheets.delete_archived_rows(archived)
+        except asyncio.CancelledError:
+            # Остановка бота: строки удалены, но очередь не пересчитана — при старте она строится заново
+            scheduler.clear()
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка удаления перенесённых в архив записей: {e}", exc_info=True)
+            # Неизвестно, успели ли строки удалиться: очередь напоминаний строится заново по таблице
+            scheduler.clear()
+            context.job_queue.run_once(scheduler.rebuild, 0, name="rebuild_reminders_now")
+            return
+        if deleted_rows:
+            scheduler.renumber_rows(deleted_rows)
+
+
+async def start_leader_jobs(job_queue) -> None:
+    """Экземпляр стал лидером: запускаем напоминания, рассылки и синхронизацию с таблицей"""
+    await scheduler.start()
+    # Очередь напоминаний строится сразу (с досылкой пропущенных)
+    # и периодически пересобирается, чтобы учесть ручные правки таблицы
+    job_queue.run_repeating(
+        scheduler.rebuild,
+        interval=scheduler.resync_interval,
+        first=10,  # Начинаем через 10 секунд после получения лидерства
+        name="rebuild_reminders"
+    )
+    # Прерванные рассылки и рассылки, созданные на других экземплярах
+    job_queue.run_repeating(
+        broadcasts.resume,
+        interval=broadcasts.resume_interval,
+        first=0,
+        name="resume_broadcasts"
+    )
+    if sheets_sync:
+        job_queue.run_repeating(
+            sheets_sync.sync,
+            interval=sheets_sync.interval,
+            first=5,
+            name="sheets_sync"
+        )
+    # Архив ведётся только в листе "Записи" основного хранилища Google Sheets
+    if storage is google_sheets and google_sheets.archive_after.total_seconds() > 0:
+        job_queue.run_repeating(
+            archive_registrations,
+            interval=google_sheets.archive_interval,
+            first=60,
+            name="archive_registrations"
         )
+    logger.info(
+        f"Планировщик напоминаний настроен (пересборка каждые {scheduler.resync_interval} с)"
+    )
 
-    # Создаем приложение
-    app_builder = ApplicationBuilder().token(token)
-    if proxy_url:
-        app_builder = app_builder.proxy(proxy_url).get_updates_proxy(proxy_url)
-    application = app_builder.build()
+
+async def stop_leader_jobs(job_queue) -> None:
+    """Экземпляр потерял лидерство: задачи лидера снимаются, их подхватит новый лидер"""
+    for name in ("rebuild_reminders", "resume_broadcasts", "sheets_sync", "archive_registrations"):
+        for job in job_queue.get_jobs_by_name(name):
+            job.schedule_removal()
+    scheduler.stop()
+    await broadcasts.stop()
+
+
+async def _connect_with_retry(name: str, connect) -> None:
+    """Вызывать connect(), пока не получится, с растущей паузой между попытками"""
+    delay = STORAGE_CONNECT_RETRY
+    while True:
+        try:
+            await connect()
+            return
+        except Exception as e:
+            logger.error(f"Не удалось подключить {name}, повтор через {delay} с: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, STORAGE_CONNECT_MAX_RETRY)
+
+
+async def connect_storage() -> None:
+    """
+    Подключение хранилища в фоне (авторизация и поиск листов Google Sheets могут занимать секунды).
+    До подключения слоты и напоминания обслуживаются из снимка, после — сверяются с хранилищем
+    """
+    started = time.monotonic()
+    await _connect_with_retry("хранилище", sheets.initialize)
+    logger.info(f"Хранилище инициализировано за {time.monotonic() - started:.1f} с: {type(storage).__name__}")
+    # Пока работали по снимку, дозапись журнала падала и копила паузу до REGISTRATIONS_FLUSH_MAX_BACKOFF
+    journal.reset_backoff()
+
+    # Очередь напоминаний могла быть построена по номерам строк из снимка: строим её заново по хранилищу
+    async with sheets.row_lock:
+        sheets.end_warm_start()
+        scheduler.clear()
+    await scheduler.rebuild()
+    await seats.rebuild()
+
+    # Google Sheets как зеркало SQLite-хранилища — необязательно для работы бота
+    if sheets_sync:
+        await _connect_with_retry("зеркало в Google Sheets", lambda: asyncio.to_thread(google_sheets.initialize))
+
+
+def _on_background_task_done(task: asyncio.Task) -> None:
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Фоновая задача {task.get_name()} завершилась с ошибкой", exc_info=task.exception())
+
+
+async def post_init(app: Application) -> None:
+    """Инициализация scheduler после запуска бота"""
+    try:
+        job_queue = app.job_queue
+        if await sheets.load_snapshot():
+            logger.info("Бот работает по снимку, пока хранилище подключается")
+        task = asyncio.create_task(connect_storage(), name="connect_storage")
+        background_tasks.add(task)
+        task.add_done_callback(_on_background_task_done)
+        scheduler.initialize(sheets, app.bot, job_queue, ledger=reminder_ledger, lease=leader)
+        journal.initialize(sheets, on_flushed=schedule_flushed_registration)
+        seats.initialize(sheets, journal)
+        conversations.load()
+        broadcasts.initialize(
+            app.bot, reply_markup=get_register_button_reply_markup(), recipients=recipients, lease=leader
+        )
+        await metrics_server.start()
+        if job_queue:
+            # Проверка задержки прокси пула и возврат исключённых (у каждого экземпляра свой пул)
+            if isinstance(app.bot.request, ProxyPoolRequest) and proxy_pool.probe_interval > 0:
+                job_queue.run_repeating(
+                    app.bot.request.probe,
+                    interval=proxy_pool.probe_interval,
+                    first=0,
+                    name="probe_proxies"
+                )
+            # Снимок пишется каждым экземпляром: при следующем старте бот поднимется без хранилища
+            job_queue.run_repeating(
+                warm_snapshot.save,
+                interval=warm_snapshot.save_interval,
+                first=warm_snapshot.save_interval,
+                name="save_snapshot"
+            )
+            # Очистка брошенных диалогов и их сохранение на диск
+            job_queue.run_repeating(
+                conversations.persist,
+                interval=conversations.persist_interval,
+                first=conversations.persist_interval,
+                name="persist_conversations"
+            )
+            # Фоновая дозапись журнала регистраций (в том числе оставшихся с прошлого запуска).
+            # Журнал локальный, поэтому его дозаписывает каждый экземпляр
+            job_queue.run_repeating(
+                journal.flush,
+                interval=journal.flush_interval,
+                first=1,
+                name="flush_registrations"
+            )
+            # Занятые места считает каждый экземпляр: брони других экземпляров появятся после пересчёта
+            job_queue.run_repeating(
+                seats.rebuild,
+                interval=seats.resync_interval,
+                first=0,
+                name="rebuild_seats"
+            )
+            # Индекс получателей локальный, поэтому его сверяет с таблицей каждый экземпляр
+            job_queue.run_repeating(
+                sync_recipients,
+                interval=recipients.sync_interval,
+                first=30,
+                name="sync_recipients"
+            )
+            # Задачи лидера запускаются при получении аренды и снимаются при её потере
+            leader.initialize(
+                on_acquired=lambda: start_leader_jobs(job_queue),
+                on_lost=lambda: stop_leader_jobs(job_queue),
+            )
+            job_queue.run_repeating(
+                leader.renew,
+                interval=leader.renew_interval,
+                first=0,
+                name="leader_lease"
+            )
+        else:
+            logger.error(
+                "JobQueue недоступен — напоминания не будут отправляться. "
+                "Установите зависимости: pip install \"python-telegram-bot[job-queue]\""
+            )
+    except Exception as e:
+        logger.error(f"Ошибка при инициализации напоминаний: {e}", exc_info=True)
+
+
+async def post_shutdown(app: Application) -> None:
+    """Остановка рассылок, последняя попытка дозаписать журнал и остановка пула потоков Google Sheets"""
+    # Подключение хранилища могло ещё не закончиться: без отмены оно продолжилось бы после остановки
+    for task in list(background_tasks):
+        task.cancel()
+    await asyncio.gather(*list(background_tasks), return_exceptions=True)
+    scheduler.stop()
+    await broadcasts.shutdown()
+    # Аренда освобождается после остановки рассылок, чтобы другой экземпляр не начал их раньше
+    await leader.release()
+    await conversations.persist()
+    await warm_snapshot.save()
+    await journal.flush()
+    journal.close()
+    reminder_ledger.close()
+    recipients.close()
+    await metrics_server.stop()
+    sheets.shutdown()
+
+
+def build_application(app_builder: ApplicationBuilder) -> Application:
+    """
+    Приложение с обработчиками диалога и фоновыми задачами.
+    app_builder — ApplicationBuilder с токеном и сетевыми настройками (прокси, свой BaseRequest в нагрузочном тесте)
+    """
+    # Состояния ConversationHandler сохраняются рядом с диалогами, чтобы запись переживала перезапуск
+    if conversations.path:
+        app_builder = app_builder.persistence(
+            PicklePersistence(
+                filepath=f"{conversations.path}.states",
+                store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=False, callback_data=False),
+                update_interval=conversations.persist_interval,
+            )
+        )
+    application = app_builder.concurrent_updates(update_processor).build()
     
     # Создаем ConversationHandler для диалога
     conv_handler = ConversationHandler(
@@ -399,51 +926,75 @@ def main():
             NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, name_input)],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        # Брошенный диалог завершается одновременно с удалением его состояния
+        conversation_timeout=conversations.ttl,
+        name="registration",
+        persistent=bool(conversations.path),
     )
     
     # Добавляем обработчики
     application.add_handler(conv_handler)
     application.add_handler(CommandHandler("announce_new_exam", announce_new_exam))
-    
-    # Инициализируем Google Sheets
-    try:
-        sheets.initialize()
-        logger.info("Google Sheets инициализирован")
-    except Exception as e:
-        logger.error(f"Ошибка инициализации Google Sheets: {e}")
-    
-    # Функция для инициализации напоминаний после запуска бота
-    async def post_init(app: Application) -> None:
-        """Инициализация scheduler после запуска бота"""
-        try:
-            scheduler.initialize(sheets, app.bot)
-            # Настраиваем периодическую проверку напоминаний каждую минуту
-            job_queue = app.job_queue
-            if job_queue:
-                # Создаем обертку-функцию для job_queue
-                async def check_reminders_callback(context: ContextTypes.DEFAULT_TYPE):
-                    await scheduler.check_and_send_reminders(context)
-                
-                job_queue.run_repeating(
-                    check_reminders_callback,
-                    interval=60,  # Каждую минуту
-                    first=10,  # Начинаем через 10 секунд после запуска
-                    name="check_reminders"
-                )
-                logger.info("Периодическая проверка напоминаний настроена (каждую минуту)")
-            else:
-                logger.error(
-                    "JobQueue недоступен — напоминания не будут отправляться. "
-                    "Установите зависимости: pip install \"python-telegram-bot[job-queue]\""
-                )
-        except Exception as e:
-            logger.error(f"Ошибка при инициализации напоминаний: {e}", exc_info=True)
-    
+    application.add_handler(CommandHandler("refresh_slots", refresh_slots))
+    application.add_handler(CommandHandler("sheets_quota", sheets_quota))
+    application.add_handler(CommandHandler("proxy_stats", proxy_stats))
+    application.add_handler(CommandHandler("inactive_chats", inactive_chats))
+    application.add_handler(CommandHandler("reset_inactive_chats", reset_inactive_chats))
+
     application.post_init = post_init
-    
-    # Запускаем бота
-    logger.info("Бот запущен")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    application.post_shutdown = post_shutdown
+    return application
+
+
+def main():
+    """Запуск бота"""
+    token = os.getenv("TELEGRAM_BOT_TOKEN")
+    if not token:
+        raise ValueError("TELEGRAM_BOT_TOKEN не установлен в переменных окружения")
+
+    # Прокси для регионов с ограниченным доступом к Telegram API
+    proxy_urls = build_proxy_urls()
+    if not proxy_urls:
+        logger.warning(
+            "Прокси не задан. Укажите TELEGRAM_PROXY_URL или параметры TELEGRAM_PROXY_POOL_*"
+        )
+
+    # Создаем приложение
+    app_builder = ApplicationBuilder().token(token)
+    connection_pool_size = telegram_connection_pool_size()
+    if len(proxy_urls) > 1:
+        # Несколько прокси пула: каждый запрос (и отправка, и polling) идёт через более здоровый.
+        # Пул соединений полного размера у каждого прокси: весь трафик может уйти через один
+        proxy_pool.configure(proxy_urls)
+        app_builder = app_builder.request(
+            ProxyPoolRequest(proxy_pool, connection_pool_size=connection_pool_size)
+        ).get_updates_request(ProxyPoolRequest(proxy_pool, connection_pool_size=1))
+    else:
+        app_builder = app_builder.connection_pool_size(connection_pool_size)
+        if proxy_urls:
+            app_builder = app_builder.proxy(proxy_urls[0]).get_updates_proxy(proxy_urls[0])
+    logger.info(
+        f"Параллельных обновлений: до {update_processor.max_concurrent_updates}, "
+        f"соединений к Bot API: {connection_pool_size}"
+    )
+    # Хранилище подключается в фоне после запуска (см. connect_storage)
+    application = build_application(app_builder)
+
+    # Запускаем бота: long polling (по умолчанию) или webhook со встроенным HTTP-сервером.
+    # При возврате к polling webhook снимается автоматически
+    bot_mode = os.getenv("BOT_MODE", "polling").strip().lower()
+    if bot_mode == "webhook":
+        webhook_settings = build_webhook_settings()
+        logger.info(
+            f"Бот запущен в режиме webhook: {webhook_settings['listen']}:{webhook_settings['port']}"
+            f"/{webhook_settings['url_path']}"
+        )
+        application.run_webhook(allowed_updates=Update.ALL_TYPES, **webhook_settings)
+    elif bot_mode == "polling":
+        logger.info("Бот запущен")
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
+    else:
+        raise ValueError(f"Неизвестный BOT_MODE: {bot_mode} (ожидается polling или webhook)")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,363 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+
+from metrics import BROADCAST_MESSAGES, BROADCAST_THROUGHPUT
+from recipients import is_dead_chat_error
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Глобальный лимит отправки: не чаще rate сообщений в секунду, с общей паузой после RetryAfter"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_at = 0.0
+        self._paused_until = 0.0
+        self._lock = None
+
+    async def wait(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            now = loop.time()
+            delay = max(self._next_at, self._paused_until) - now
+            if delay > 0:
+                await asyncio.sleep(delay)
+                now = loop.time()
+            self._next_at = now + self.interval
+
+    def pause(self, seconds: float):
+        """Остановить все отправки на seconds секунд (Telegram вернул RetryAfter)"""
+        resume_at = asyncio.get_running_loop().time() + seconds
+        self._paused_until = max(self._paused_until, resume_at)
+
+
+class BroadcastEngine:
+    """
+    Фоновая массовая рассылка.
+    Получатели и их статусы хранятся в SQLite, поэтому прерванная рассылка продолжается после перезапуска
+    без повторной отправки тем, кому сообщение уже ушло. Администратору периодически обновляется
+    сообщение с прогрессом.
+    """
+
+    def __init__(self, path: str | None = None):
+        self.path = path or os.getenv("BROADCAST_DB_PATH", "broadcasts.db")
+        # Сколько сообщений отправляется параллельно
+        self.concurrency = max(1, int(os.getenv("BROADCAST_CONCURRENCY", "10")))
+        # Глобальный лимит Telegram — около 30 сообщений в секунду, оставляем запас
+        self.rate = float(os.getenv("BROADCAST_RATE", "25"))
+        # Как часто (сек) обновлять сообщение с прогрессом
+        self.progress_interval = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))
+        # Сколько раз пробовать отправить сообщение при сетевых ошибках
+        self.max_attempts = max(1, int(os.getenv("BROADCAST_MAX_ATTEMPTS", "3")))
+        # Как часто (сек) лидер проверяет, нет ли новых или прерванных рассылок
+        self.resume_interval = float(os.getenv("BROADCAST_RESUME_INTERVAL", "15"))
+        self.bot = None
+        self.reply_markup = None
+        # RecipientIndex: недоступные чаты помечаются в нём неактивными
+        self.recipients = None
+        # LeaderLease: рассылает только действующий лидер (None — один экземпляр)
+        self.lease = None
+        self._limiter = RateLimiter(self.rate)
+        self._tasks = {}
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # База открывается при первом обращении, а не при импорте модуля
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS broadcasts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    created_at REAL NOT NULL,
+                    admin_chat_id INTEGER NOT NULL,
+                    progress_message_id INTEGER,
+                    text TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'running',
+                    finished_at REAL
+                );
+                CREATE TABLE IF NOT EXISTS broadcast_recipients (
+                    broadcast_id INTEGER NOT NULL,
+                    chat_id INTEGER NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    error TEXT,
+                    updated_at REAL,
+                    PRIMARY KEY (broadcast_id, chat_id)
+                );
+                CREATE INDEX IF NOT EXISTS idx_broadcast_recipients_status
+                    ON broadcast_recipients (broadcast_id, status);
+                """
+            )
+            self._conn.commit()
+        return self._conn
+
+    def initialize(self, bot, reply_markup=None, recipients=None, lease=None):
+        """
+        bot — экземпляр telegram.Bot; reply_markup прикладывается к каждому сообщению рассылки;
+        recipients — RecipientIndex, в котором помечаются заблокировавшие бота;
+        lease — LeaderLease, аренда которого проверяется перед каждым сообщением
+        """
+        self.bot = bot
+        self.reply_markup = reply_markup
+        self.recipients = recipients
+        self.lease = lease
+
+    def _holds_lease(self) -> bool:
+        return self.lease is None or self.lease.is_leader
+
+    # --- Синхронные операции с SQLite ---
+
+    def _create(self, admin_chat_id: int, text: str, recipient_ids: list) -> int:
+        with self._lock:
+            conn = self._connection()
+            cursor = conn.execute(
+                "INSERT INTO broadcasts (created_at, admin_chat_id, text) VALUES (?, ?, ?)",
+                (time.time(), admin_chat_id, text),
+            )
+            broadcast_id = cursor.lastrowid
+            conn.executemany(
+                "INSERT OR IGNORE INTO broadcast_recipients (broadcast_id, chat_id) VALUES (?, ?)",
+                [(broadcast_id, chat_id) for chat_id in recipient_ids],
+            )
+            conn.commit()
+            return broadcast_id
+
+    def _set_progress_message(self, broadcast_id: int, message_id: int):
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "UPDATE broadcasts SET progress_message_id = ? WHERE id = ?",
+                (message_id, broadcast_id),
+            )
+            conn.commit()
+
+    def _load(self, broadcast_id: int):
+        with self._lock:
+            return self._connection().execute(
+                "SELECT admin_chat_id, progress_message_id, text FROM broadcasts WHERE id = ?",
+                (broadcast_id,),
+            ).fetchone()
+
+    def _running_ids(self) -> list:
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT id FROM broadcasts WHERE status = 'running' ORDER BY id"
+            ).fetchall()
+            return [row[0] for row in rows]
+
+    def _claim_pending(self, broadcast_id: int) -> list:
+        """
+        Получатели, которым ещё не отправляли.
+        Записи, застрявшие в 'sending' после падения, не переотправляются: лучше пропустить, чем задвоить.
+        """
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "UPDATE broadcast_recipients SET status = 'unknown', updated_at = ? "
+                "WHERE broadcast_id = ? AND status = 'sending'",
+                (time.time(), broadcast_id),
+            )
+            conn.commit()
+            rows = conn.execute(
+                "SELECT chat_id FROM broadcast_recipients WHERE broadcast_id = ? AND status = 'pending'",
+                (broadcast_id,),
+            ).fetchall()
+            return [row[0] for row in rows]
+
+    def _set_status(self, broadcast_id: int, chat_id: int, status: str, error: str | None = None):
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "UPDATE broadcast_recipients SET status = ?, error = ?, updated_at = ? "
+                "WHERE broadcast_id = ? AND chat_id = ?",
+                (status, error, time.time(), broadcast_id, chat_id),
+            )
+            conn.commit()
+
+    def _finish(self, broadcast_id: int):
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "UPDATE broadcasts SET status = 'finished', finished_at = ? WHERE id = ?",
+                (time.time(), broadcast_id),
+            )
+            conn.commit()
+
+    def stats(self, broadcast_id: int) -> dict:
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT status, COUNT(*) FROM broadcast_recipients WHERE broadcast_id = ? GROUP BY status",
+                (broadcast_id,),
+            ).fetchall()
+        counts = dict(rows)
+        counts["total"] = sum(counts.values())
+        return counts
+
+    # --- Асинхронный интерфейс ---
+
+    def is_running(self) -> bool:
+        return any(not task.done() for task in self._tasks.values())
+
+    async def has_unfinished(self) -> bool:
+        """Есть незавершённая рассылка (в том числе запущенная другим экземпляром бота)"""
+        return self.is_running() or bool(await asyncio.to_thread(self._running_ids))
+
+    async def start(self, admin_chat_id: int, text: str, recipient_ids: list, launch: bool = True) -> int:
+        """
+        Создать рассылку и запустить её в фоне. Возвращает id рассылки.
+        launch=False — только сохранить: рассылку подхватит лидер при очередном resume.
+        """
+        broadcast_id = await asyncio.to_thread(self._create, admin_chat_id, text, recipient_ids)
+        try:
+            message = await self.bot.send_message(
+                chat_id=admin_chat_id,
+                text=f"Рассылка #{broadcast_id} запущена. Получателей: {len(recipient_ids)}",
+            )
+            await asyncio.to_thread(self._set_progress_message, broadcast_id, message.message_id)
+        except Exception as e:
+            logger.warning(f"Не удалось отправить сообщение о прогрессе рассылки #{broadcast_id}: {e}")
+        if launch:
+            self._launch(broadcast_id)
+        return broadcast_id
+
+    async def resume(self, context=None):
+        """Продолжить рассылки, прерванные перезапуском бота или сменой лидера (вызывается job_queue)"""
+        for broadcast_id in await asyncio.to_thread(self._running_ids):
+            if broadcast_id not in self._tasks:
+                logger.info(f"Продолжаем прерванную рассылку #{broadcast_id}")
+                self._launch(broadcast_id)
+
+    def _launch(self, broadcast_id: int):
+        task = asyncio.create_task(self._run(broadcast_id))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+
+    async def _run(self, broadcast_id: int):
+        admin_chat_id, progress_message_id, text = await asyncio.to_thread(self._load, broadcast_id)
+        recipient_ids = await asyncio.to_thread(self._claim_pending, broadcast_id)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        started = time.monotonic()
+
+        async def send_limited(chat_id: int):
+            async with semaphore:
+                await self._send(broadcast_id, chat_id, text)
+
+        progress_task = asyncio.create_task(
+            self._report_progress(broadcast_id, admin_chat_id, progress_message_id)
+        )
+        try:
+            await asyncio.gather(*(send_limited(chat_id) for chat_id in recipient_ids))
+        finally:
+            progress_task.cancel()
+
+        if not self._holds_lease():
+            # Оставшиеся получатели остались в 'pending': рассылку продолжит действующий лидер
+            logger.warning(f"Рассылка #{broadcast_id} приостановлена: аренда лидера не подтверждена")
+            return
+
+        await asyncio.to_thread(self._finish, broadcast_id)
+        stats = await asyncio.to_thread(self.stats, broadcast_id)
+        elapsed = time.monotonic() - started
+        if recipient_ids and elapsed > 0:
+            BROADCAST_THROUGHPUT.set(len(recipient_ids) / elapsed)
+        logger.info(f"Рассылка #{broadcast_id} завершена за {elapsed:.1f} с: {stats}")
+        await self._show(
+            admin_chat_id,
+            progress_message_id,
+            f"Рассылка #{broadcast_id} завершена.\n"
+            f"Успешно: {stats.get('sent', 0)}\n"
+            f"С ошибкой: {stats.get('failed', 0) + stats.get('unknown', 0)}",
+        )
+
+    async def _send(self, broadcast_id: int, chat_id: int, text: str):
+        attempt = 0
+        while True:
+            attempt += 1
+            await self._limiter.wait()
+            if not self._holds_lease():
+                # Аренду мог забрать другой экземпляр — отправлять от имени лидера больше нельзя
+                return
+            # Отметка ставится непосредственно перед запросом: отменённые до него отправки останутся в 'pending'
+            await asyncio.to_thread(self._set_status, broadcast_id, chat_id, "sending")
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text, reply_markup=self.reply_markup)
+                await asyncio.to_thread(self._set_status, broadcast_id, chat_id, "sent")
+                BROADCAST_MESSAGES.inc(status="sent")
+                return
+            except RetryAfter as e:
+                # Лимит Telegram: притормаживаем всю рассылку и пробуем снова (попытка не считается)
+                logger.warning(f"Telegram просит подождать {e.retry_after} с (рассылка #{broadcast_id})")
+                self._limiter.pause(float(e.retry_after))
+                attempt -= 1
+            except BadRequest as e:
+                # BadRequest — наследник NetworkError, но повтор здесь не поможет (например, чат не найден)
+                await self._fail(broadcast_id, chat_id, e)
+                return
+            except (TimedOut, NetworkError) as e:
+                if attempt >= self.max_attempts:
+                    await self._fail(broadcast_id, chat_id, e)
+                    return
+                await asyncio.sleep(2 ** attempt)
+            except Exception as e:
+                await self._fail(broadcast_id, chat_id, e)
+                return
+
+    async def _fail(self, broadcast_id: int, chat_id: int, error: Exception):
+        await asyncio.to_thread(self._set_status, broadcast_id, chat_id, "failed", str(error))
+        BROADCAST_MESSAGES.inc(status="failed")
+        logger.warning(f"Не удалось отправить уведомление пользователю {chat_id}: {error}")
+        if self.recipients and is_dead_chat_error(error):
+            # Заблокировавшим бота следующие рассылки не отправляются
+            try:
+                await self.recipients.mark_inactive(chat_id, str(error))
+            except Exception as e:
+                logger.error(f"Не удалось пометить получателя {chat_id} неактивным: {e}")
+
+    async def _report_progress(self, broadcast_id: int, admin_chat_id: int, progress_message_id):
+        last_text = None
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            stats = await asyncio.to_thread(self.stats, broadcast_id)
+            done = stats["total"] - stats.get("pending", 0) - stats.get("sending", 0)
+            text = (
+                f"Рассылка #{broadcast_id}: обработано {done} из {stats['total']}\n"
+                f"Успешно: {stats.get('sent', 0)}, с ошибкой: {stats.get('failed', 0)}"
+            )
+            # Telegram отклоняет редактирование без изменений
+            if text != last_text:
+                await self._show(admin_chat_id, progress_message_id, text)
+                last_text = text
+
+    async def _show(self, admin_chat_id: int, progress_message_id, text: str):
+        try:
+            if progress_message_id:
+                await self.bot.edit_message_text(chat_id=admin_chat_id, message_id=progress_message_id, text=text)
+            else:
+                await self.bot.send_message(chat_id=admin_chat_id, text=text)
+        except Exception as e:
+            logger.warning(f"Не удалось обновить прогресс рассылки: {e}")
+
+    async def stop(self):
+        """Остановить фоновые рассылки; незавершённые продолжит следующий лидер или перезапуск"""
+        for task in list(self._tasks.values()):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    async def shutdown(self):
+        await self.stop()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,113 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationStore:
+    """
+    Хранилище незавершённых диалогов записи (вместо глобального словаря user_data).
+    Брошенные диалоги удаляются по TTL, а при превышении лимита вытесняются самые давние.
+    В состоянии хранятся только простые значения (строки), поэтому его можно
+    сохранять на диск, и начатая запись переживает перезапуск бота.
+    """
+
+    def __init__(self):
+        # Через сколько секунд бездействия диалог считается брошенным
+        self.ttl = float(os.getenv("CONVERSATION_TTL", "3600"))
+        # Максимальное число одновременно хранимых диалогов
+        self.max_size = max(1, int(os.getenv("CONVERSATION_MAX", "10000")))
+        # Файл для сохранения диалогов между перезапусками (пусто — только в памяти)
+        self.path = os.getenv("CONVERSATION_STORE_PATH", "").strip() or None
+        self.persist_interval = float(os.getenv("CONVERSATION_PERSIST_INTERVAL", "30"))
+        # user_id -> (время последнего обращения, состояние)
+        self._items = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, user_id: int) -> bool:
+        return self.get(user_id) is not None
+
+    def start(self, user_id: int) -> dict:
+        """Начать новый диалог (старое состояние пользователя сбрасывается)"""
+        state = {}
+        self._items.pop(user_id, None)
+        self._items[user_id] = (time.time(), state)
+        while len(self._items) > self.max_size:
+            evicted_id, _ = self._items.popitem(last=False)
+            logger.warning(f"Диалог пользователя {evicted_id} вытеснен: превышен лимит CONVERSATION_MAX")
+        return state
+
+    def get(self, user_id: int) -> dict | None:
+        """Состояние диалога или None, если его нет или он истёк"""
+        item = self._items.get(user_id)
+        if item is None:
+            return None
+        touched_at, state = item
+        if time.time() - touched_at > self.ttl:
+            del self._items[user_id]
+            return None
+        self._items[user_id] = (time.time(), state)
+        self._items.move_to_end(user_id)
+        return state
+
+    def pop(self, user_id: int) -> dict | None:
+        item = self._items.pop(user_id, None)
+        return item[1] if item else None
+
+    def evict_expired(self) -> int:
+        """Удалить истёкшие диалоги; самые давние лежат в начале словаря"""
+        deadline = time.time() - self.ttl
+        evicted = 0
+        while self._items:
+            user_id, (touched_at, _) = next(iter(self._items.items()))
+            if touched_at > deadline:
+                break
+            del self._items[user_id]
+            evicted += 1
+        return evicted
+
+    # --- Сохранение на диск ---
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                raw = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Не удалось загрузить сохранённые диалоги из {self.path}: {e}")
+            return
+
+        items = sorted(((int(user_id), item) for user_id, item in raw.items()), key=lambda x: x[1][0])
+        self._items = OrderedDict((user_id, (touched_at, state)) for user_id, (touched_at, state) in items)
+        evicted = self.evict_expired()
+        logger.info(f"Загружено незавершённых диалогов: {len(self._items)} (истекло: {evicted})")
+
+    def _save(self, snapshot: str):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(snapshot)
+        os.replace(tmp_path, self.path)
+
+    async def persist(self, context=None):
+        """Удалить истёкшие диалоги и сохранить остальные на диск (вызывается job_queue)"""
+        evicted = self.evict_expired()
+        if evicted:
+            logger.info(f"Удалено брошенных диалогов: {evicted}")
+        if not self.path:
+            return
+        # Снимок делается в event loop, запись файла — в потоке
+        snapshot = json.dumps(
+            {str(user_id): [touched_at, state] for user_id, (touched_at, state) in self._items.items()},
+            ensure_ascii=False,
+        )
+        try:
+            await asyncio.to_thread(self._save, snapshot)
+        except OSError as e:
+            logger.error(f"Не удалось сохранить диалоги в {self.path}: {e}")
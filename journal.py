@@ -0,0 +1,189 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RegistrationJournal:
+    """
+    Журнал регистраций с отложенной записью в Google Sheets.
+    Запись сначала фиксируется в локальной SQLite-базе (WAL) и сразу подтверждается пользователю,
+    а в таблицу строки уходят пачками через append_rows — строго в порядке поступления.
+    Незаписанные строки переживают перезапуск и дозаписываются при старте.
+    Доставка «хотя бы один раз»: при падении между append_rows и отметкой в журнале строка может задвоиться.
+    """
+
+    def __init__(self, path: str | None = None):
+        self.path = path or os.getenv("REGISTRATIONS_JOURNAL_PATH", "registrations_journal.db")
+        # Сколько строк отправлять в таблицу за один запрос
+        self.batch_size = max(1, int(os.getenv("REGISTRATIONS_FLUSH_BATCH", "100")))
+        # Максимальная пауза между повторами после ошибки, в секундах
+        self.max_backoff = float(os.getenv("REGISTRATIONS_FLUSH_MAX_BACKOFF", "300"))
+        # Период фоновой дозаписи, в секундах
+        self.flush_interval = float(os.getenv("REGISTRATIONS_FLUSH_INTERVAL", "5"))
+        self.sheets = None
+        self.on_flushed = None
+        self._retry_at = 0.0
+        self._failures = 0
+        self._flush_lock = None
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # База открывается при первом обращении, а не при импорте модуля
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=FULL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS registrations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    created_at REAL NOT NULL,
+                    row_json TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    flushed_at REAL,
+                    row_number INTEGER
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_registrations_pending ON registrations (flushed_at, id)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def initialize(self, sheets, on_flushed=None):
+        """
+        sheets — асинхронный фасад Google Sheets.
+        on_flushed(row_number, row) вызывается для каждой строки, записанной в таблицу.
+        """
+        self.sheets = sheets
+        self.on_flushed = on_flushed
+        pending = self.pending_count()
+        if pending:
+            logger.info(f"В журнале регистраций {pending} незаписанных строк — будут дозаписаны")
+
+    # --- Синхронные операции с SQLite ---
+
+    def _append(self, row: list) -> int:
+        with self._lock:
+            conn = self._connection()
+            cursor = conn.execute(
+                "INSERT INTO registrations (created_at, row_json) VALUES (?, ?)",
+                (time.time(), json.dumps(row, ensure_ascii=False)),
+            )
+            conn.commit()
+            return cursor.lastrowid
+
+    def _pending(self, limit: int) -> list:
+        with self._lock:
+            conn = self._connection()
+            cursor = conn.execute(
+                "SELECT id, row_json FROM registrations WHERE flushed_at IS NULL ORDER BY id LIMIT ?",
+                (limit,),
+            )
+            return [(entry_id, json.loads(row_json)) for entry_id, row_json in cursor.fetchall()]
+
+    def _mark_flushed(self, entry_ids: list, first_row_number: int | None):
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(
+                "UPDATE registrations SET flushed_at = ?, row_number = ?, attempts = attempts + 1 WHERE id = ?",
+                [
+                    (now, first_row_number + offset if first_row_number is not None else None, entry_id)
+                    for offset, entry_id in enumerate(entry_ids)
+                ],
+            )
+            conn.commit()
+
+    def _mark_failed(self, entry_ids: list, error: str):
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(
+                "UPDATE registrations SET attempts = attempts + 1, last_error = ? WHERE id = ?",
+                [(error, entry_id) for entry_id in entry_ids],
+            )
+            conn.commit()
+
+    def pending_rows(self) -> list:
+        """Строки, ещё не записанные в таблицу"""
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT row_json FROM registrations WHERE flushed_at IS NULL ORDER BY id"
+            ).fetchall()
+        return [json.loads(row_json) for (row_json,) in rows]
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return self._connection().execute(
+                "SELECT COUNT(*) FROM registrations WHERE flushed_at IS NULL"
+            ).fetchone()[0]
+
+    # --- Асинхронный интерфейс для бота ---
+
+    async def append(self, row: list) -> int:
+        """Зафиксировать регистрацию в журнале (до записи в таблицу)"""
+        return await asyncio.to_thread(self._append, row)
+
+    def reset_backoff(self):
+        """Хранилище подключилось: следующая дозапись идёт по расписанию, без накопленной паузы"""
+        self._failures = 0
+        self._retry_at = 0.0
+
+    async def flush(self, context=None):
+        """Дозаписать накопленные строки в таблицу (вызывается job_queue)"""
+        if not self.sheets:
+            logger.warning("Журнал регистраций не инициализирован (нет sheets)")
+            return
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        if self._flush_lock.locked() or time.monotonic() < self._retry_at:
+            return
+
+        async with self._flush_lock:
+            while True:
+                batch = await asyncio.to_thread(self._pending, self.batch_size)
+                if not batch:
+                    return
+
+                entry_ids = [entry_id for entry_id, _ in batch]
+                rows = [row for _, row in batch]
+                # Номер первой строки должен оставаться верным, пока напоминания для этих строк не поставлены
+                async with self.sheets.row_lock:
+                    try:
+                        first_row_number = await self.sheets.append_registrations(rows)
+                    except Exception as e:
+                        # Следующие строки не отправляем, пока не уйдёт эта пачка: порядок важнее
+                        self._failures += 1
+                        delay = min(self.max_backoff, 2 ** self._failures)
+                        self._retry_at = time.monotonic() + delay
+                        await asyncio.to_thread(self._mark_failed, entry_ids, str(e))
+                        logger.error(
+                            f"Не удалось записать {len(rows)} регистраций в Google Sheets, повтор через {delay:.0f} с: {e}"
+                        )
+                        return
+
+                    self._failures = 0
+                    await asyncio.to_thread(self._mark_flushed, entry_ids, first_row_number)
+                    logger.info(f"Из журнала записано в Google Sheets: {len(rows)} регистраций")
+
+                    if self.on_flushed and first_row_number is not None:
+                        for offset, row in enumerate(rows):
+                            try:
+                                self.on_flushed(first_row_number + offset, row)
+                            except Exception as e:
+                                logger.error(f"Ошибка обработки записанной регистрации: {e}", exc_info=True)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
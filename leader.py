@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import os
+import socket
+import sqlite3
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderLease:
+    """
+    Выбор лидера между несколькими экземплярами бота через аренду (lease) в общей SQLite-базе.
+    Только лидер запускает напоминания, рассылки и синхронизацию; диалоги обслуживают все экземпляры.
+    Лидер продлевает аренду каждые LEADER_LEASE_TTL / 3 секунд; если он пропал, аренду забирает
+    другой экземпляр после её истечения.
+    Без LEADER_LEASE_PATH экземпляр считается единственным и всегда является лидером.
+    """
+
+    def __init__(self, name: str = "jobs"):
+        self.name = name
+        self.path = os.getenv("LEADER_LEASE_PATH", "").strip() or None
+        self.ttl = float(os.getenv("LEADER_LEASE_TTL", "30"))
+        self.renew_interval = self.ttl / 3
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._leader = False
+        # До какого момента (по монотонным часам) аренда точно наша
+        self._valid_until = 0.0
+        self.on_acquired = None
+        self.on_lost = None
+
+    @property
+    def is_leader(self) -> bool:
+        # Если продлить аренду не удалось вовремя (например, завис event loop), её мог забрать
+        # другой экземпляр — такой лидер перестаёт считать себя лидером, не дожидаясь renew
+        return self._leader and time.monotonic() < self._valid_until
+
+    def initialize(self, on_acquired=None, on_lost=None):
+        """Колбэки (async) вызываются при получении и потере лидерства"""
+        self.on_acquired = on_acquired
+        self.on_lost = on_lost
+
+    def _connect(self) -> sqlite3.Connection:
+        # Соединение на каждую попытку: файл может лежать на общем томе нескольких экземпляров
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, holder TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        return conn
+
+    def _try_acquire(self) -> bool:
+        if not self.path:
+            return True
+
+        conn = self._connect()
+        try:
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT holder, expires_at FROM leases WHERE name = ?", (self.name,)).fetchone()
+            if row is None or row[0] == self.holder or row[1] < now:
+                conn.execute(
+                    "INSERT OR REPLACE INTO leases (name, holder, expires_at) VALUES (?, ?, ?)",
+                    (self.name, self.holder, now + self.ttl),
+                )
+                conn.execute("COMMIT")
+                return True
+            conn.execute("COMMIT")
+            return False
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _release(self):
+        if not self.path:
+            return
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (self.name, self.holder))
+        finally:
+            conn.close()
+
+    async def renew(self, context=None):
+        """Получить или продлить аренду (вызывается job_queue)"""
+        attempt_started = time.monotonic()
+        try:
+            acquired = await asyncio.to_thread(self._try_acquire)
+        except sqlite3.Error as e:
+            # Не смогли подтвердить аренду — безопаснее перестать быть лидером
+            logger.error(f"Ошибка продления аренды лидера: {e}")
+            acquired = False
+
+        if acquired:
+            self._valid_until = attempt_started + self.ttl if self.path else float("inf")
+
+        if acquired and not self._leader:
+            self._leader = True
+            logger.info(f"Экземпляр {self.holder} стал лидером")
+            if self.on_acquired:
+                await self.on_acquired()
+        elif not acquired and self._leader:
+            self._leader = False
+            logger.warning(f"Экземпляр {self.holder} потерял лидерство")
+            if self.on_lost:
+                await self.on_lost()
+
+    async def release(self):
+        """Отдать аренду при остановке, чтобы другой экземпляр подхватил задачи сразу"""
+        if not self._leader:
+            return
+        self._leader = False
+        try:
+            await asyncio.to_thread(self._release)
+            logger.info(f"Экземпляр {self.holder} освободил аренду лидера")
+        except sqlite3.Error as e:
+            logger.error(f"Не удалось освободить аренду лидера: {e}")
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryLedger:
+    """
+    Журнал доставки напоминаний (SQLite): попытка, результат и message_id для каждой пары
+    (запись, тип напоминания). Запись определяется Telegram ID и временем экзамена, а не номером строки,
+    поэтому удаление и перестановка строк в таблице не приводят к повторной отправке.
+    Статусы держатся в памяти, проверка перед отправкой — поиск в словаре.
+    """
+
+    def __init__(self, path: str | None = None):
+        self.path = path or os.getenv("REMINDER_LEDGER_PATH", "reminder_ledger.db")
+        # Сколько дней хранить записи о прошедших экзаменах
+        self.retention_days = float(os.getenv("REMINDER_LEDGER_RETENTION_DAYS", "30"))
+        # (ключ записи, тип напоминания) -> статус
+        self._statuses = {}
+        self._lock = threading.Lock()
+        self._conn = None
+
+    @staticmethod
+    def key_for(exam: dict) -> str:
+        """Ключ записи: Telegram ID и время экзамена"""
+        return f"{str(exam.get('telegram_id', '')).strip()}|{exam['exam_datetime'].strftime('%d.%m.%Y %H:%M')}"
+
+    def _connection(self) -> sqlite3.Connection:
+        # База открывается при первом обращении, а не при импорте модуля
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS deliveries (
+                    registration_key TEXT NOT NULL,
+                    reminder_type TEXT NOT NULL,
+                    chat_id INTEGER,
+                    exam_at REAL NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    attempted_at REAL,
+                    delivered_at REAL,
+                    message_id INTEGER,
+                    error TEXT,
+                    PRIMARY KEY (registration_key, reminder_type)
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_deliveries_exam_at ON deliveries (exam_at)")
+            self._conn.commit()
+        return self._conn
+
+    # --- Синхронные операции с SQLite ---
+
+    def _load(self) -> dict:
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "DELETE FROM deliveries WHERE exam_at < ?",
+                (time.time() - self.retention_days * 86400,),
+            )
+            conn.commit()
+            rows = conn.execute("SELECT registration_key, reminder_type, status FROM deliveries").fetchall()
+        return {(key, reminder_type): status for key, reminder_type, status in rows}
+
+    def _record_attempt(self, key: str, reminder_type: str, chat_id: int, exam_at: float):
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                """
+                INSERT INTO deliveries (registration_key, reminder_type, chat_id, exam_at, status, attempts, attempted_at)
+                VALUES (?, ?, ?, ?, 'sending', 1, ?)
+                ON CONFLICT (registration_key, reminder_type) DO UPDATE SET
+                    status = 'sending', attempts = attempts + 1, attempted_at = excluded.attempted_at, error = NULL
+                """,
+                (key, reminder_type, chat_id, exam_at, time.time()),
+            )
+            conn.commit()
+
+    def _record_outcome(self, key: str, reminder_type: str, status: str, message_id=None, error=None):
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                """
+                UPDATE deliveries SET status = ?, message_id = ?, error = ?,
+                    delivered_at = CASE WHEN ? = 'sent' THEN ? ELSE delivered_at END
+                WHERE registration_key = ? AND reminder_type = ?
+                """,
+                (status, message_id, error, status, time.time(), key, reminder_type),
+            )
+            conn.commit()
+
+    # --- Асинхронный интерфейс ---
+
+    async def load(self):
+        """Загрузить статусы в память (при старте и при получении лидерства)"""
+        self._statuses = await asyncio.to_thread(self._load)
+        uncertain = sum(1 for status in self._statuses.values() if status == "sending")
+        logger.info(f"Журнал доставки напоминаний загружен: {len(self._statuses)} записей")
+        if uncertain:
+            # Бот упал во время отправки: доставлено ли сообщение, неизвестно — повторно не шлём
+            logger.warning(f"Напоминаний с неизвестным результатом отправки: {uncertain}")
+
+    def status(self, exam: dict, reminder_type: str) -> str | None:
+        return self._statuses.get((self.key_for(exam), reminder_type))
+
+    def is_done(self, exam: dict, reminder_type: str) -> bool:
+        """Напоминание доставлено или его результат неизвестен — повторно не отправляется"""
+        return self.status(exam, reminder_type) in ("sent", "sending")
+
+    async def record_attempt(self, exam: dict, reminder_type: str, chat_id: int):
+        key = self.key_for(exam)
+        self._statuses[(key, reminder_type)] = "sending"
+        await asyncio.to_thread(
+            self._record_attempt, key, reminder_type, chat_id, exam["exam_datetime"].timestamp()
+        )
+
+    async def record_sent(self, exam: dict, reminder_type: str, message_id: int):
+        key = self.key_for(exam)
+        self._statuses[(key, reminder_type)] = "sent"
+        await asyncio.to_thread(self._record_outcome, key, reminder_type, "sent", message_id)
+
+    async def record_failed(self, exam: dict, reminder_type: str, error: str):
+        key = self.key_for(exam)
+        self._statuses[(key, reminder_type)] = "failed"
+        await asyncio.to_thread(self._record_outcome, key, reminder_type, "failed", None, error)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -7,12 +7,14 @@ TEXT_CHOOSE_EXAM_TYPE = "Выберите тип экзамена:"
 TEXT_SCHEDULE_LOAD_ERROR = "К сожалению, не удалось загрузить расписание. Попробуйте позже."
 TEXT_NO_SLOTS = "На данный момент нет доступных дат для записи. Обратитесь к организаторам."
 TEXT_CHOOSE_SLOT = "Выбери дату и время экзамена:"
-TEXT_SLOT_UNAVAILABLE = "Выбранный слот недоступен. Начните заново /start"
+TEXT_SLOT_UNAVAILABLE = "Выбранного времени больше нет в расписании. Выбери другое:"
+TEXT_SLOT_FULL = "На выбранное время мест больше нет. Выбери другое время: /start"
 TEXT_CHOOSE_TEACHER = "Выбери преподавателя:"
 TEXT_ENTER_FULL_NAME = "Введи своё имя и фамилию:"
 TEXT_INVALID_FULL_NAME = "Пожалуйста, введите корректное имя и фамилию (минимум 3 символа):"
 TEXT_SAVE_ERROR = "Произошла ошибка при сохранении данных. Пожалуйста, попробуйте позже."
 TEXT_CANCELLED = "Запись отменена."
+TEXT_SESSION_EXPIRED = "Время на запись истекло. Начните заново /start"
 
 # --- Массовое уведомление ---
 
@@ -0,0 +1,325 @@
+import asyncio
+import functools
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм по умолчанию, в секундах
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(label_names: tuple, label_values: tuple, extra: dict | None = None) -> str:
+    pairs = list(zip(label_names, label_values)) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"Метрика {self.name} ожидает метки {self.label_names}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> list:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in items]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        super().__init__(name, documentation, labels)
+        self._function = None
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def set_function(self, function):
+        """
+        Значение вычисляется при каждом чтении /metrics.
+        Для метрики с метками function возвращает словарь {кортеж значений меток: значение}
+        """
+        self._function = function
+
+    def _samples(self) -> list:
+        if self._function is not None:
+            try:
+                value = self._function()
+                if not self.label_names:
+                    return [f"{self.name} {_format_value(value)}"]
+                return [
+                    f"{self.name}{_format_labels(self.label_names, tuple(str(v) for v in key))} {_format_value(sample)}"
+                    for key, sample in sorted(value.items())
+                ]
+            except Exception as e:
+                logger.warning(f"Не удалось вычислить метрику {self.name}: {e}")
+                return []
+        return super()._samples()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Счётчики по корзинам (не накопительные), сумма и количество
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def _samples(self) -> list:
+        with self._lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names, key, {"le": _format_value(bound)})
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, {'le': '+Inf'})} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+
+class Registry:
+    """Набор метрик и их вывод в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: tuple = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: tuple = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STORAGE_LATENCY = REGISTRY.histogram(
+    "bot_storage_call_duration_seconds",
+    "Длительность вызова метода хранилища, включая ожидание в пуле потоков",
+    labels=("method",),
+)
+STORAGE_ERRORS = REGISTRY.counter(
+    "bot_storage_call_errors_total",
+    "Вызовы хранилища, завершившиеся ошибкой или таймаутом",
+    labels=("method",),
+)
+HANDLER_LATENCY = REGISTRY.histogram(
+    "bot_handler_duration_seconds",
+    "Длительность обработчика диалога",
+    labels=("handler",),
+)
+HANDLER_ERRORS = REGISTRY.counter(
+    "bot_handler_errors_total",
+    "Обработчики, завершившиеся исключением",
+    labels=("handler",),
+)
+REMINDERS_SENT = REGISTRY.counter(
+    "bot_reminders_sent_total",
+    "Отправленные напоминания",
+    labels=("type",),
+)
+REMINDERS_FAILED = REGISTRY.counter(
+    "bot_reminders_failed_total",
+    "Напоминания, которые не удалось отправить",
+    labels=("type",),
+)
+REMINDER_LAG = REGISTRY.histogram(
+    "bot_reminder_lag_seconds",
+    "Опоздание напоминания: фактическое время отправки минус плановое",
+    labels=("type",),
+    buckets=(0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0),
+)
+BROADCAST_MESSAGES = REGISTRY.counter(
+    "bot_broadcast_messages_total",
+    "Сообщения рассылок по итоговому статусу",
+    labels=("status",),
+)
+BROADCAST_THROUGHPUT = REGISTRY.gauge(
+    "bot_broadcast_throughput_messages_per_second",
+    "Скорость последней завершённой рассылки",
+)
+CONVERSATIONS_ACTIVE = REGISTRY.gauge(
+    "bot_conversations_active",
+    "Незавершённые диалоги записи в памяти",
+)
+SHEETS_QUOTA_HEADROOM = REGISTRY.gauge(
+    "bot_sheets_quota_available",
+    "Свободные токены квоты Google Sheets API (запросов, которые можно сделать прямо сейчас)",
+    labels=("kind",),
+)
+SHEETS_QUOTA_WAIT = REGISTRY.histogram(
+    "bot_sheets_quota_wait_seconds",
+    "Ожидание токена квоты Google Sheets API перед запросом",
+    labels=("kind", "priority"),
+    buckets=(0.01, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0),
+)
+SHEETS_THROTTLED = REGISTRY.counter(
+    "bot_sheets_retries_total",
+    "Повторы запросов к Google Sheets API после 429 и 5xx",
+    labels=("kind", "status"),
+)
+PROXY_LATENCY = REGISTRY.histogram(
+    "bot_proxy_request_duration_seconds",
+    "Длительность запроса к Bot API через прокси пула (без getUpdates) и проверок getMe",
+    labels=("proxy",),
+)
+PROXY_FAILURES = REGISTRY.counter(
+    "bot_proxy_failures_total",
+    "Сетевые ошибки и таймауты запросов через прокси пула",
+    labels=("proxy",),
+)
+PROXY_ADMITTED = REGISTRY.gauge(
+    "bot_proxy_admitted",
+    "1, если прокси пула в ротации, 0 — исключён после ошибок подряд",
+    labels=("proxy",),
+)
+IS_LEADER = REGISTRY.gauge(
+    "bot_is_leader",
+    "1, если экземпляр выполняет задачи лидера (напоминания, рассылки, синхронизацию)",
+)
+
+
+def observe_handler(func):
+    """Декоратор обработчика: длительность и ошибки в bot_handler_duration_seconds / bot_handler_errors_total"""
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=func.__name__)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, handler=func.__name__)
+
+    return wrapper
+
+
+class MetricsServer:
+    """
+    Минимальный HTTP-сервер в event loop бота: GET /metrics отдаёт REGISTRY в формате Prometheus.
+    Включается переменной METRICS_PORT.
+    """
+
+    def __init__(self, registry: Registry = REGISTRY):
+        self.registry = registry
+        port = os.getenv("METRICS_PORT", "").strip()
+        self.port = int(port) if port else None
+        self.host = os.getenv("METRICS_HOST", "0.0.0.0").strip() or "0.0.0.0"
+        self._server = None
+
+    async def start(self):
+        if self.port is None:
+            return
+        try:
+            self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        except OSError as e:
+            # Метрики необязательны: бот продолжает работать без них
+            logger.error(f"Не удалось запустить сервер метрик на {self.host}:{self.port}: {e}")
+            return
+        logger.info(f"Метрики доступны на http://{self.host}:{self.port}/metrics")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Заголовки запроса не нужны, но их нужно дочитать до пустой строки
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=5)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", self.registry.render().encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"Not Found\n"
+
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode("latin-1")
+                + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
@@ -0,0 +1,188 @@
+import logging
+import os
+import threading
+import time
+
+from gspread.utils import rowcol_to_a1
+
+logger = logging.getLogger(__name__)
+
+
+def column_letter(col: int) -> str:
+    """Буква колонки по номеру (1-based): 11 -> K"""
+    return rowcol_to_a1(1, col).rstrip("0123456789")
+
+
+class RegistrationsMirror:
+    """
+    Локальная копия листа "Записи".
+    Загружается целиком один раз, дальше докачивает только новые строки
+    (после последней известной строки) и периодически полностью сверяется с таблицей.
+    Все чтения (напоминания, получатели рассылки) идут в эту копию.
+
+    columns — заголовки колонок, которые нужно держать в копии (None — все колонки).
+    Позиции колонок определяются по строке заголовков при каждой полной загрузке,
+    а сами колонки читаются одним batch_get по диапазонам (соседние объединяются: J:K).
+    """
+
+    def __init__(self, worksheet, columns: list | None = None, start_row: int | None = None):
+        self.worksheet = worksheet
+        self.columns = list(columns) if columns else None
+        # Не чаще, чем раз в N секунд, спрашиваем у таблицы новые строки
+        self.sync_interval = float(os.getenv("REGISTRATIONS_SYNC_INTERVAL", "15"))
+        # Раз в N секунд перечитываем лист полностью (ручные правки и удаления строк)
+        self.full_sync_interval = float(os.getenv("REGISTRATIONS_FULL_SYNC_INTERVAL", "600"))
+        # С какой строки листа читать записи (строки выше — архив, в копию не загружаются)
+        if start_row is None:
+            start_row = int(os.getenv("REGISTRATIONS_START_ROW", "2"))
+        self.start_row = max(2, start_row)
+        # Заголовки листа целиком и заголовки колонок копии
+        self.sheet_headers = []
+        self.headers = []
+        self.rows = []
+        # Номера колонок листа (1-based) для колонок копии и диапазоны колонок для batch_get
+        self._column_numbers = []
+        self._column_ranges = []
+        self._synced_at = 0.0
+        self._full_synced_at = 0.0
+        self._loaded = False
+        # Растёт при каждой полной загрузке: номера строк и содержимое могли измениться
+        self.generation = 0
+        self._lock = threading.RLock()
+
+    @property
+    def watermark(self) -> int:
+        """Номер последней известной строки листа (строка 1 — заголовки)"""
+        return self.start_row + len(self.rows) - 1
+
+    def invalidate(self):
+        """Следующее чтение перечитает лист целиком"""
+        with self._lock:
+            self._loaded = False
+
+    def sync(self, force: bool = False):
+        with self._lock:
+            now = time.monotonic()
+            if not self._loaded or now - self._full_synced_at >= self.full_sync_interval:
+                self._full_sync(now)
+            elif force or now - self._synced_at >= self.sync_interval:
+                self._incremental_sync(now)
+
+    def _full_sync(self, now: float):
+        header_rows = self.worksheet.get("1:1")
+        self._resolve_columns([str(h).strip() for h in header_rows[0]] if header_rows else [])
+        self.rows = self._read_rows(self.start_row) if self.headers else []
+        self.generation += 1
+        self._loaded = True
+        self._synced_at = now
+        self._full_synced_at = now
+        logger.info(
+            f"Лист 'Записи' загружен полностью: {len(self.rows)} строк с {self.start_row}-й, "
+            f"колонок: {len(self.headers)} из {len(self.sheet_headers)}"
+        )
+
+    def _incremental_sync(self, now: float):
+        if not self.headers:
+            self._full_sync(now)
+            return
+
+        new_rows = self._read_rows(self.watermark + 1)
+        if new_rows:
+            self.rows.extend(new_rows)
+            logger.info(f"Из листа 'Записи' подгружено новых строк: {len(new_rows)}")
+        self._synced_at = now
+
+    def _resolve_columns(self, sheet_headers: list):
+        self.sheet_headers = sheet_headers
+        if self.columns is None:
+            wanted = [header for header in sheet_headers if header]
+        else:
+            wanted = []
+            for header in self.columns:
+                if header in sheet_headers:
+                    wanted.append(header)
+                else:
+                    logger.warning(f"В листе 'Записи' нет колонки '{header}'")
+
+        self._column_numbers = sorted(sheet_headers.index(header) + 1 for header in wanted)
+        self.headers = [sheet_headers[number - 1] for number in self._column_numbers]
+
+        self._column_ranges = []
+        for number in self._column_numbers:
+            if self._column_ranges and number == self._column_ranges[-1][1] + 1:
+                self._column_ranges[-1] = (self._column_ranges[-1][0], number)
+            else:
+                self._column_ranges.append((number, number))
+
+    def _read_rows(self, first_row: int) -> list:
+        """Строки копии начиная с first_row: один batch_get по диапазонам нужных колонок"""
+        ranges = [
+            f"{rowcol_to_a1(first_row, first_col)}:{column_letter(last_col)}"
+            for first_col, last_col in self._column_ranges
+        ]
+        blocks = self.worksheet.batch_get(ranges)
+        # API не возвращает пустые строки в конце диапазона, поэтому длина блоков может различаться
+        row_count = max((len(block) for block in blocks), default=0)
+        rows = []
+        for index in range(row_count):
+            row = []
+            for (first_col, last_col), block in zip(self._column_ranges, blocks):
+                cells = block[index] if index < len(block) else []
+                width = last_col - first_col + 1
+                row.extend(str(value) for value in cells[:width])
+                row.extend([""] * (width - len(cells)))
+            rows.append(row)
+        return rows
+
+    def _project(self, row: list) -> list:
+        """Строка листа целиком -> строка копии (только нужные колонки)"""
+        return [str(row[number - 1]) if number - 1 < len(row) else "" for number in self._column_numbers]
+
+    def column_number(self, header: str):
+        """Номер колонки листа (1-based) по заголовку, или None"""
+        with self._lock:
+            if not self._loaded:
+                self.sync()
+            if header not in self.sheet_headers:
+                return None
+            return self.sheet_headers.index(header) + 1
+
+    def append_local(self, row_number: int, row: list) -> bool:
+        """
+        Добавить только что записанную строку (в формате листа) без запроса к таблице.
+        Возвращает False, если строка легла не сразу после известных (тогда её подтянет синхронизация).
+        """
+        with self._lock:
+            if not self._loaded or row_number != self.watermark + 1:
+                return False
+            self.rows.append(self._project(row))
+            return True
+
+    def set_value(self, row_number: int, header: str, value: str):
+        """Обновить ячейку в локальной копии после успешной записи в таблицу"""
+        with self._lock:
+            if header not in self.headers:
+                return
+            index = row_number - self.start_row
+            if 0 <= index < len(self.rows):
+                self.rows[index][self.headers.index(header)] = value
+
+    def records(self):
+        """Список (номер строки, запись-словарь) — аналог get_all_records с номерами строк"""
+        self.sync()
+        with self._lock:
+            headers = list(self.headers)
+            return [
+                (row_number, dict(zip(headers, row)))
+                for row_number, row in enumerate(self.rows, start=self.start_row)
+            ]
+
+    def snapshot(self):
+        """
+        (поколение, заголовки, первая строка, строки) после синхронизации.
+        Пока поколение не изменилось, строки только дописываются в конец,
+        поэтому построенные по ним индексы можно дополнять, а не пересчитывать.
+        """
+        self.sync()
+        with self._lock:
+            return self.generation, list(self.headers), self.start_row, list(self.rows)
@@ -0,0 +1,219 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import httpx
+from telegram.error import NetworkError, TimedOut
+from telegram.request import BaseRequest, HTTPXRequest
+
+from metrics import PROXY_FAILURES, PROXY_LATENCY
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних задержек хранить для перцентилей
+LATENCY_WINDOW = 100
+# Вес последнего замера в скользящем среднем задержки
+LATENCY_EWMA_ALPHA = 0.3
+
+# Ошибки, при которых запрос точно не дошёл до Telegram: его можно повторить через другой прокси
+_NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.ProxyError)
+
+
+def proxy_label(url: str) -> str:
+    """host:port прокси без логина и пароля (для логов и метрик)"""
+    parts = urlsplit(url)
+    return f"{parts.hostname}:{parts.port}" if parts.port else str(parts.hostname)
+
+
+class ProxyState:
+    """Состояние одного прокси: задержки, ошибки подряд и исключение из ротации"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.label = proxy_label(url)
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.latency_ewma = None
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.last_error = ""
+
+    def is_admitted(self, now: float) -> bool:
+        return self.ejected_until <= now
+
+    def score(self) -> float:
+        # Прокси без замеров получает запросы первым, чтобы о нём появилась статистика
+        return (self.latency_ewma or 0.0) * (1 + self.consecutive_failures)
+
+    def percentile(self, point: int):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * point / 100))]
+
+
+class ProxyPool:
+    """
+    Пул прокси для Bot API. Каждый запрос идёт через более здоровый из двух случайных прокси
+    (меньше средняя задержка и ошибок подряд). После TELEGRAM_PROXY_MAX_FAILURES ошибок подряд
+    прокси исключается на TELEGRAM_PROXY_EJECT_SECONDS; потом он снова получает запросы,
+    и первая же ошибка исключает его опять, а успех (в том числе проверки getMe) возвращает в ротацию.
+    """
+
+    def __init__(self):
+        # Сколько портов пула держать в ротации
+        self.size = max(1, int(os.getenv("TELEGRAM_PROXY_POOL_SIZE", "5")))
+        self.max_failures = max(1, int(os.getenv("TELEGRAM_PROXY_MAX_FAILURES", "3")))
+        self.eject_seconds = float(os.getenv("TELEGRAM_PROXY_EJECT_SECONDS", "300"))
+        # Как часто (сек) проверять задержку прокси запросом getMe (0 — не проверять)
+        self.probe_interval = float(os.getenv("TELEGRAM_PROXY_PROBE_INTERVAL", "60"))
+        self.proxies = []
+
+    def configure(self, urls: list):
+        self.proxies = [ProxyState(url) for url in urls]
+        logger.info(f"Пул прокси: {', '.join(proxy.label for proxy in self.proxies)}")
+
+    def choose(self, exclude: tuple = ()) -> ProxyState:
+        """Прокси для очередного запроса"""
+        now = time.monotonic()
+        candidates = [proxy for proxy in self.proxies if proxy not in exclude]
+        admitted = [proxy for proxy in candidates if proxy.is_admitted(now)]
+        if not admitted:
+            # Исключены все: лучше прокси, который вернётся раньше всех, чем никакого
+            return min(candidates or self.proxies, key=lambda proxy: proxy.ejected_until)
+        if len(admitted) == 1:
+            return admitted[0]
+        return min(random.sample(admitted, 2), key=ProxyState.score)
+
+    def record_success(self, proxy: ProxyState, latency: float | None):
+        """Запрос прошёл; latency — None для запросов, длительность которых не говорит о прокси (getUpdates)"""
+        proxy.requests += 1
+        if proxy.ejected_until:
+            logger.info(f"Прокси {proxy.label} снова в ротации")
+        proxy.consecutive_failures = 0
+        proxy.ejected_until = 0.0
+        if latency is not None:
+            proxy.latencies.append(latency)
+            if proxy.latency_ewma is None:
+                proxy.latency_ewma = latency
+            else:
+                proxy.latency_ewma += LATENCY_EWMA_ALPHA * (latency - proxy.latency_ewma)
+            PROXY_LATENCY.observe(latency, proxy=proxy.label)
+
+    def record_failure(self, proxy: ProxyState, error: Exception):
+        proxy.requests += 1
+        proxy.failures += 1
+        proxy.consecutive_failures += 1
+        proxy.last_error = str(error) or type(error).__name__
+        PROXY_FAILURES.inc(proxy=proxy.label)
+        if proxy.consecutive_failures >= self.max_failures and proxy.is_admitted(time.monotonic()):
+            proxy.ejected_until = time.monotonic() + self.eject_seconds
+            logger.warning(
+                f"Прокси {proxy.label} исключён на {self.eject_seconds:.0f} с после "
+                f"{proxy.consecutive_failures} ошибок подряд: {proxy.last_error}"
+            )
+
+    def stats(self) -> list:
+        """Статистика по прокси: [{label, admitted, ejected_for, requests, failures, p50, p95, ewma}]"""
+        now = time.monotonic()
+        return [
+            {
+                "label": proxy.label,
+                "admitted": proxy.is_admitted(now),
+                "ejected_for": max(0.0, proxy.ejected_until - now),
+                "requests": proxy.requests,
+                "failures": proxy.failures,
+                "p50": proxy.percentile(50),
+                "p95": proxy.percentile(95),
+                "ewma": proxy.latency_ewma,
+                "last_error": proxy.last_error,
+            }
+            for proxy in self.proxies
+        ]
+
+
+class ProxyPoolRequest(BaseRequest):
+    """
+    Транспорт Bot API поверх ProxyPool: по HTTPXRequest на каждый прокси, прокси выбирается на каждый запрос.
+    Если соединение с прокси не установилось (запрос не ушёл в Telegram), запрос повторяется через другой прокси;
+    прочие ошибки не повторяются, чтобы сообщение не ушло дважды.
+    """
+
+    def __init__(self, pool: ProxyPool, connection_pool_size: int = 1, **timeouts):
+        self.pool = pool
+        self._timeouts = timeouts
+        self._requests = {
+            proxy.url: HTTPXRequest(connection_pool_size=connection_pool_size, proxy=proxy.url, **timeouts)
+            for proxy in pool.proxies
+        }
+
+    @property
+    def read_timeout(self):
+        return self._timeouts.get("read_timeout", 5.0)
+
+    async def initialize(self):
+        await asyncio.gather(*(request.initialize() for request in self._requests.values()))
+
+    async def shutdown(self):
+        await asyncio.gather(*(request.shutdown() for request in self._requests.values()))
+
+    async def do_request(self, url, method, request_data=None, read_timeout=BaseRequest.DEFAULT_NONE,
+                         write_timeout=BaseRequest.DEFAULT_NONE, connect_timeout=BaseRequest.DEFAULT_NONE,
+                         pool_timeout=BaseRequest.DEFAULT_NONE):
+        # Длительность getUpdates — это ожидание новых сообщений (long polling), а не задержка прокси
+        long_poll = url.endswith("/getUpdates")
+        tried = []
+        while True:
+            proxy = self.pool.choose(exclude=tuple(tried))
+            started = time.monotonic()
+            try:
+                result = await self._requests[proxy.url].do_request(
+                    url, method, request_data,
+                    read_timeout=read_timeout, write_timeout=write_timeout,
+                    connect_timeout=connect_timeout, pool_timeout=pool_timeout,
+                )
+            except (TimedOut, NetworkError) as e:
+                if isinstance(e.__cause__, httpx.PoolTimeout):
+                    # Заняты все соединения этого экземпляра, прокси тут ни при чём
+                    raise
+                self.pool.record_failure(proxy, e)
+                tried.append(proxy)
+                if isinstance(e.__cause__, _NOT_SENT_ERRORS) and len(tried) < len(self.pool.proxies):
+                    logger.warning(f"Прокси {proxy.label} недоступен ({e}), повтор через другой прокси")
+                    continue
+                raise
+            code = result[0]
+            if code >= 500 or code == 407:
+                # 5xx и 407 отвечает сам прокси (или недоступен Telegram за ним): задержка ничего не говорит
+                # о прокси, а без учёта ошибки прокси, отвечающий так на всё, никогда не исключался бы
+                self.pool.record_failure(proxy, NetworkError(f"Ответ через прокси: HTTP {code}"))
+            else:
+                self.pool.record_success(proxy, None if long_poll else time.monotonic() - started)
+            return result
+
+    async def probe(self, context):
+        """Проверка прокси запросом getMe (вызывается job_queue): замер задержки и возврат исключённых"""
+        url = f"{context.bot.base_url}/getMe"
+        now = time.monotonic()
+        # Исключённые прокси проверяются, только когда срок исключения истёк
+        proxies = [proxy for proxy in self.pool.proxies if proxy.is_admitted(now)]
+
+        async def probe_one(proxy: ProxyState):
+            started = time.monotonic()
+            try:
+                code, _ = await self._requests[proxy.url].do_request(url, "POST")
+            except (TimedOut, NetworkError) as e:
+                self.pool.record_failure(proxy, e)
+                return
+            if code != 200:
+                # Ответ пришёл, но не от Telegram (ошибка прокси, 407, 502): задержка ничего не говорит о прокси
+                self.pool.record_failure(proxy, NetworkError(f"getMe через прокси вернул HTTP {code}"))
+                return
+            self.pool.record_success(proxy, time.monotonic() - started)
+
+        await asyncio.gather(*(probe_one(proxy) for proxy in proxies))
@@ -0,0 +1,224 @@
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+
+import gspread
+from gspread.exceptions import APIError
+
+from metrics import SHEETS_QUOTA_WAIT, SHEETS_THROTTLED
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета запросов к Google Sheets (меньше — важнее)
+CRITICAL = 0  # Регистрации и флаги напоминаний
+NORMAL = 1    # Интерактивные чтения (расписание)
+BULK = 2      # Сканы листа, получатели рассылок, архив, синхронизация
+
+PRIORITY_NAMES = {CRITICAL: "critical", NORMAL: "normal", BULK: "bulk"}
+
+# Приоритет текущего запроса; передаётся в поток пула вместе с контекстом (см. AsyncGoogleSheets._run)
+REQUEST_PRIORITY = contextvars.ContextVar("sheets_request_priority", default=NORMAL)
+# До какого момента (time.monotonic()) вызывающий ждёт ответа; None — без срока. Передаётся так же, как приоритет:
+# после срока запрос не ждёт квоту и не повторяется — его результат уже никому не нужен
+REQUEST_DEADLINE = contextvars.ContextVar("sheets_request_deadline", default=None)
+
+# Ответы, после которых запрос имеет смысл повторить
+RETRY_STATUS_CODES = {429, 500, 502, 503}
+
+
+def is_idempotent(method: str, endpoint: str) -> bool:
+    """
+    Можно ли повторить запрос, не зная, выполнился ли он. Чтения и перезапись значений — да;
+    дописывание строк (values:append) и правки структуры листа (spreadsheets:batchUpdate, например
+    удаление строк) после повтора выполнились бы дважды
+    """
+    if method.lower() == "get":
+        return True
+    if endpoint.endswith(":append"):
+        return False
+    return not (endpoint.endswith(":batchUpdate") and "/values:" not in endpoint)
+
+
+class _TokenBucket:
+    """Квота запросов в минуту: ёмкость — вся минутная квота, пополнение равномерное"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = max(1.0, per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+
+class SheetsGovernor:
+    """
+    Единая точка перед каждым HTTP-запросом к Google Sheets API.
+    - Отдельные корзины токенов для чтения и записи (SHEETS_READ_QUOTA / SHEETS_WRITE_QUOTA в минуту).
+    - Ожидающие запросы обслуживаются по приоритету: регистрации и флаги напоминаний раньше сканов.
+      Запросы BULK не трогают последние SHEETS_QUOTA_RESERVE квоты — запас для важных.
+    - 429 и 5xx повторяются с экспоненциальной паузой и случайным разбросом; после 429
+      приостанавливаются все запросы того же вида, чтобы не добивать исчерпанную квоту.
+      Неидемпотентные запросы (дописывание строк) после 5xx не повторяются: строки могли уже записаться.
+    - Ожидание квоты и повторы не выходят за срок REQUEST_DEADLINE (таймаут вызывающего).
+    Вызовы блокирующие: выполняются в потоках пула AsyncGoogleSheets или asyncio.to_thread.
+    """
+
+    def __init__(self):
+        # Квоты Google Sheets API по умолчанию — 60 запросов чтения и 60 записи в минуту на пользователя
+        self.buckets = {
+            "read": _TokenBucket(float(os.getenv("SHEETS_READ_QUOTA", "60"))),
+            "write": _TokenBucket(float(os.getenv("SHEETS_WRITE_QUOTA", "60"))),
+        }
+        # Доля квоты, которую запросы BULK оставляют запросам поважнее
+        self.reserve = min(0.9, max(0.0, float(os.getenv("SHEETS_QUOTA_RESERVE", "0.2"))))
+        self.max_retries = max(0, int(os.getenv("SHEETS_MAX_RETRIES", "5")))
+        self.base_backoff = float(os.getenv("SHEETS_BACKOFF_BASE", "1"))
+        self.max_backoff = float(os.getenv("SHEETS_BACKOFF_MAX", "32"))
+        self._paused_until = {kind: 0.0 for kind in self.buckets}
+        self._waiting = {kind: [] for kind in self.buckets}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def execute(self, kind: str, func, *args, idempotent: bool = True, **kwargs):
+        """
+        Выполнить запрос вида kind ('read' или 'write') в пределах квоты, с повторами при 429 и 5xx.
+        idempotent=False — после 5xx запрос не повторяется (429 означает, что запрос отклонён, его повторить можно)
+        """
+        priority = REQUEST_PRIORITY.get()
+        deadline = REQUEST_DEADLINE.get()
+        attempt = 0
+        while True:
+            self.acquire(kind, priority, deadline)
+            try:
+                return func(*args, **kwargs)
+            except APIError as e:
+                status = getattr(e.response, "status_code", None)
+                if status not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                    raise
+                if status != 429 and not idempotent:
+                    # По 5xx не узнать, выполнен ли запрос: повтор мог бы задвоить строки
+                    raise
+                delay = self._backoff(attempt)
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    # Вызывающий перестанет ждать раньше повтора
+                    raise
+                attempt += 1
+                SHEETS_THROTTLED.inc(kind=kind, status=status)
+                logger.warning(
+                    f"Google Sheets ответил {status} ({kind}, {PRIORITY_NAMES[priority]}), "
+                    f"повтор {attempt}/{self.max_retries} через {delay:.1f} с"
+                )
+                if status == 429:
+                    # Квота исчерпана: ждут все запросы этого вида, а не только повторяемый
+                    self._pause(kind, delay)
+                else:
+                    time.sleep(delay)
+
+    def _backoff(self, attempt: int) -> float:
+        # Половина паузы фиксирована, половина случайна: повторы разных потоков не совпадают
+        delay = min(self.max_backoff, self.base_backoff * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _pause(self, kind: str, seconds: float):
+        with self._condition:
+            now = time.monotonic()
+            self._paused_until[kind] = max(self._paused_until[kind], now + seconds)
+            self.buckets[kind].refill(now)
+            self.buckets[kind].tokens = 0.0
+            self._condition.notify_all()
+
+    def _needed(self, kind: str, priority: int) -> float:
+        bucket = self.buckets[kind]
+        # Запросы BULK ждут, пока в корзине не останется больше зарезервированного
+        needed = 1.0 + (bucket.capacity * self.reserve if priority >= BULK else 0.0)
+        return min(needed, bucket.capacity)
+
+    def admission_delay(self, kind: str, priority: int = NORMAL) -> float:
+        """
+        Через сколько секунд запрос этого приоритета получил бы токен (0 — сразу), без учёта очереди.
+        Токены не расходуются: по этой оценке вызывающий ждёт квоту, ещё не заняв поток пула
+        """
+        bucket = self.buckets[kind]
+        needed = self._needed(kind, priority)
+        with self._condition:
+            now = time.monotonic()
+            bucket.refill(now)
+            return max(0.0, self._paused_until[kind] - now, (needed - bucket.tokens) / bucket.rate)
+
+    def acquire(self, kind: str, priority: int = NORMAL, deadline: float | None = None):
+        """
+        Дождаться токена: первым его получает ожидающий запрос с наивысшим приоритетом.
+        TimeoutError — срок deadline (time.monotonic()) истёк раньше, чем нашёлся токен
+        """
+        bucket = self.buckets[kind]
+        waiting = self._waiting[kind]
+        needed = self._needed(kind, priority)
+        started = time.monotonic()
+
+        with self._condition:
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(waiting, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    bucket.refill(now)
+                    paused_for = self._paused_until[kind] - now
+                    if waiting[0] == ticket and paused_for <= 0 and bucket.tokens >= needed:
+                        bucket.tokens -= 1.0
+                        break
+                    if deadline is not None and now >= deadline:
+                        raise TimeoutError(
+                            f"Квота Google Sheets ({kind}, {PRIORITY_NAMES.get(priority)}) "
+                            f"не освободилась за {now - started:.1f} с"
+                        )
+                    timeout = max(paused_for, (needed - bucket.tokens) / bucket.rate, 0.01)
+                    if deadline is not None:
+                        timeout = min(timeout, max(deadline - now, 0.01))
+                    self._condition.wait(timeout=timeout)
+            finally:
+                waiting.remove(ticket)
+                heapq.heapify(waiting)
+                self._condition.notify_all()
+
+        waited = time.monotonic() - started
+        SHEETS_QUOTA_WAIT.observe(waited, kind=kind, priority=PRIORITY_NAMES.get(priority, str(priority)))
+        if waited >= 5:
+            logger.info(f"Запрос к Google Sheets ({kind}, {PRIORITY_NAMES.get(priority)}) ждал квоту {waited:.1f} с")
+
+    def headroom(self) -> dict:
+        """Остаток квоты: {вид: {available, capacity, waiting, paused_for}}"""
+        with self._condition:
+            now = time.monotonic()
+            result = {}
+            for kind, bucket in self.buckets.items():
+                bucket.refill(now)
+                result[kind] = {
+                    "available": round(bucket.tokens, 2),
+                    "capacity": bucket.capacity,
+                    "waiting": len(self._waiting[kind]),
+                    "paused_for": round(max(0.0, self._paused_until[kind] - now), 2),
+                }
+            return result
+
+
+class GovernedClient(gspread.Client):
+    """Клиент gspread, каждый HTTP-запрос которого проходит через SheetsGovernor"""
+
+    def __init__(self, auth, session=None, governor: SheetsGovernor | None = None):
+        super().__init__(auth, session)
+        self.governor = governor or SheetsGovernor()
+
+    def request(self, method, endpoint, *args, **kwargs):
+        kind = "read" if method.lower() == "get" else "write"
+        return self.governor.execute(
+            kind, super().request, method, endpoint, *args, idempotent=is_idempotent(method, endpoint), **kwargs
+        )
+
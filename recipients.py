@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from telegram.error import BadRequest, Forbidden
+
+logger = logging.getLogger(__name__)
+
+
+def is_dead_chat_error(error: Exception) -> bool:
+    """Бот заблокирован, пользователь удалён или чат не найден — повторная отправка не поможет"""
+    if isinstance(error, Forbidden):
+        return True
+    return isinstance(error, BadRequest) and "chat not found" in str(error).lower()
+
+
+class RecipientIndex:
+    """
+    Получатели рассылок (SQLite): пополняется при каждой регистрации и периодически сверяется
+    с историей записей в таблице, поэтому /announce_new_exam не перечитывает лист.
+    Чаты, которые вернули Forbidden или «chat not found», помечаются неактивными и в рассылки не попадают,
+    пока администратор их не вернёт или пользователь снова не запишется.
+    """
+
+    def __init__(self, path: str | None = None):
+        self.path = path or os.getenv("RECIPIENTS_DB_PATH", "recipients.db")
+        # Как часто (сек) добавлять в индекс Telegram ID из истории записей (ручные правки, другие экземпляры)
+        self.sync_interval = float(os.getenv("RECIPIENTS_SYNC_INTERVAL", "3600"))
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # База открывается при первом обращении, а не при импорте модуля
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS recipients (
+                    chat_id INTEGER PRIMARY KEY,
+                    added_at REAL NOT NULL,
+                    registered_at REAL,
+                    active INTEGER NOT NULL DEFAULT 1,
+                    inactive_at REAL,
+                    inactive_reason TEXT
+                )
+                """
+            )
+            self._conn.commit()
+        return self._conn
+
+    # --- Синхронные операции с SQLite ---
+
+    def _add(self, chat_id: int):
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            # Новая регистрация означает, что чат жив: неактивный получатель возвращается в рассылки
+            conn.execute(
+                """
+                INSERT INTO recipients (chat_id, added_at, registered_at) VALUES (?, ?, ?)
+                ON CONFLICT (chat_id) DO UPDATE SET
+                    registered_at = excluded.registered_at, active = 1, inactive_at = NULL, inactive_reason = NULL
+                """,
+                (chat_id, now, now),
+            )
+            conn.commit()
+
+    def _merge(self, chat_ids: list) -> int:
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO recipients (chat_id, added_at) VALUES (?, ?)",
+                [(chat_id, now) for chat_id in chat_ids],
+            )
+            conn.commit()
+            return conn.total_changes - before
+
+    def _mark_inactive(self, chat_id: int, reason: str):
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                """
+                INSERT INTO recipients (chat_id, added_at, active, inactive_at, inactive_reason) VALUES (?, ?, 0, ?, ?)
+                ON CONFLICT (chat_id) DO UPDATE SET
+                    active = 0, inactive_at = excluded.inactive_at, inactive_reason = excluded.inactive_reason
+                """,
+                (chat_id, time.time(), time.time(), reason),
+            )
+            conn.commit()
+
+    def _reset_inactive(self, chat_ids: list | None) -> int:
+        with self._lock:
+            conn = self._connection()
+            if chat_ids is None:
+                cursor = conn.execute(
+                    "UPDATE recipients SET active = 1, inactive_at = NULL, inactive_reason = NULL WHERE active = 0"
+                )
+            else:
+                cursor = conn.executemany(
+                    "UPDATE recipients SET active = 1, inactive_at = NULL, inactive_reason = NULL "
+                    "WHERE active = 0 AND chat_id = ?",
+                    [(chat_id,) for chat_id in chat_ids],
+                )
+            conn.commit()
+            return cursor.rowcount
+
+    def active_ids(self) -> list:
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT chat_id FROM recipients WHERE active = 1 ORDER BY chat_id"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def inactive(self) -> list:
+        """[(chat_id, когда помечен, причина)], последние помеченные первыми"""
+        with self._lock:
+            return self._connection().execute(
+                "SELECT chat_id, inactive_at, inactive_reason FROM recipients WHERE active = 0 "
+                "ORDER BY inactive_at DESC"
+            ).fetchall()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._connection().execute("SELECT COUNT(*) FROM recipients").fetchone()[0]
+
+    # --- Асинхронный интерфейс ---
+
+    async def add(self, chat_id: int):
+        """Пользователь записался (вызывается при сохранении регистрации)"""
+        await asyncio.to_thread(self._add, int(chat_id))
+
+    async def merge(self, chat_ids: list) -> int:
+        """Добавить недостающих получателей (статус уже известных не меняется). Возвращает число добавленных"""
+        added = await asyncio.to_thread(self._merge, [int(chat_id) for chat_id in chat_ids])
+        if added:
+            logger.info(f"В индекс получателей рассылок добавлено: {added}")
+        return added
+
+    async def mark_inactive(self, chat_id: int, reason: str):
+        """Чат недоступен (бот заблокирован, чат удалён): в следующие рассылки не попадает"""
+        await asyncio.to_thread(self._mark_inactive, int(chat_id), reason)
+        logger.info(f"Получатель {chat_id} помечен неактивным: {reason}")
+
+    async def reset_inactive(self, chat_ids: list | None = None) -> int:
+        """Вернуть в рассылки неактивные чаты (все или указанные). Возвращает число возвращённых"""
+        return await asyncio.to_thread(self._reset_inactive, chat_ids)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -1,101 +1,365 @@
+import asyncio
+import bisect
+import heapq
 import logging
+import os
+import time
 from datetime import datetime, timedelta
 import pytz
+from apscheduler.jobstores.base import JobLookupError
 
+from metrics import REMINDER_LAG, REMINDERS_FAILED, REMINDERS_SENT
 from messages import TEXT_REMINDER_15M, reminder_1h_text, zoom_link_for_day_name
 
 logger = logging.getLogger(__name__)
 
+# Типы напоминаний и за сколько до экзамена они отправляются
+REMINDER_OFFSETS = {
+    "1h": timedelta(hours=1),
+    "15m": timedelta(minutes=15),
+}
+
+REMINDER_LABELS = {
+    "1h": "за час",
+    "15m": "за 15 минут",
+}
+
 
 class ReminderScheduler:
-    """Класс для управления напоминаниями через периодическую проверку Google Sheets"""
-    
+    """
+    Класс для управления напоминаниями.
+    Для каждого неотправленного напоминания вычисляется точное время отправки;
+    очередь хранится в min-heap, а job_queue будится ровно к ближайшему напоминанию.
+    """
+
     def __init__(self):
         self.timezone = pytz.timezone("Asia/Novosibirsk")  # Время в таблице — новосибирское
         self.sheets = None
         self.bot = None
-    
-    def initialize(self, sheets, bot):
-        """Инициализация с Google Sheets и ботом"""
+        self.job_queue = None
+        # Напоминания, время которых прошло, пока бот был выключен, досылаются в течение этого окна
+        self.catchup_window = timedelta(minutes=int(os.getenv("REMINDER_CATCHUP_MINUTES", "10")))
+        # Как часто пересобирать очередь из таблицы (ручные правки времени экзамена)
+        self.resync_interval = int(os.getenv("REMINDER_RESYNC_INTERVAL", "300"))
+        # Сколько напоминаний одного запуска отправляется параллельно
+        self.concurrency = max(1, int(os.getenv("REMINDER_CONCURRENCY", "10")))
+        # Очередь: (время отправки, номер строки, тип); актуальные записи лежат в _pending
+        self._heap = []
+        self._pending = {}
+        self._in_flight = set()
+        self._wake_job = None
+        # Журнал доставки (DeliveryLedger): что уже отправлено, независимо от флагов в таблице
+        self.ledger = None
+        # Очередь ведёт только лидер (см. LeaderLease); остальные экземпляры напоминания не отправляют
+        self.active = False
+        # LeaderLease: перед каждой отправкой проверяется, что аренда ещё действует (None — один экземпляр)
+        self.lease = None
+
+    def initialize(self, sheets, bot, job_queue=None, ledger=None, lease=None):
+        """Инициализация с асинхронным фасадом Google Sheets, ботом, очередью задач, журналом доставки и арендой лидера"""
         self.sheets = sheets
         self.bot = bot
+        self.job_queue = job_queue
+        self.ledger = ledger
+        self.lease = lease
         logger.info("ReminderScheduler инициализирован")
-    
-    async def check_and_send_reminders(self, context=None):
-        """Проверка и отправка напоминаний (вызывается каждую минуту)"""
+
+    def _holds_lease(self) -> bool:
+        # active снимается только в on_lost, а аренда могла истечь раньше (завис event loop, медленный renew)
+        return self.active and (self.lease is None or self.lease.is_leader)
+
+    async def start(self):
+        """Экземпляр стал лидером: журнал доставки перечитывается, очередь строится при ближайшей пересборке"""
+        if self.ledger:
+            # Пока лидером был другой экземпляр, журнал мог пополниться
+            await self.ledger.load()
+        self.active = True
+
+    def stop(self):
+        """Экземпляр перестал быть лидером: очередь и будильник сбрасываются"""
+        self.active = False
+        self.clear()
+
+    def clear(self):
+        """Сбросить очередь и будильник (её заново заполнит ближайшая пересборка)"""
+        self._heap = []
+        self._pending = {}
+        if self._wake_job is not None:
+            try:
+                self._wake_job.schedule_removal()
+            except JobLookupError:
+                # При завершении бота JobQueue останавливается раньше — снимать уже нечего
+                pass
+            self._wake_job = None
+
+    def schedule_exam(self, exam: dict):
+        """
+        Поставить в очередь напоминания для одной записи.
+        exam — словарь в формате get_all_exams_for_reminders (row_number, telegram_id, exam_datetime, ...).
+        """
+        if not self.active:
+            return 0
+        now = datetime.now(pytz.UTC).astimezone(self.timezone)
+        scheduled = self._plan_exam(exam, now)
+        if scheduled:
+            self._arm()
+        return scheduled
+
+    def _plan_exam(self, exam: dict, now: datetime) -> int:
+        scheduled = 0
+        exam_datetime = exam["exam_datetime"]
+
+        for reminder_type, offset in REMINDER_OFFSETS.items():
+            key = (exam["row_number"], reminder_type)
+            if exam.get(f"reminder_{reminder_type}_sent") or key in self._in_flight:
+                continue
+            if self.ledger and self.ledger.is_done(exam, reminder_type):
+                continue
+
+            fire_at = exam_datetime - offset
+            if fire_at < now - self.catchup_window or exam_datetime <= now:
+                # Окно досылки прошло — напоминание уже неактуально
+                continue
+
+            entry = (fire_at, exam["row_number"], reminder_type)
+            self._pending[key] = (entry, exam)
+            heapq.heappush(self._heap, entry)
+            scheduled += 1
+
+        return scheduled
+
+    async def rebuild(self, context=None):
+        """Пересобрать очередь напоминаний по данным таблицы (при старте и периодически). Возвращает число запланированных"""
         if not self.sheets:
             logger.warning("ReminderScheduler не инициализирован (нет sheets)")
             return
-        
-        # Используем bot из context, если передан, иначе из self.bot
+        if not self.active:
+            return
+
+        # Квоту на скан листа ждём до row_lock, чтобы не задерживать дозапись регистраций
+        await self.sheets.wait_for_quota()
+        # Номера строк в очереди должны совпадать с таблицей, пока очередь строится и сверяется
+        async with self.sheets.row_lock:
+            return await self._rebuild()
+
+    async def _rebuild(self):
+        try:
+            exams = await self.sheets.get_all_exams_for_reminders()
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке записей для напоминаний: {e}", exc_info=True)
+            return
+        if not self.active:
+            # Лидерство потеряно, пока загружались записи
+            return
+
+        now = datetime.now(pytz.UTC).astimezone(self.timezone)
+        self._heap = []
+        self._pending = {}
+
+        scheduled = 0
+        for exam in exams:
+            scheduled += self._plan_exam(exam, now)
+
+        self._arm()
+        logger.info(f"Очередь напоминаний пересобрана: {scheduled} запланировано")
+        await self._reconcile(exams)
+        return scheduled
+
+    def renumber_rows(self, deleted_rows: list):
+        """
+        Строки удалены из таблицы (перенос в архив): номера строк в очереди сдвигаются вслед за таблицей.
+        Вызывается под sheets.row_lock, поэтому отправляемых прямо сейчас напоминаний нет.
+        """
+        deleted_rows = sorted(deleted_rows)
+        deleted = set(deleted_rows)
+        pending = {}
+        for (row_number, reminder_type), (entry, exam) in self._pending.items():
+            if row_number in deleted:
+                continue
+            new_row_number = row_number - bisect.bisect_left(deleted_rows, row_number)
+            new_entry = (entry[0], new_row_number, reminder_type)
+            pending[(new_row_number, reminder_type)] = (new_entry, dict(exam, row_number=new_row_number))
+
+        self._pending = pending
+        self._heap = [entry for entry, _ in pending.values()]
+        heapq.heapify(self._heap)
+        self._arm()
+        logger.info(f"Номера строк в очереди напоминаний пересчитаны после удаления {len(deleted_rows)} строк")
+
+    async def _reconcile(self, exams: list):
+        """
+        Сверка журнала доставки с таблицей: отметки об отправленных напоминаниях, которые не дошли
+        до таблицы (ошибка записи, ручная правка), восстанавливаются одним пакетом
+        """
+        if not self.ledger:
+            return
+        missing = [
+            (exam["row_number"], reminder_type)
+            for exam in exams
+            for reminder_type in REMINDER_OFFSETS
+            if not exam.get(f"reminder_{reminder_type}_sent") and self.ledger.status(exam, reminder_type) == "sent"
+        ]
+        if missing:
+            logger.info(f"Сверка с журналом доставки: восстанавливаем {len(missing)} отметок в таблице")
+            await self._mark_sent(missing)
+
+    def _arm(self):
+        """Перезавести будильник job_queue на ближайшее напоминание"""
+        if not self.job_queue:
+            logger.warning("JobQueue недоступен — напоминания не будут отправляться")
+            return
+
+        # Выбрасываем из вершины кучи записи, которые были перепланированы
+        while self._heap and not self._is_current(self._heap[0]):
+            heapq.heappop(self._heap)
+
+        if self._wake_job is not None:
+            try:
+                self._wake_job.schedule_removal()
+            except JobLookupError:
+                # Задача уже выполнилась или пропущена планировщиком — снимать нечего
+                pass
+            self._wake_job = None
+
+        if not self._heap:
+            return
+
+        # Просроченное напоминание (поздняя запись, досылка после перезапуска, долгая отправка)
+        # будим сразу: задачу с прошедшим временем APScheduler пропустил бы как опоздавшую
+        now = datetime.now(pytz.UTC).astimezone(self.timezone)
+        self._wake_job = self.job_queue.run_once(
+            self._on_wake,
+            when=max(self._heap[0][0], now),
+            name="send_reminders",
+            job_kwargs={"misfire_grace_time": None},
+        )
+
+    def _is_current(self, entry: tuple) -> bool:
+        planned = self._pending.get((entry[1], entry[2]))
+        return planned is not None and planned[0] == entry
+
+    def _pop_due(self, now: datetime) -> list:
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            if not self._is_current(entry):
+                continue
+            _, exam = self._pending.pop((entry[1], entry[2]))
+            due.append((entry[2], exam))
+        return due
+
+    async def _on_wake(self, context=None):
+        """Отправка всех напоминаний, время которых наступило"""
+        self._wake_job = None
         bot = context.bot if context and hasattr(context, 'bot') else self.bot
-        if not bot:
-            logger.warning("ReminderScheduler не инициализирован (нет bot)")
+
+        # Между отправкой и отметкой в таблице номера строк не должны сдвигаться
+        async with self.sheets.row_lock:
+            await self._send_due(bot)
+
+    async def _send_due(self, bot):
+        now = datetime.now(pytz.UTC).astimezone(self.timezone)
+        due = self._pop_due(now)
+
+        try:
+            started = time.monotonic()
+            semaphore = asyncio.Semaphore(self.concurrency)
+            sent = []
+            delivered_at = []
+
+            skipped = []
+
+            async def send_limited(reminder_type: str, exam: dict):
+                async with semaphore:
+                    if not self._holds_lease():
+                        # Аренду мог забрать другой экземпляр: неотправленное напоминание без флага
+                        # в таблице снова попадёт в очередь при пересборке у действующего лидера
+                        skipped.append((exam["row_number"], reminder_type))
+                        return
+                    if await self._send_reminder(bot, exam, reminder_type):
+                        sent.append((exam["row_number"], reminder_type))
+                        delivered_at.append(time.monotonic())
+
+            # Ошибки отдельных сообщений обрабатываются внутри _send_reminder и не мешают остальным
+            await asyncio.gather(*(send_limited(reminder_type, exam) for reminder_type, exam in due))
+            if skipped:
+                logger.warning(f"Аренда лидера не подтверждена: {len(skipped)} напоминаний не отправлено")
+
+            if sent:
+                logger.info(
+                    f"Отправлено {len(sent)} из {len(due)} напоминаний за {time.monotonic() - started:.2f} с "
+                    f"(разброс между первым и последним: {max(delivered_at) - min(delivered_at):.2f} с)"
+                )
+                await self._mark_sent(sent)
+        finally:
+            self._arm()
+
+    async def _mark_sent(self, sent: list):
+        """Отметить отправленные напоминания в таблице одним пакетом"""
+        try:
+            failed = await self.sheets.mark_reminders_sent(sent)
+        except Exception as e:
+            logger.error(f"Ошибка при отметке {len(sent)} напоминаний в таблице: {e}", exc_info=True)
             return
-        
+
+        for (row_number, reminder_type), error in failed.items():
+            logger.error(f"Напоминание {reminder_type} для строки {row_number} не отмечено в таблице: {error}")
+
+    async def _send_reminder(self, bot, exam: dict, reminder_type: str) -> bool:
+        telegram_id = exam.get("telegram_id", "")
+        if not telegram_id:
+            return False
+
         try:
-            # Получаем все экзамены из таблицы
-            exams = self.sheets.get_all_exams_for_reminders()
-            
-            # Текущее время в часовом поясе экзаменов (НСК), не зависит от сервера
-            now = datetime.now(pytz.UTC).astimezone(self.timezone)
-            sent_count = 0
-            
-            for exam in exams:
-                exam_datetime = exam["exam_datetime"]
-                telegram_id = exam.get("telegram_id", "")
-                
-                if not telegram_id:
-                    continue
-                
+            telegram_id = int(telegram_id)
+        except (ValueError, TypeError):
+            logger.warning(f"Некорректный Telegram ID: {telegram_id}")
+            return False
+
+        if reminder_type == "1h":
+            day_name = exam.get("day_name", "").strip()
+            text = reminder_1h_text(zoom_link_for_day_name(day_name))
+        else:
+            text = TEXT_REMINDER_15M
+
+        key = (exam["row_number"], reminder_type)
+        label = REMINDER_LABELS[reminder_type]
+        if self.ledger and self.ledger.is_done(exam, reminder_type):
+            return False
+
+        self._in_flight.add(key)
+        try:
+            if self.ledger:
+                # Попытка фиксируется до отправки: после падения напоминание не уйдёт второй раз
                 try:
-                    telegram_id = int(telegram_id)
-                except (ValueError, TypeError):
-                    logger.warning(f"Некорректный Telegram ID: {telegram_id}")
-                    continue
-                
-                # Проверяем напоминание за час
-                day_name = exam.get("day_name", "").strip()
-                zoom_link = zoom_link_for_day_name(day_name)
-                msg_1h = reminder_1h_text(zoom_link)
-                
-                reminder_1h_time = exam_datetime - timedelta(hours=1)
-                if not exam["reminder_1h_sent"]:
-                    # Проверяем, нужно ли отправить сейчас (с допуском в 1 минуту)
-                    time_diff = (reminder_1h_time - now).total_seconds()
-                    if 0 <= time_diff <= 60:  # В пределах 1 минуты
-                        try:
-                            await bot.send_message(
-                                chat_id=telegram_id,
-                                text=msg_1h
-                            )
-                            # Отмечаем как отправленное в таблице
-                            self.sheets.mark_reminder_sent(exam["row_number"], "1h")
-                            sent_count += 1
-                            logger.info(f"Напоминание за час отправлено пользователю {telegram_id} ({exam.get('full_name', '')})")
-                        except Exception as e:
-                            logger.error(f"Ошибка при отправке напоминания за час пользователю {telegram_id}: {e}")
-                
-                # Проверяем напоминание за 15 минут
-                reminder_15m_time = exam_datetime - timedelta(minutes=15)
-                if not exam["reminder_15m_sent"]:
-                    # Проверяем, нужно ли отправить сейчас (с допуском в 1 минуту)
-                    time_diff = (reminder_15m_time - now).total_seconds()
-                    if 0 <= time_diff <= 60:  # В пределах 1 минуты
-                        try:
-                            await bot.send_message(
-                                chat_id=telegram_id,
-                                text=TEXT_REMINDER_15M
-                            )
-                            # Отмечаем как отправленное в таблице
-                            self.sheets.mark_reminder_sent(exam["row_number"], "15m")
-                            sent_count += 1
-                            logger.info(f"Напоминание за 15 минут отправлено пользователю {telegram_id} ({exam.get('full_name', '')})")
-                        except Exception as e:
-                            logger.error(f"Ошибка при отправке напоминания за 15 минут пользователю {telegram_id}: {e}")
-            
-            if sent_count > 0:
-                logger.info(f"Отправлено {sent_count} напоминаний")
-                
+                    await self.ledger.record_attempt(exam, reminder_type, telegram_id)
+                except Exception as e:
+                    logger.error(f"Журнал доставки недоступен, напоминание {label} не отправлено: {e}")
+                    return False
+            try:
+                message = await bot.send_message(chat_id=telegram_id, text=text)
+            except Exception as e:
+                REMINDERS_FAILED.inc(type=reminder_type)
+                logger.error(f"Ошибка при отправке напоминания {label} пользователю {telegram_id}: {e}")
+                if self.ledger:
+                    await self._record(self.ledger.record_failed(exam, reminder_type, str(e)))
+                return False
+            REMINDERS_SENT.inc(type=reminder_type)
+            fire_at = exam["exam_datetime"] - REMINDER_OFFSETS[reminder_type]
+            REMINDER_LAG.observe(
+                max(0.0, (datetime.now(pytz.UTC) - fire_at).total_seconds()), type=reminder_type
+            )
+            if self.ledger:
+                await self._record(self.ledger.record_sent(exam, reminder_type, message.message_id))
+            logger.info(f"Напоминание {label} отправлено пользователю {telegram_id} ({exam.get('full_name', '')})")
+            return True
+        finally:
+            self._in_flight.discard(key)
+
+    @staticmethod
+    async def _record(coroutine):
+        """Запись результата в журнал доставки; статус в памяти уже обновлён, ошибка записи только логируется"""
+        try:
+            await coroutine
         except Exception as e:
-            logger.error(f"Ошибка при проверке напоминаний: {e}", exc_info=True)
+            logger.error(f"Ошибка записи в журнал доставки напоминаний: {e}")
@@ -0,0 +1,60 @@
+"""
+Отправка записанного Update (JSON) на локальный webhook бота — для проверки режима BOT_MODE=webhook.
+
+Пример:
+    python scripts/post_update.py scripts/sample_update_start.json
+    python scripts/post_update.py update.json --url http://127.0.0.1:8080/telegram --secret my_secret
+
+По умолчанию адрес и секрет берутся из WEBHOOK_PORT, WEBHOOK_PATH и WEBHOOK_SECRET_TOKEN (.env).
+"""
+import argparse
+import json
+import os
+import sys
+import urllib.error
+import urllib.request
+
+from dotenv import load_dotenv
+
+
+def main():
+    load_dotenv()
+    default_url = (
+        f"http://127.0.0.1:{os.getenv('WEBHOOK_PORT', '8080')}"
+        f"/{os.getenv('WEBHOOK_PATH', 'telegram').strip().strip('/')}"
+    )
+
+    parser = argparse.ArgumentParser(description="Отправить Update JSON на локальный webhook")
+    parser.add_argument("update_file", help="файл с JSON одного Update (или списком Update)")
+    parser.add_argument("--url", default=default_url, help=f"адрес webhook (по умолчанию {default_url})")
+    parser.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET_TOKEN", ""), help="секретный токен")
+    args = parser.parse_args()
+
+    with open(args.update_file, encoding="utf-8") as f:
+        payload = json.load(f)
+    updates = payload if isinstance(payload, list) else [payload]
+
+    headers = {"Content-Type": "application/json"}
+    if args.secret:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = args.secret
+
+    failed = 0
+    for update in updates:
+        request = urllib.request.Request(
+            args.url,
+            data=json.dumps(update, ensure_ascii=False).encode("utf-8"),
+            headers=headers,
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                print(f"update_id={update.get('update_id')}: HTTP {response.status}")
+        except urllib.error.HTTPError as e:
+            failed += 1
+            print(f"update_id={update.get('update_id')}: HTTP {e.code} {e.reason}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
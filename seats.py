@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import os
+from collections import Counter
+
+from storage import parse_exam_datetime
+
+logger = logging.getLogger(__name__)
+
+
+class SeatCounter:
+    """
+    Занятые места по слотам (ключ — дата и время экзамена «DD.MM.YYYY HH:MM»).
+    Счётчики строятся по предстоящим записям хранилища и незаписанным строкам журнала,
+    дальше обновляются при каждой регистрации и периодически сверяются заново
+    (ручные правки таблицы, регистрации на других экземплярах).
+    Проверка и бронирование места выполняются без await, поэтому атомарны в event loop.
+    """
+
+    def __init__(self):
+        # Как часто (сек) пересчитывать занятые места по таблице
+        self.resync_interval = float(os.getenv("SEATS_RESYNC_INTERVAL", "300"))
+        self.sheets = None
+        self.journal = None
+        self._booked = Counter()
+        self._loaded = False
+        # Места, забронированные во время пересчёта (их может не быть в прочитанных данных)
+        self._reserved_during_rebuild = None
+        self._rebuild_task = None
+
+    def initialize(self, sheets, journal):
+        """sheets — асинхронный фасад хранилища, journal — RegistrationJournal"""
+        self.sheets = sheets
+        self.journal = journal
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def booked(self, slot_key: str) -> int:
+        return self._booked[slot_key]
+
+    def has_room(self, slot: dict) -> bool:
+        """
+        В слоте есть свободное место. Пока счётчики не построены,
+        слоты с ограниченной вместимостью считаются занятыми: лучше скрыть слот, чем переполнить
+        """
+        capacity = slot.get("capacity")
+        if capacity is None:
+            return True
+        return self._loaded and self._booked[slot["datetime_str"]] < capacity
+
+    def reserve(self, slot_key: str, capacity: int | None) -> bool:
+        """Занять место в слоте. False — мест нет (или счётчики ещё не построены)"""
+        if capacity is not None and (not self._loaded or self._booked[slot_key] >= capacity):
+            return False
+        self._booked[slot_key] += 1
+        if self._reserved_during_rebuild is not None:
+            self._reserved_during_rebuild.append(slot_key)
+        return True
+
+    def release(self, slot_key: str):
+        """Вернуть место (регистрацию не удалось сохранить)"""
+        if self._booked[slot_key] > 0:
+            self._booked[slot_key] -= 1
+        if self._reserved_during_rebuild and slot_key in self._reserved_during_rebuild:
+            self._reserved_during_rebuild.remove(slot_key)
+
+    async def ensure_loaded(self) -> bool:
+        """Построить счётчики, если их ещё нет"""
+        if not self._loaded:
+            await self.rebuild()
+        return self._loaded
+
+    async def rebuild(self, context=None):
+        """
+        Пересчитать занятые места по хранилищу и журналу регистраций (при старте и периодически).
+        Одновременные вызовы (задача job_queue, подключение хранилища, /refresh_slots, ensure_loaded)
+        ждут один пересчёт: у двух параллельных был бы общий список броней, и один терял бы брони другого
+        """
+        if not self.sheets or not self.journal:
+            logger.warning("SeatCounter не инициализирован (нет sheets или journal)")
+            return
+
+        if self._rebuild_task is None or self._rebuild_task.done():
+            self._rebuild_task = asyncio.create_task(self._rebuild())
+        await asyncio.shield(self._rebuild_task)
+
+    async def _rebuild(self):
+        reserved = self._reserved_during_rebuild = []
+        try:
+            # Квоту на скан листа ждём до row_lock, чтобы не задерживать дозапись регистраций
+            await self.sheets.wait_for_quota()
+            # Пока держится row_lock, журнал не переносит строки в таблицу:
+            # каждая регистрация попадает либо в прочитанные записи, либо в незаписанные строки журнала
+            async with self.sheets.row_lock:
+                exams = await self.sheets.get_all_exams_for_reminders()
+                pending_rows = await asyncio.to_thread(self.journal.pending_rows)
+        except Exception as e:
+            logger.error(f"Ошибка пересчёта занятых мест: {e}")
+            return
+        finally:
+            # Дальше до замены счётчиков await нет: новых броней в reserved уже не появится
+            self._reserved_during_rebuild = None
+
+        booked = Counter(exam["exam_datetime"].strftime("%d.%m.%Y %H:%M") for exam in exams)
+        for row in pending_rows:
+            exam_datetime = parse_exam_datetime(str(row[7])) if len(row) > 7 else None
+            if exam_datetime is not None:
+                booked[exam_datetime.strftime("%d.%m.%Y %H:%M")] += 1
+        # Брони, сделанные во время чтения, могли в него не попасть: лучше ненадолго завысить счётчик
+        booked.update(reserved)
+
+        self._booked = booked
+        self._loaded = True
+        logger.info(f"Занятые места пересчитаны: {sum(booked.values())} записей в {len(booked)} слотах")
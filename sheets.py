@@ -1,25 +1,47 @@
+import bisect
+import functools
 import os
+import re
+import threading
 import gspread
+from gspread.utils import rowcol_to_a1
 from google.oauth2.service_account import Credentials
 from datetime import datetime, timedelta
 import logging
 import pytz
 
+from mirror import RegistrationsMirror, column_letter
+from quota import GovernedClient, SheetsGovernor
+from storage import EXAMPLE_SCHEDULE_ROWS, REGISTRATION_HEADERS, SCHEDULE_HEADERS, Storage, parse_exam_datetime
+
 logger = logging.getLogger(__name__)
 
 
-class GoogleSheets:
+class GoogleSheets(Storage):
     """Класс для работы с Google Sheets"""
     
     def __init__(self):
+        super().__init__()
         self.client = None
         self.spreadsheet = None
         self.worksheet = None
         self.schedule_worksheet = None
+        self.registrations = None
+        # Квоты Google Sheets API: все HTTP-запросы клиента проходят через governor (см. quota.py)
+        self.governor = SheetsGovernor()
+        # Индекс дат экзаменов по локальной копии листа (см. _update_exam_index)
+        self._exam_index = []
+        self._exam_index_size = 0
+        self._exam_index_generation = None
+        self._exam_index_lock = threading.Lock()
+        # ((поколение копии, start_row), Telegram ID из архивных листов и строк выше start_row)
+        self._history_ids = None
+        # Записи на экзамены, прошедшие больше N дней назад, переносятся в архивные листы (0 — не переносить)
+        self.archive_after = timedelta(days=float(os.getenv("REGISTRATIONS_ARCHIVE_AFTER_DAYS", "14")))
+        # Как часто (в секундах) запускать перенос в архив
+        self.archive_interval = int(os.getenv("REGISTRATIONS_ARCHIVE_INTERVAL", "21600"))
         self.sheet_id = os.getenv("GOOGLE_SHEET_ID")
         self.credentials_path = os.getenv("GOOGLE_CREDENTIALS_PATH", "credentials.json")
-        # Часовой пояс, в котором указано время в таблице (НСК)
-        self.timezone = pytz.timezone("Asia/Novosibirsk")
     
     def initialize(self):
         """Инициализация подключения к Google Sheets"""
@@ -36,8 +58,11 @@ class GoogleSheets:
                 scopes=scope
             )
             
-            # Создаем клиент
-            self.client = gspread.authorize(creds)
+            # Создаем клиент (каждый запрос ждёт токен квоты и повторяется при 429/5xx)
+            self.client = gspread.authorize(
+                creds,
+                client_factory=functools.partial(GovernedClient, governor=self.governor),
+            )
             
             # Открываем таблицу
             if not self.sheet_id:
@@ -56,20 +81,11 @@ class GoogleSheets:
                     cols=11
                 )
                 # Добавляем заголовки
-                headers = [
-                    "Дата записи",
-                    "Telegram ID",
-                    "Имя пользователя",
-                    "Имя и фамилия",
-                    "Тип экзамена",
-                    "День",
-                    "Время",
-                    "Дата и время экзамена",
-                    "Преподаватель",
-                    "Напоминание за час отправлено",
-                    "Напоминание за 15 минут отправлено"
-                ]
-                self.worksheet.append_row(headers)
+                self.worksheet.append_row(REGISTRATION_HEADERS)
+            
+            self.registrations = RegistrationsMirror(
+                self.worksheet, self.MIRROR_COLUMNS, start_row=self._mirror_start_row()
+            )
             
             # Получаем или создаём лист "Даты экзаменов" с расписанием
             try:
@@ -81,18 +97,8 @@ class GoogleSheets:
                     rows=100,
                     cols=5
                 )
-                # Заголовки: Дата, Время, Zoom, Контакт
-                headers = ["Дата", "Время", "Zoom", "Контакт"]
-                self.schedule_worksheet.append_row(headers)
-                # Пример данных для заполнения (суббота 28.02, воскресенье 01.03)
-                example_rows = [
-                    ["28.02.2026", "11:00", "https://us06web.zoom.us/j/9709286191", "@vasilina45"],
-                    ["28.02.2026", "15:00", "https://us06web.zoom.us/j/9709286191", "@vasilina45"],
-                    ["01.03.2026", "10:00", "https://us06web.zoom.us/j/5621545595?pwd=EEaV6rb8Dr8UgaaL9AF4wbarlhraNV.1", "@dkvnastya"],
-                    ["01.03.2026", "14:00", "https://us06web.zoom.us/j/5621545595?pwd=EEaV6rb8Dr8UgaaL9AF4wbarlhraNV.1", "@dkvnastya"],
-                ]
-                for row in example_rows:
-                    self.schedule_worksheet.append_row(row)
+                # Заголовки и пример данных для заполнения — одним запросом
+                self.schedule_worksheet.append_rows([SCHEDULE_HEADERS] + EXAMPLE_SCHEDULE_ROWS)
                 logger.info("Создан лист 'Даты экзаменов' с примером расписания")
             
             logger.info("Google Sheets успешно инициализирован")
@@ -101,30 +107,31 @@ class GoogleSheets:
             logger.error(f"Ошибка инициализации Google Sheets: {e}")
             raise
     
-    def save_registration(self, user_data: dict):
-        """Сохранение данных регистрации в таблицу"""
+    def append_registrations(self, rows: list):
+        """
+        Добавление пачки строк в лист "Записи" одним запросом append_rows.
+        Возвращает номер первой добавленной строки (или None, если его не удалось определить).
+        """
         if not self.worksheet:
             raise RuntimeError("Google Sheets не инициализирован")
         
-        # Подготавливаем данные для записи (дата записи — в том же часовом поясе, что и экзамены)
-        now_nsk = datetime.now(pytz.UTC).astimezone(self.timezone)
-        row = [
-            now_nsk.strftime("%d.%m.%Y %H:%M:%S"),  # Дата записи
-            user_data.get("telegram_id", ""),
-            user_data.get("telegram_username", ""),
-            user_data.get("full_name", ""),
-            user_data.get("exam_type", ""),
-            user_data.get("day_name", ""),
-            user_data.get("time", ""),
-            user_data.get("exam_datetime", ""),  # Формат: DD.MM.YYYY HH:MM
-            user_data.get("teacher", ""),
-            "Нет",  # Напоминание за час отправлено
-            "Нет"   # Напоминание за 15 минут отправлено
-        ]
-        
-        # Добавляем строку в таблицу
-        self.worksheet.append_row(row)
-        logger.info(f"Данные сохранены в Google Sheets: {user_data.get('full_name')}")
+        # Добавляем строки в таблицу и сразу в локальную копию, если известны их номера
+        response = self.worksheet.append_rows(rows)
+        first_row_number = self._appended_row_number(response)
+        if first_row_number is not None:
+            for offset, row in enumerate(rows):
+                self.registrations.append_local(first_row_number + offset, row)
+        return first_row_number
+    
+    @staticmethod
+    def _appended_row_number(response):
+        """Номер первой добавленной строки из ответа append_rows ('Записи'!A57:K60 -> 57)"""
+        try:
+            updated_range = response["updates"]["updatedRange"]
+        except (KeyError, TypeError):
+            return None
+        match = re.search(r"![A-Z]+(\d+)", updated_range)
+        return int(match.group(1)) if match else None
     
     def get_exam_slots(self):
         """
@@ -132,130 +139,102 @@ class GoogleSheets:
         Возвращает список словарей: [{date, time, datetime_str, zoom, contact, day_name}, ...]
         Только слоты в будущем.
         """
+        return self.slots_from_records(self.get_schedule_records())
+    
+    def get_schedule_records(self):
+        """Строки листа "Даты экзаменов" как словари {Дата, Время, Zoom, Контакт, Мест}"""
         if not self.schedule_worksheet:
             raise RuntimeError("Google Sheets не инициализирован")
         
-        records = self.schedule_worksheet.get_all_records()
-        slots = []
-        now = datetime.now(pytz.UTC).astimezone(self.timezone)
-        months_ru = ["", "января", "февраля", "марта", "апреля", "мая", "июня",
-                     "июля", "августа", "сентября", "октября", "ноября", "декабря"]
-        days_ru = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"]
-        
-        for idx, record in enumerate(records):
-            date_str = str(record.get("Дата", "")).strip()
-            time_str = str(record.get("Время", "")).strip()
-            zoom = str(record.get("Zoom", "")).strip()
-            contact = str(record.get("Контакт", "")).strip()
-            
-            if not date_str or not time_str:
-                continue
-            
-            try:
-                exam_date = datetime.strptime(date_str, "%d.%m.%Y")
-                exam_time = datetime.strptime(time_str, "%H:%M").time()
-                exam_datetime_naive = datetime.combine(exam_date.date(), exam_time)
-                exam_datetime = self.timezone.localize(exam_datetime_naive)
-                
-                if exam_datetime < now:
-                    continue
-                
-                day_name = days_ru[exam_date.weekday()]
-                display_date = f"{day_name}, {exam_date.day} {months_ru[exam_date.month]} {time_str}"
-                datetime_str = exam_datetime_naive.strftime("%d.%m.%Y %H:%M")
-                
-                slots.append({
-                    "index": idx,
-                    "date": date_str,
-                    "time": time_str,
-                    "datetime_str": datetime_str,
-                    "exam_datetime": exam_datetime,
-                    "zoom": zoom or "https://us06web.zoom.us/j/9709286191",
-                    "contact": contact or "@vasilina45",
-                    "day_name": day_name,
-                    "display": display_date
-                })
-            except (ValueError, TypeError) as e:
-                logger.warning(f"Ошибка парсинга слота: {date_str} {time_str}, {e}")
-                continue
-        
-        return slots
+        return self.schedule_worksheet.get_all_records()
     
     def get_all_exams_for_reminders(self):
         """Получение всех экзаменов для проверки напоминаний"""
         if not self.worksheet:
             raise RuntimeError("Google Sheets не инициализирован")
         
-        # Получаем все записи
-        records = self.worksheet.get_all_records()
-        exams = []
-        now = datetime.now(pytz.UTC).astimezone(self.timezone)
+        generation, headers, start_row, rows = self.registrations.snapshot()
+        with self._exam_index_lock:
+            self._update_exam_index(generation, headers, start_row, rows)
+            upcoming = self._upcoming_exams()
+        columns = {header: index for index, header in enumerate(headers)}
         
-        for idx, record in enumerate(records, start=2):  # Начинаем с 2, так как строка 1 - заголовки
-            exam_datetime_str = record.get("Дата и время экзамена", "")
-            if not exam_datetime_str:
-                continue
-            
-            try:
-                # Парсим формат DD.MM.YYYY HH:MM (время в таблице — новосибирское)
-                exam_datetime_naive = datetime.strptime(exam_datetime_str, "%d.%m.%Y %H:%M")
-                exam_datetime = self.timezone.localize(exam_datetime_naive)
-                
-                # Проверяем, что экзамен еще не прошел (с небольшим запасом в 15 минут после окончания)
-                if exam_datetime >= now - timedelta(minutes=15):
-                    reminder_1h_sent = record.get("Напоминание за час отправлено", "Нет").strip().lower()
-                    reminder_15m_sent = record.get("Напоминание за 15 минут отправлено", "Нет").strip().lower()
-                    
-                    exams.append({
-                        "row_number": idx,  # Номер строки для обновления
-                        "telegram_id": record.get("Telegram ID", ""),
-                        "exam_datetime": exam_datetime,
-                        "full_name": record.get("Имя и фамилия", ""),
-                        "day_name": record.get("День", ""),  # Суббота или Воскресенье
-                        "reminder_1h_sent": reminder_1h_sent in ("да", "yes", "1", "true", "✓"),
-                        "reminder_15m_sent": reminder_15m_sent in ("да", "yes", "1", "true", "✓")
-                    })
-            except ValueError as e:
-                # Пробуем альтернативные форматы
-                try:
-                    exam_datetime = datetime.fromisoformat(exam_datetime_str.replace("Z", "+00:00"))
-                    if exam_datetime.tzinfo:
-                        exam_datetime = exam_datetime.astimezone(self.timezone)
-                    else:
-                        exam_datetime = self.timezone.localize(exam_datetime)
-                    
-                    if exam_datetime >= now - timedelta(minutes=15):
-                        reminder_1h_sent = record.get("Напоминание за час отправлено", "Нет").strip().lower()
-                        reminder_15m_sent = record.get("Напоминание за 15 минут отправлено", "Нет").strip().lower()
-                        
-                        exams.append({
-                            "row_number": idx,
-                            "telegram_id": record.get("Telegram ID", ""),
-                            "exam_datetime": exam_datetime,
-                            "full_name": record.get("Имя и фамилия", ""),
-                            "day_name": record.get("День", ""),
-                            "reminder_1h_sent": reminder_1h_sent in ("да", "yes", "1", "true", "✓"),
-                            "reminder_15m_sent": reminder_15m_sent in ("да", "yes", "1", "true", "✓")
-                        })
-                except (ValueError, TypeError) as e2:
-                    logger.warning(f"Ошибка парсинга даты: {exam_datetime_str}, {e}, {e2}")
-                    continue
-            except (ValueError, TypeError) as e:
-                logger.warning(f"Ошибка парсинга даты: {exam_datetime_str}, {e}")
-                continue
+        def value(row, header, default=""):
+            index = columns.get(header)
+            return row[index] if index is not None and index < len(row) else default
+        
+        exams = []
+        for exam_datetime, idx in upcoming:
+            row = rows[idx - start_row]
+            exams.append({
+                "row_number": idx,  # Номер строки для обновления
+                "telegram_id": value(row, "Telegram ID"),
+                "exam_datetime": exam_datetime,
+                "full_name": value(row, "Имя и фамилия"),
+                "day_name": value(row, "День"),  # Суббота или Воскресенье
+                "reminder_1h_sent": self._is_flag_set(value(row, "Напоминание за час отправлено", "Нет")),
+                "reminder_15m_sent": self._is_flag_set(value(row, "Напоминание за 15 минут отправлено", "Нет"))
+            })
         
         return exams
+    
+    def _update_exam_index(self, generation: int, headers: list, start_row: int, rows: list):
+        """
+        Отсортированный индекс [(дата экзамена, номер строки)] по локальной копии листа.
+        После полной загрузки строится заново, после докачки — дополняется только новыми строками,
+        так что прошедшие экзамены не разбираются на каждом проходе.
+        """
+        if generation != self._exam_index_generation or len(rows) < self._exam_index_size:
+            self._exam_index = []
+            self._exam_index_size = 0
+            self._exam_index_generation = generation
+        
+        if "Дата и время экзамена" not in headers:
+            return
+        column = headers.index("Дата и время экзамена")
+        
+        new_entries = []
+        for idx in range(self._exam_index_size, len(rows)):
+            exam_datetime = parse_exam_datetime(rows[idx][column])
+            if exam_datetime is not None:
+                new_entries.append((exam_datetime, start_row + idx))
+        self._exam_index_size = len(rows)
+        
+        if not new_entries:
+            return
+        new_entries.sort()
+        if self._exam_index and new_entries[0] < self._exam_index[-1]:
+            self._exam_index = sorted(self._exam_index + new_entries)
+        else:
+            self._exam_index.extend(new_entries)
+    
+    def _upcoming_exams(self) -> list:
+        """
+        Экзамены, которые ещё не прошли (с небольшим запасом в 15 минут после начала):
+        по отсортированному индексу сразу переходим к первому актуальному
+        """
+        now = datetime.now(pytz.UTC).astimezone(self.timezone)
+        start = bisect.bisect_left(self._exam_index, (now - timedelta(minutes=15),))
+        return self._exam_index[start:]
+    
+    @staticmethod
+    def _is_flag_set(value) -> bool:
+        return str(value).strip().lower() in ("да", "yes", "1", "true", "✓")
 
     def get_unique_telegram_ids(self):
         """Получение уникальных Telegram ID из истории записей"""
         if not self.worksheet:
             raise RuntimeError("Google Sheets не инициализирован")
 
-        records = self.worksheet.get_all_records()
-        unique_ids = set()
+        generation, headers, start_row, rows = self.registrations.snapshot()
+        values = self._history_telegram_ids(generation, start_row)
+        if "Telegram ID" in headers:
+            column = headers.index("Telegram ID")
+            values = values + [row[column] for row in rows]
 
-        for record in records:
-            telegram_id = str(record.get("Telegram ID", "")).strip()
+        unique_ids = set()
+        for value in values:
+            telegram_id = str(value).strip()
             if not telegram_id:
                 continue
 
@@ -266,24 +245,272 @@ class GoogleSheets:
                 continue
 
         return sorted(unique_ids)
-    
-    def mark_reminder_sent(self, row_number: int, reminder_type: str):
-        """Отметить напоминание как отправленное"""
+
+    def _history_telegram_ids(self, generation: int, start_row: int) -> list:
+        """
+        Telegram ID записей, которых нет в локальной копии: архивные листы и строки выше start_row.
+        Эти строки меняет только перенос в архив (после него копия загружается заново),
+        поэтому они перечитываются только при смене поколения копии.
+        """
+        if self._history_ids is not None and self._history_ids[0] == (generation, start_row):
+            return self._history_ids[1]
+
+        values = []
+        column = self.registrations.column_number("Telegram ID")
+        if column is not None and start_row > 2:
+            cells = self.worksheet.get(f"{rowcol_to_a1(2, column)}:{rowcol_to_a1(start_row - 1, column)}")
+            values.extend(row[0] for row in cells if row)
+        for worksheet in self.spreadsheet.worksheets():
+            if not worksheet.title.startswith(self.ARCHIVE_TITLE_PREFIX):
+                continue
+            header_rows = worksheet.get("1:1")
+            headers = [str(h).strip() for h in header_rows[0]] if header_rows else []
+            if "Telegram ID" not in headers:
+                continue
+            archive_column = headers.index("Telegram ID") + 1
+            cells = worksheet.get(f"{rowcol_to_a1(2, archive_column)}:{column_letter(archive_column)}")
+            values.extend(row[0] for row in cells if row)
+
+        self._history_ids = ((generation, start_row), values)
+        return values
+
+    def _mirror_start_row(self):
+        """
+        Первая строка копии листа "Записи". Перенос в архив удаляет строки и сдвигает оставшиеся вверх,
+        поэтому постоянное смещение REGISTRATIONS_START_ROW при нём скрыло бы предстоящие записи:
+        лист читается со 2-й строки, а маленьким его держит сам перенос
+        """
+        if self.archive_after.total_seconds() <= 0:
+            return None
+        if int(os.getenv("REGISTRATIONS_START_ROW", "2")) > 2:
+            logger.warning("REGISTRATIONS_START_ROW не используется, пока включён перенос записей в архив")
+        return 2
+
+    # Архивные листы: «Архив 2025-2026» — записи на экзамены одного учебного года
+    ARCHIVE_TITLE_PREFIX = "Архив "
+
+    def archive_registrations(self, cutoff: datetime) -> list:
+        """
+        Копирование записей на экзамены раньше cutoff из листа "Записи" в архивные листы (по учебному году).
+        Строки дописываются в архив без повторов — копирование можно безопасно повторить после сбоя.
+        Лист "Записи" не меняется: возвращает [(номер строки, ключ строки)] для delete_archived_rows.
+        """
         if not self.worksheet:
             raise RuntimeError("Google Sheets не инициализирован")
-        
-        # Определяем номер колонки (1-based)
-        if reminder_type == "1h":
-            col_number = 10  # "Напоминание за час отправлено"
-        elif reminder_type == "15m":
-            col_number = 11  # "Напоминание за 15 минут отправлено"
-        else:
-            raise ValueError(f"Неизвестный тип напоминания: {reminder_type}")
-        
+
+        values = self.worksheet.get_all_values()
+        if len(values) < 2:
+            return []
+        headers = [str(h).strip() for h in values[0]]
+        if "Дата и время экзамена" not in headers:
+            logger.warning("В листе 'Записи' нет колонки 'Дата и время экзамена' — перенос в архив пропущен")
+            return []
+        column = headers.index("Дата и время экзамена")
+
+        by_season = {}
+        for row_number, row in enumerate(values[1:], start=2):
+            exam_datetime = parse_exam_datetime(str(row[column])) if column < len(row) else None
+            if exam_datetime is None or exam_datetime >= cutoff:
+                continue
+            row = [str(value) for value in row] + [""] * (len(headers) - len(row))
+            by_season.setdefault(self._season(exam_datetime), []).append((row_number, row))
+        if not by_season:
+            return []
+
+        for season, items in sorted(by_season.items()):
+            archive = self._archive_worksheet(season, headers)
+            archived_keys = self._archive_keys(archive, headers)
+            new_rows = [row for _, row in items if self._archive_key(row, headers) not in archived_keys]
+            if new_rows:
+                archive.append_rows(new_rows)
+            logger.info(
+                f"В лист '{archive.title}' перенесено записей: {len(new_rows)}"
+                f" (уже были в архиве: {len(items) - len(new_rows)})"
+            )
+
+        return sorted(
+            (row_number, self._archive_key(row, headers))
+            for items in by_season.values()
+            for row_number, row in items
+        )
+
+    def delete_archived_rows(self, archived: list) -> list:
+        """
+        Удаление из листа "Записи" строк, скопированных archive_registrations, одним batch_update.
+        Вызывается под row_lock. Если строки с тех пор сдвинулись (ручная правка листа), ничего не удаляется.
+        Возвращает номера удалённых строк (в нумерации до удаления) по возрастанию.
+        """
+        if not self.worksheet:
+            raise RuntimeError("Google Sheets не инициализирован")
+        if not archived:
+            return []
+
+        first_row, last_row = archived[0][0], archived[-1][0]
+        header_block, rows_block = self.worksheet.batch_get(["1:1", f"{first_row}:{last_row}"])
+        headers = [str(h).strip() for h in header_block[0]] if header_block else []
+        for row_number, key in archived:
+            index = row_number - first_row
+            row = [str(value) for value in rows_block[index]] if index < len(rows_block) else []
+            row += [""] * (len(headers) - len(row))
+            if self._archive_key(row, headers) != key:
+                raise RuntimeError(
+                    f"Строка {row_number} листа 'Записи' изменилась после копирования в архив — удаление отложено"
+                )
+
+        deleted_rows = [row_number for row_number, _ in archived]
+        # Диапазоны удаляются снизу вверх, чтобы номера ещё не удалённых строк не сдвигались
+        requests = [
+            {
+                "deleteDimension": {
+                    "range": {
+                        "sheetId": self.worksheet.id,
+                        "dimension": "ROWS",
+                        "startIndex": first - 1,
+                        "endIndex": last,
+                    }
+                }
+            }
+            for first, last in reversed(self._contiguous_ranges(deleted_rows))
+        ]
+        # Копия листа сбрасывается до удаления: если batch_update упадёт или оборвётся по таймауту,
+        # часть строк могла уже исчезнуть, и номера строк в копии верить нельзя
+        self.registrations.invalidate()
+        self.spreadsheet.batch_update({"requests": requests})
+        logger.info(f"Из листа 'Записи' удалено перенесённых в архив строк: {len(deleted_rows)}")
+
+        # Номера строк сдвинулись: копия листа, индексы и ID из архива перечитываются
+        # (и после удаления — если копию успели перечитать, пока шёл batch_update)
+        self.registrations.invalidate()
+        return deleted_rows
+
+    @staticmethod
+    def _season(exam_datetime: datetime) -> str:
+        """Учебный год экзамена: с сентября по август (2025-2026)"""
+        start_year = exam_datetime.year if exam_datetime.month >= 9 else exam_datetime.year - 1
+        return f"{start_year}-{start_year + 1}"
+
+    def _archive_worksheet(self, season: str, headers: list):
+        title = f"{self.ARCHIVE_TITLE_PREFIX}{season}"
         try:
-            # Обновляем ячейку
-            self.worksheet.update_cell(row_number, col_number, "Да")
-            logger.info(f"Напоминание {reminder_type} отмечено как отправленное для строки {row_number}")
+            return self.spreadsheet.worksheet(title)
+        except gspread.exceptions.WorksheetNotFound:
+            worksheet = self.spreadsheet.add_worksheet(title=title, rows=1000, cols=len(headers))
+            worksheet.append_row(headers)
+            logger.info(f"Создан архивный лист '{title}'")
+            return worksheet
+
+    # Колонки, по которым строка архива считается уже перенесённой
+    ARCHIVE_KEY_HEADERS = ("Дата записи", "Telegram ID", "Дата и время экзамена")
+
+    def _archive_key(self, row: list, headers: list) -> tuple:
+        return tuple(row[headers.index(header)] if header in headers else "" for header in self.ARCHIVE_KEY_HEADERS)
+
+    def _archive_keys(self, archive, headers: list) -> set:
+        """Ключи строк, которые уже есть в архивном листе (читаются только ключевые колонки)"""
+        columns = [headers.index(header) + 1 for header in self.ARCHIVE_KEY_HEADERS if header in headers]
+        blocks = archive.batch_get([
+            f"{rowcol_to_a1(2, column)}:{column_letter(column)}" for column in columns
+        ])
+        row_count = max((len(block) for block in blocks), default=0)
+        columns_values = [
+            [str(block[index][0]) if index < len(block) and block[index] else "" for index in range(row_count)]
+            for block in blocks
+        ]
+        keys = set()
+        for index in range(row_count):
+            row = [""] * len(headers)
+            for column, column_values in zip(columns, columns_values):
+                row[column - 1] = column_values[index]
+            keys.add(self._archive_key(row, headers))
+        return keys
+
+    # Колонки, которые нужны из листа "Записи": напоминания и получатели рассылки
+    MIRROR_COLUMNS = [
+        "Telegram ID",
+        "Имя и фамилия",
+        "День",
+        "Дата и время экзамена",
+        "Напоминание за час отправлено",
+        "Напоминание за 15 минут отправлено",
+    ]
+
+    # Заголовки колонок флагов напоминаний (номера колонок определяются по строке заголовков)
+    REMINDER_COLUMNS = {
+        "1h": "Напоминание за час отправлено",
+        "15m": "Напоминание за 15 минут отправлено",
+    }
+
+    def mark_reminders_sent(self, items: list) -> dict:
+        """
+        Отметить пачку напоминаний как отправленные одним batch_update.
+        items — список (номер строки, тип напоминания).
+        Соседние строки одной колонки объединяются в один диапазон (J5:J9).
+        Возвращает {(номер строки, тип): исключение} для строк, которые записать не удалось.
+        """
+        if not self.worksheet:
+            raise RuntimeError("Google Sheets не инициализирован")
+
+        failed = {}
+        rows_by_type = {}
+        for row_number, reminder_type in items:
+            if reminder_type not in self.REMINDER_COLUMNS:
+                failed[(row_number, reminder_type)] = ValueError(f"Неизвестный тип напоминания: {reminder_type}")
+                continue
+            rows_by_type.setdefault(reminder_type, set()).add(row_number)
+
+        groups = []
+        for reminder_type, rows in rows_by_type.items():
+            col_number = self.registrations.column_number(self.REMINDER_COLUMNS[reminder_type])
+            if col_number is None:
+                error = ValueError(f"В листе 'Записи' нет колонки '{self.REMINDER_COLUMNS[reminder_type]}'")
+                for row_number in rows:
+                    failed[(row_number, reminder_type)] = error
+                continue
+            for first_row, last_row in self._contiguous_ranges(sorted(rows)):
+                a1_range = rowcol_to_a1(first_row, col_number)
+                if last_row != first_row:
+                    a1_range += ":" + rowcol_to_a1(last_row, col_number)
+                groups.append({
+                    "reminder_type": reminder_type,
+                    "rows": range(first_row, last_row + 1),
+                    "update": {"range": a1_range, "values": [["Да"]] * (last_row - first_row + 1)},
+                })
+
+        if not groups:
+            return failed
+
+        try:
+            self.worksheet.batch_update([group["update"] for group in groups])
+            written = groups
         except Exception as e:
-            logger.error(f"Ошибка при обновлении ячейки: {e}")
-            raise
+            # Пакет отклонён целиком — пробуем диапазоны по отдельности, чтобы понять, какие строки не записались
+            logger.error(f"Ошибка пакетной отметки напоминаний ({len(groups)} диапазонов): {e}")
+            written = []
+            for group in groups:
+                try:
+                    self.worksheet.batch_update([group["update"]])
+                    written.append(group)
+                except Exception as group_error:
+                    logger.error(f"Не удалось отметить напоминания в диапазоне {group['update']['range']}: {group_error}")
+                    for row_number in group["rows"]:
+                        failed[(row_number, group["reminder_type"])] = group_error
+
+        for group in written:
+            header = self.REMINDER_COLUMNS[group["reminder_type"]]
+            for row_number in group["rows"]:
+                self.registrations.set_value(row_number, header, "Да")
+
+        written_count = sum(len(group["rows"]) for group in written)
+        logger.info(f"Отмечено отправленных напоминаний: {written_count} (диапазонов: {len(written)})")
+        return failed
+
+    @staticmethod
+    def _contiguous_ranges(rows: list):
+        """[3, 4, 5, 9] -> [(3, 5), (9, 9)]"""
+        ranges = []
+        for row in rows:
+            if ranges and row == ranges[-1][1] + 1:
+                ranges[-1] = (ranges[-1][0], row)
+            else:
+                ranges.append((row, row))
+        return ranges
@@ -0,0 +1,116 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+from storage import EXAM_TIMEZONE, parse_exam_datetime
+
+logger = logging.getLogger(__name__)
+
+# Формат даты и времени экзамена в снимке (как в таблице)
+DATETIME_FORMAT = "%d.%m.%Y %H:%M"
+
+
+def _encode(item: dict) -> dict:
+    return dict(item, exam_datetime=item["exam_datetime"].strftime(DATETIME_FORMAT))
+
+
+def _decode(items: list) -> list:
+    decoded = []
+    for item in items:
+        exam_datetime = parse_exam_datetime(str(item.get("exam_datetime", "")))
+        if exam_datetime is not None:
+            decoded.append(dict(item, exam_datetime=exam_datetime))
+    return decoded
+
+
+class WarmSnapshot:
+    """
+    Снимок расписания и предстоящих записей на диске (JSON).
+    При старте бот загружает его и сразу показывает слоты и планирует напоминания,
+    а хранилище подключается в фоне. Снимок обновляется после каждого успешного чтения
+    расписания и записей и сохраняется на диск не чаще раза в WARM_SNAPSHOT_INTERVAL секунд.
+    """
+
+    def __init__(self, path: str | None = None):
+        # Пустой путь — снимок не ведётся
+        self.path = path if path is not None else os.getenv("WARM_SNAPSHOT_PATH", "warm_snapshot.json")
+        self.save_interval = float(os.getenv("WARM_SNAPSHOT_INTERVAL", "60"))
+        self.slots = None
+        self.exams = None
+        self.saved_at = None
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def update_slots(self, slots: list):
+        """Расписание прочитано из хранилища"""
+        self.slots = list(slots)
+        self._dirty = True
+
+    def update_exams(self, exams: list):
+        """Предстоящие записи прочитаны из хранилища"""
+        self.exams = list(exams)
+        self._dirty = True
+
+    def upcoming_exams(self) -> list:
+        """Записи из снимка, как их вернул бы get_all_exams_for_reminders сейчас"""
+        threshold = datetime.now(pytz.UTC).astimezone(EXAM_TIMEZONE) - timedelta(minutes=15)
+        return [exam for exam in self.exams or [] if exam["exam_datetime"] >= threshold]
+
+    def load(self) -> bool:
+        """Прочитать снимок с диска. False — снимка нет или он повреждён"""
+        if not self.path or not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            slots = _decode(data.get("slots") or [])
+            exams = _decode(data.get("exams") or [])
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            logger.error(f"Не удалось прочитать снимок {self.path}: {e}")
+            return False
+
+        self.slots = slots
+        self.exams = exams
+        self.saved_at = data.get("saved_at")
+        age = time.time() - self.saved_at if self.saved_at else None
+        logger.info(
+            f"Загружен снимок {self.path}: слотов {len(slots)}, записей {len(exams)}"
+            + (f", возраст {age / 60:.0f} мин" if age is not None else "")
+        )
+        return True
+
+    def _write(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            data = {
+                "saved_at": time.time(),
+                "slots": [_encode(slot) for slot in self.slots or []],
+                "exams": [_encode(exam) for exam in self.exams or []],
+            }
+            # Запись через временный файл: при падении на диске остаётся предыдущий целый снимок
+            tmp_path = f"{self.path}.tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+                os.replace(tmp_path, self.path)
+            except OSError:
+                self._dirty = True
+                raise
+            self.saved_at = data["saved_at"]
+
+    async def save(self, context=None):
+        """Сохранить снимок, если он изменился (вызывается job_queue и при остановке)"""
+        if not self.path or not self._dirty:
+            return
+        try:
+            await asyncio.to_thread(self._write)
+        except OSError as e:
+            logger.error(f"Не удалось сохранить снимок {self.path}: {e}")
@@ -0,0 +1,323 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+from quota import BULK, REQUEST_PRIORITY
+from storage import EXAMPLE_SCHEDULE_ROWS, SCHEDULE_HEADERS, Storage, parse_exam_datetime
+
+logger = logging.getLogger(__name__)
+
+# Колонки флагов напоминаний в таблице registrations
+REMINDER_FIELDS = {
+    "1h": "reminder_1h_sent",
+    "15m": "reminder_15m_sent",
+}
+
+
+class SQLiteStorage(Storage):
+    """
+    Локальное хранилище записей и расписания в SQLite.
+    Все чтения локальные и идут по индексам (время экзамена, Telegram ID);
+    Google Sheets при этом может быть подключён как зеркало для организаторов (см. SheetsSync).
+    """
+
+    def __init__(self, path: str | None = None):
+        super().__init__()
+        self.path = path or os.getenv("SQLITE_STORAGE_PATH", "storage.db")
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def initialize(self):
+        """Открытие базы и создание таблиц; пустое расписание заполняется примером"""
+        with self._lock:
+            if self._conn is None:
+                self._conn = sqlite3.connect(self.path, check_same_thread=False)
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS registrations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    registered_at TEXT NOT NULL,
+                    telegram_id TEXT NOT NULL,
+                    telegram_username TEXT,
+                    full_name TEXT,
+                    exam_type TEXT,
+                    day_name TEXT,
+                    time TEXT,
+                    exam_datetime TEXT,
+                    teacher TEXT,
+                    reminder_1h_sent INTEGER NOT NULL DEFAULT 0,
+                    reminder_15m_sent INTEGER NOT NULL DEFAULT 0,
+                    -- Время экзамена в unix-секундах (для индекса); NULL, если строку не удалось разобрать
+                    exam_at REAL,
+                    -- Номер строки в листе "Записи" (0 — записана, но номер неизвестен)
+                    sheet_row INTEGER,
+                    -- Флаги напоминаний изменились и ещё не отправлены в таблицу
+                    flags_dirty INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS idx_registrations_exam_at ON registrations (exam_at);
+                CREATE INDEX IF NOT EXISTS idx_registrations_telegram_id ON registrations (telegram_id);
+                CREATE INDEX IF NOT EXISTS idx_registrations_sheet_row ON registrations (sheet_row);
+                CREATE TABLE IF NOT EXISTS slots (
+                    idx INTEGER PRIMARY KEY,
+                    date TEXT NOT NULL,
+                    time TEXT NOT NULL,
+                    zoom TEXT,
+                    contact TEXT,
+                    -- Вместимость слота (пусто — без ограничения)
+                    capacity TEXT
+                );
+                """
+            )
+            # Базы, созданные до появления вместимости слотов
+            slot_columns = {row[1] for row in self._conn.execute("PRAGMA table_info(slots)")}
+            if "capacity" not in slot_columns:
+                self._conn.execute("ALTER TABLE slots ADD COLUMN capacity TEXT")
+            if self._conn.execute("SELECT COUNT(*) FROM slots").fetchone()[0] == 0:
+                self._conn.executemany(
+                    "INSERT INTO slots (idx, date, time, zoom, contact) VALUES (?, ?, ?, ?, ?)",
+                    [(idx, *row) for idx, row in enumerate(EXAMPLE_SCHEDULE_ROWS)],
+                )
+                logger.info("Расписание в SQLite пустое — добавлен пример")
+            self._conn.commit()
+        logger.info(f"SQLite-хранилище инициализировано: {self.path}")
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            raise RuntimeError("SQLite-хранилище не инициализировано")
+        return self._conn
+
+    def _exam_at(self, exam_datetime_str) -> float | None:
+        exam_datetime = parse_exam_datetime(str(exam_datetime_str))
+        return exam_datetime.timestamp() if exam_datetime else None
+
+    # --- Интерфейс Storage ---
+
+    def append_registrations(self, rows: list):
+        with self._lock:
+            conn = self._connection()
+            first_id = None
+            for row in rows:
+                cursor = conn.execute(
+                    """
+                    INSERT INTO registrations (
+                        registered_at, telegram_id, telegram_username, full_name, exam_type,
+                        day_name, time, exam_datetime, teacher, exam_at
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (*[str(value) for value in row[:9]], self._exam_at(row[7])),
+                )
+                if first_id is None:
+                    first_id = cursor.lastrowid
+            conn.commit()
+            return first_id
+
+    def get_exam_slots(self):
+        return self.slots_from_records(self.get_schedule_records())
+
+    def get_schedule_records(self):
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT date, time, zoom, contact, COALESCE(capacity, '') FROM slots ORDER BY idx"
+            ).fetchall()
+        return [dict(zip(SCHEDULE_HEADERS, row)) for row in rows]
+
+    def replace_schedule(self, records: list):
+        """Заменить расписание (например, данными листа "Даты экзаменов")"""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM slots")
+            conn.executemany(
+                "INSERT INTO slots (idx, date, time, zoom, contact, capacity) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (idx, *[str(record.get(header, "")).strip() for header in SCHEDULE_HEADERS])
+                    for idx, record in enumerate(records)
+                ],
+            )
+            conn.commit()
+
+    def get_all_exams_for_reminders(self):
+        # Экзамены, которые ещё не прошли (с запасом в 15 минут после начала)
+        now = datetime.now(pytz.UTC).astimezone(self.timezone)
+        since = (now - timedelta(minutes=15)).timestamp()
+        with self._lock:
+            rows = self._connection().execute(
+                """
+                SELECT id, telegram_id, exam_at, full_name, day_name, reminder_1h_sent, reminder_15m_sent
+                FROM registrations WHERE exam_at >= ? ORDER BY exam_at
+                """,
+                (since,),
+            ).fetchall()
+        return [
+            {
+                "row_number": row_id,
+                "telegram_id": telegram_id,
+                "exam_datetime": datetime.fromtimestamp(exam_at, pytz.UTC).astimezone(self.timezone),
+                "full_name": full_name,
+                "day_name": day_name,
+                "reminder_1h_sent": bool(reminder_1h_sent),
+                "reminder_15m_sent": bool(reminder_15m_sent),
+            }
+            for row_id, telegram_id, exam_at, full_name, day_name, reminder_1h_sent, reminder_15m_sent in rows
+        ]
+
+    def get_unique_telegram_ids(self):
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT DISTINCT telegram_id FROM registrations"
+            ).fetchall()
+        unique_ids = set()
+        for (telegram_id,) in rows:
+            try:
+                unique_ids.add(int(telegram_id))
+            except (ValueError, TypeError):
+                logger.warning(f"Некорректный Telegram ID в истории: {telegram_id}")
+        return sorted(unique_ids)
+
+    def mark_reminders_sent(self, items: list) -> dict:
+        failed = {}
+        updates = {}
+        for row_id, reminder_type in items:
+            if reminder_type not in REMINDER_FIELDS:
+                failed[(row_id, reminder_type)] = ValueError(f"Неизвестный тип напоминания: {reminder_type}")
+                continue
+            updates.setdefault(REMINDER_FIELDS[reminder_type], []).append(row_id)
+
+        with self._lock:
+            conn = self._connection()
+            for field, row_ids in updates.items():
+                conn.executemany(
+                    f"UPDATE registrations SET {field} = 1, flags_dirty = 1 WHERE id = ?",
+                    [(row_id,) for row_id in row_ids],
+                )
+            conn.commit()
+        return failed
+
+    # --- Для синхронизации с Google Sheets ---
+
+    def unsynced_registrations(self, limit: int) -> list:
+        """Записи, ещё не попавшие в лист "Записи", в порядке добавления: [(id, строка листа)]"""
+        with self._lock:
+            rows = self._connection().execute(
+                """
+                SELECT id, registered_at, telegram_id, telegram_username, full_name, exam_type,
+                       day_name, time, exam_datetime, teacher, reminder_1h_sent, reminder_15m_sent
+                FROM registrations WHERE sheet_row IS NULL ORDER BY id LIMIT ?
+                """,
+                (limit,),
+            ).fetchall()
+        return [
+            (row[0], [*row[1:10], "Да" if row[10] else "Нет", "Да" if row[11] else "Нет"])
+            for row in rows
+        ]
+
+    def set_sheet_rows(self, row_ids: list, first_sheet_row: int | None):
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(
+                "UPDATE registrations SET sheet_row = ?, flags_dirty = 0 WHERE id = ?",
+                [
+                    (first_sheet_row + offset if first_sheet_row is not None else 0, row_id)
+                    for offset, row_id in enumerate(row_ids)
+                ],
+            )
+            conn.commit()
+
+    def dirty_flags(self) -> list:
+        """Флаги напоминаний, которые нужно перенести в таблицу: [(id, номер строки листа, тип)]"""
+        with self._lock:
+            rows = self._connection().execute(
+                """
+                SELECT id, sheet_row, reminder_1h_sent, reminder_15m_sent
+                FROM registrations WHERE flags_dirty = 1 AND sheet_row > 0
+                """
+            ).fetchall()
+        items = []
+        for row_id, sheet_row, reminder_1h_sent, reminder_15m_sent in rows:
+            if reminder_1h_sent:
+                items.append((row_id, sheet_row, "1h"))
+            if reminder_15m_sent:
+                items.append((row_id, sheet_row, "15m"))
+        return items
+
+    def clear_dirty_flags(self, row_ids: list):
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(
+                "UPDATE registrations SET flags_dirty = 0 WHERE id = ?",
+                [(row_id,) for row_id in row_ids],
+            )
+            conn.commit()
+
+
+class SheetsSync:
+    """
+    Зеркалирование SQLite-хранилища в Google Sheets для организаторов:
+    новые записи и флаги напоминаний уходят в лист "Записи",
+    а расписание забирается из листа "Даты экзаменов" (его по-прежнему правят в таблице).
+    """
+
+    def __init__(self, storage: SQLiteStorage, sheets):
+        self.storage = storage
+        # Синхронный GoogleSheets: вызовы выполняются в отдельном потоке
+        self.sheets = sheets
+        self.interval = float(os.getenv("SHEETS_SYNC_INTERVAL", "60"))
+        self.batch_size = max(1, int(os.getenv("SHEETS_SYNC_BATCH", "200")))
+        self._lock = None
+
+    async def sync(self, context=None):
+        """Один проход синхронизации (вызывается job_queue)"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        if self._lock.locked():
+            return
+
+        async with self._lock:
+            started = time.monotonic()
+            # Бот работает с SQLite, таблица — только копия для организаторов: её запросы уступают остальным.
+            # asyncio.to_thread передаёт приоритет в поток вместе с контекстом
+            priority = REQUEST_PRIORITY.set(BULK)
+            try:
+                await self._push_registrations()
+                await self._push_flags()
+                await self._pull_schedule()
+            except Exception as e:
+                logger.error(f"Ошибка синхронизации с Google Sheets: {e}", exc_info=True)
+                return
+            finally:
+                REQUEST_PRIORITY.reset(priority)
+            logger.debug(f"Синхронизация с Google Sheets заняла {time.monotonic() - started:.2f} с")
+
+    async def _push_registrations(self):
+        while True:
+            batch = await asyncio.to_thread(self.storage.unsynced_registrations, self.batch_size)
+            if not batch:
+                return
+            row_ids = [row_id for row_id, _ in batch]
+            first_sheet_row = await asyncio.to_thread(
+                self.sheets.append_registrations, [row for _, row in batch]
+            )
+            await asyncio.to_thread(self.storage.set_sheet_rows, row_ids, first_sheet_row)
+            logger.info(f"В Google Sheets перенесено записей: {len(batch)}")
+
+    async def _push_flags(self):
+        items = await asyncio.to_thread(self.storage.dirty_flags)
+        if not items:
+            return
+        failed = await asyncio.to_thread(
+            self.sheets.mark_reminders_sent,
+            [(sheet_row, reminder_type) for _, sheet_row, reminder_type in items],
+        )
+        failed_rows = {sheet_row for sheet_row, _ in failed}
+        synced_ids = {row_id for row_id, sheet_row, _ in items if sheet_row not in failed_rows}
+        await asyncio.to_thread(self.storage.clear_dirty_flags, list(synced_ids))
+
+    async def _pull_schedule(self):
+        records = await asyncio.to_thread(self.sheets.get_schedule_records)
+        await asyncio.to_thread(self.storage.replace_schedule, records)
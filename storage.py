@@ -0,0 +1,210 @@
+import functools
+import logging
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+import pytz
+
+logger = logging.getLogger(__name__)
+
+# Колонки листа "Записи" (и формат строки регистрации для любого хранилища)
+REGISTRATION_HEADERS = [
+    "Дата записи",
+    "Telegram ID",
+    "Имя пользователя",
+    "Имя и фамилия",
+    "Тип экзамена",
+    "День",
+    "Время",
+    "Дата и время экзамена",
+    "Преподаватель",
+    "Напоминание за час отправлено",
+    "Напоминание за 15 минут отправлено"
+]
+
+# Колонки листа "Даты экзаменов": Дата, Время, Zoom, Контакт и необязательная вместимость слота
+SCHEDULE_HEADERS = ["Дата", "Время", "Zoom", "Контакт", "Мест"]
+
+# Пример расписания для пустого хранилища (суббота 28.02, воскресенье 01.03)
+EXAMPLE_SCHEDULE_ROWS = [
+    ["28.02.2026", "11:00", "https://us06web.zoom.us/j/9709286191", "@vasilina45"],
+    ["28.02.2026", "15:00", "https://us06web.zoom.us/j/9709286191", "@vasilina45"],
+    ["01.03.2026", "10:00", "https://us06web.zoom.us/j/5621545595?pwd=EEaV6rb8Dr8UgaaL9AF4wbarlhraNV.1", "@dkvnastya"],
+    ["01.03.2026", "14:00", "https://us06web.zoom.us/j/5621545595?pwd=EEaV6rb8Dr8UgaaL9AF4wbarlhraNV.1", "@dkvnastya"],
+]
+
+MONTHS_RU = ["", "января", "февраля", "марта", "апреля", "мая", "июня",
+             "июля", "августа", "сентября", "октября", "ноября", "декабря"]
+DAYS_RU = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"]
+
+# Часовой пояс, в котором указано время экзаменов (НСК)
+EXAM_TIMEZONE = pytz.timezone("Asia/Novosibirsk")
+
+
+@functools.lru_cache(maxsize=8192)
+def parse_exam_datetime(value: str):
+    """
+    Дата и время экзамена «DD.MM.YYYY HH:MM» (время НСК) -> datetime с часовым поясом, или None.
+    Результат кэшируется по исходной строке: в листе повторяются одни и те же слоты,
+    а напоминания перечитывают его каждую минуту.
+    Если строка не в основном формате — пробуем strptime (без ведущих нулей) и ISO 8601.
+    """
+    text = value.strip()
+    if not text:
+        return None
+    try:
+        if len(text) == 16 and text[2] == "." and text[5] == "." and text[10] == " " and text[13] == ":":
+            # Быстрый путь для основного формата без strptime
+            naive = datetime(int(text[6:10]), int(text[3:5]), int(text[0:2]), int(text[11:13]), int(text[14:16]))
+        else:
+            naive = datetime.strptime(text, "%d.%m.%Y %H:%M")
+    except ValueError as e:
+        try:
+            parsed = datetime.fromisoformat(text.replace("Z", "+00:00"))
+        except ValueError as e2:
+            logger.warning(f"Ошибка парсинга даты: {text}, {e}, {e2}")
+            return None
+        if parsed.tzinfo:
+            return parsed.astimezone(EXAM_TIMEZONE)
+        naive = parsed
+    return EXAM_TIMEZONE.localize(naive)
+
+
+class Storage(ABC):
+    """
+    Интерфейс хранилища, которым пользуются bot.py и scheduler.py.
+    Реализации: GoogleSheets (sheets.py) и SQLiteStorage (sqlite_storage.py).
+    Запись идентифицируется полем row_number: номер строки листа для Google Sheets, id записи для SQLite.
+    """
+
+    def __init__(self):
+        self.timezone = EXAM_TIMEZONE
+
+    @abstractmethod
+    def initialize(self):
+        """Подключение к хранилищу и создание недостающих структур"""
+
+    @abstractmethod
+    def append_registrations(self, rows: list):
+        """Добавить пачку строк регистраций. Возвращает идентификатор первой (или None)"""
+
+    @abstractmethod
+    def get_exam_slots(self):
+        """Доступные слоты экзаменов в будущем"""
+
+    @abstractmethod
+    def get_all_exams_for_reminders(self):
+        """Записи на ещё не прошедшие экзамены в формате exam_from_row"""
+
+    @abstractmethod
+    def get_unique_telegram_ids(self):
+        """Отсортированный список уникальных Telegram ID из истории записей"""
+
+    @abstractmethod
+    def mark_reminders_sent(self, items: list) -> dict:
+        """Отметить напоминания (row_number, тип) отправленными. Возвращает {(row_number, тип): ошибка}"""
+
+    def save_registration(self, user_data: dict):
+        """Сохранение данных регистрации. Возвращает идентификатор записи (или None)"""
+        row_number = self.append_registrations([self.build_registration_row(user_data)])
+        logger.info(f"Данные сохранены: {user_data.get('full_name')}")
+        return row_number
+
+    def mark_reminder_sent(self, row_number: int, reminder_type: str):
+        """Отметить напоминание как отправленное"""
+        failed = self.mark_reminders_sent([(row_number, reminder_type)])
+        if failed:
+            raise failed[(row_number, reminder_type)]
+
+    def build_registration_row(self, user_data: dict) -> list:
+        """Строка регистрации в формате листа «Записи»"""
+        # Дата записи — в том же часовом поясе, что и экзамены
+        now_nsk = datetime.now(pytz.UTC).astimezone(self.timezone)
+        return [
+            now_nsk.strftime("%d.%m.%Y %H:%M:%S"),  # Дата записи
+            user_data.get("telegram_id", ""),
+            user_data.get("telegram_username", ""),
+            user_data.get("full_name", ""),
+            user_data.get("exam_type", ""),
+            user_data.get("day_name", ""),
+            user_data.get("time", ""),
+            user_data.get("exam_datetime", ""),  # Формат: DD.MM.YYYY HH:MM
+            user_data.get("teacher", ""),
+            "Нет",  # Напоминание за час отправлено
+            "Нет"   # Напоминание за 15 минут отправлено
+        ]
+
+    def exam_from_row(self, row_number: int, row: list):
+        """Запись в формате get_all_exams_for_reminders из строки регистрации (или None)"""
+        try:
+            exam_datetime = parse_exam_datetime(str(row[7]))
+        except IndexError:
+            return None
+        if exam_datetime is None:
+            return None
+        return {
+            "row_number": row_number,
+            "telegram_id": row[1],
+            "exam_datetime": exam_datetime,
+            "full_name": row[3],
+            "day_name": row[5],
+            "reminder_1h_sent": False,
+            "reminder_15m_sent": False,
+        }
+
+    def slots_from_records(self, records: list) -> list:
+        """
+        Слоты из записей расписания ({Дата, Время, Zoom, Контакт, Мест}).
+        Возвращает список словарей: [{date, time, datetime_str, zoom, contact, day_name, capacity}, ...]
+        Только слоты в будущем. capacity — None, если вместимость не указана.
+        """
+        slots = []
+        now = datetime.now(pytz.UTC).astimezone(self.timezone)
+
+        for idx, record in enumerate(records):
+            date_str = str(record.get("Дата", "")).strip()
+            time_str = str(record.get("Время", "")).strip()
+            zoom = str(record.get("Zoom", "")).strip()
+            contact = str(record.get("Контакт", "")).strip()
+            capacity_str = str(record.get("Мест", "")).strip()
+
+            if not date_str or not time_str:
+                continue
+
+            capacity = None
+            if capacity_str:
+                try:
+                    capacity = max(0, int(capacity_str))
+                except ValueError:
+                    logger.warning(f"Некорректная вместимость слота {date_str} {time_str}: {capacity_str}")
+
+            try:
+                exam_date = datetime.strptime(date_str, "%d.%m.%Y")
+                exam_time = datetime.strptime(time_str, "%H:%M").time()
+                exam_datetime_naive = datetime.combine(exam_date.date(), exam_time)
+                exam_datetime = self.timezone.localize(exam_datetime_naive)
+
+                if exam_datetime < now:
+                    continue
+
+                day_name = DAYS_RU[exam_date.weekday()]
+                display_date = f"{day_name}, {exam_date.day} {MONTHS_RU[exam_date.month]} {time_str}"
+                datetime_str = exam_datetime_naive.strftime("%d.%m.%Y %H:%M")
+
+                slots.append({
+                    "index": idx,
+                    "date": date_str,
+                    "time": time_str,
+                    "datetime_str": datetime_str,
+                    "exam_datetime": exam_datetime,
+                    "zoom": zoom or "https://us06web.zoom.us/j/9709286191",
+                    "contact": contact or "@vasilina45",
+                    "day_name": day_name,
+                    "display": display_date,
+                    "capacity": capacity
+                })
+            except (ValueError, TypeError) as e:
+                logger.warning(f"Ошибка парсинга слота: {date_str} {time_str}, {e}")
+                continue
+
+        return slots
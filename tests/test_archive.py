@@ -0,0 +1,51 @@
+"""Перенос прошедших записей в архивные листы (GoogleSheets на таблице в памяти)"""
+from datetime import datetime
+
+import pytest
+import pytz
+
+from benchmarks.fakes import make_google_sheets, registration_rows
+
+EXAM_COLUMN = 7
+
+
+def past_and_upcoming(sheets):
+    cutoff = datetime.now(pytz.UTC)
+    rows = sheets.worksheet.values[1:]
+    past = [row for row in rows if exam_time(row) < cutoff]
+    return cutoff, past, [row for row in rows if exam_time(row) >= cutoff]
+
+
+def exam_time(row: list) -> datetime:
+    return pytz.timezone("Asia/Novosibirsk").localize(datetime.strptime(row[EXAM_COLUMN], "%d.%m.%Y %H:%M"))
+
+
+def test_archive_then_delete_keeps_only_upcoming_rows():
+    sheets = make_google_sheets(registration_rows(40, seed=3))
+    cutoff, past, upcoming = past_and_upcoming(sheets)
+
+    archived = sheets.archive_registrations(cutoff)
+    # Копирование лист "Записи" не трогает
+    assert len(sheets.worksheet.values) == 41
+    assert len(archived) == len(past)
+
+    deleted_rows = sheets.delete_archived_rows(archived)
+    assert deleted_rows == [row_number for row_number, _ in archived]
+    assert sheets.worksheet.values[1:] == upcoming
+    archive_rows = [
+        row for sheet in sheets.spreadsheet.worksheets() if sheet.title.startswith("Архив ") for row in sheet.values[1:]
+    ]
+    assert sorted(archive_rows) == sorted(past)
+
+
+def test_rows_shifted_after_copy_are_not_deleted():
+    sheets = make_google_sheets(registration_rows(40, seed=3))
+    cutoff, _, _ = past_and_upcoming(sheets)
+    archived = sheets.archive_registrations(cutoff)
+
+    # Ручное удаление строки между копированием и удалением сдвигает номера строк
+    del sheets.worksheet.values[1]
+    before = [list(row) for row in sheets.worksheet.values]
+    with pytest.raises(RuntimeError):
+        sheets.delete_archived_rows(archived)
+    assert sheets.worksheet.values == before
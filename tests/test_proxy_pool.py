@@ -0,0 +1,55 @@
+"""Учёт ответов прокси в ProxyPool"""
+import asyncio
+from types import SimpleNamespace
+
+from proxy_pool import ProxyPool, ProxyPoolRequest
+
+SEND_URL = "https://api.telegram.org/bot123:TEST/sendMessage"
+
+
+class StaticRequest:
+    """HTTPXRequest одного прокси, который всегда отвечает одним кодом"""
+
+    def __init__(self, code: int):
+        self.code = code
+
+    async def do_request(self, *args, **kwargs):
+        return self.code, b'{"ok": true, "result": {}}'
+
+
+def pool_request(codes: dict) -> tuple:
+    pool = ProxyPool()
+    pool.configure(list(codes))
+    request = ProxyPoolRequest(pool)
+    request._requests = {url: StaticRequest(code) for url, code in codes.items()}
+    return pool, request
+
+
+def test_proxy_answering_502_is_ejected():
+    pool, request = pool_request({"http://bad:1": 502})
+
+    async def scenario():
+        for _ in range(pool.max_failures):
+            code, _ = await request.do_request(SEND_URL, "POST")
+            assert code == 502
+
+    asyncio.run(scenario())
+    [stats] = pool.stats()
+    assert not stats["admitted"]
+    assert stats["p50"] is None
+
+
+def test_telegram_client_errors_count_as_proxy_success():
+    pool, request = pool_request({"http://good:1": 400})
+    asyncio.run(request.do_request(SEND_URL, "POST"))
+    [stats] = pool.stats()
+    assert stats["failures"] == 0
+    assert stats["p50"] is not None
+
+
+def test_probe_counts_non_200_as_failure():
+    pool, request = pool_request({"http://good:1": 200, "http://bad:2": 407})
+    context = SimpleNamespace(bot=SimpleNamespace(base_url="https://api.telegram.org/bot123:TEST"))
+    asyncio.run(request.probe(context))
+    failures = {stats["label"]: stats["failures"] for stats in pool.stats()}
+    assert failures == {"good:1": 0, "bad:2": 1}
@@ -0,0 +1,79 @@
+"""Повторы и сроки запросов SheetsGovernor"""
+import time
+
+import pytest
+from gspread.exceptions import APIError
+
+from quota import REQUEST_DEADLINE, SheetsGovernor, is_idempotent
+
+
+class FakeResponse:
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+        self.text = "error"
+
+    def json(self):
+        return {"error": {"code": self.status_code, "message": "error", "status": "ERROR"}}
+
+
+def failing(calls: list, status: int):
+    def request():
+        calls.append(status)
+        raise APIError(FakeResponse(status))
+    return request
+
+
+def governor() -> SheetsGovernor:
+    governor = SheetsGovernor()
+    governor.base_backoff = 0.001
+    return governor
+
+
+def test_append_is_not_retried_after_server_error():
+    calls = []
+    with pytest.raises(APIError):
+        governor().execute("write", failing(calls, 503), idempotent=False)
+    assert calls == [503]
+
+
+def test_append_is_retried_after_rate_limit():
+    calls = []
+    g = governor()
+    g.max_retries = 2
+    with pytest.raises(APIError):
+        g.execute("write", failing(calls, 429), idempotent=False)
+    assert calls == [429, 429, 429]
+
+
+def test_quota_wait_stops_at_deadline():
+    g = governor()
+    g.buckets["read"].tokens = 0.0
+    token = REQUEST_DEADLINE.set(time.monotonic() + 0.2)
+    try:
+        started = time.monotonic()
+        with pytest.raises(TimeoutError):
+            g.execute("read", lambda: None)
+        assert time.monotonic() - started < 1
+    finally:
+        REQUEST_DEADLINE.reset(token)
+
+
+def test_retries_stop_before_deadline():
+    calls = []
+    g = governor()
+    g.base_backoff = 1.0
+    token = REQUEST_DEADLINE.set(time.monotonic() + 0.2)
+    try:
+        with pytest.raises(APIError):
+            g.execute("read", failing(calls, 503))
+    finally:
+        REQUEST_DEADLINE.reset(token)
+    assert calls == [503]
+
+
+def test_idempotency_by_endpoint():
+    base = "https://sheets.googleapis.com/v4/spreadsheets/1"
+    assert is_idempotent("get", f"{base}/values/A1")
+    assert is_idempotent("post", f"{base}/values:batchUpdate")
+    assert not is_idempotent("post", f"{base}/values/A1:append")
+    assert not is_idempotent("post", f"{base}:batchUpdate")
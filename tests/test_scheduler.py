@@ -0,0 +1,99 @@
+"""Будильник очереди напоминаний на настоящем JobQueue (APScheduler)"""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytz
+from telegram.ext import ApplicationBuilder
+
+from benchmarks.fakes import FakeBot, FakeTelegramRequest
+from scheduler import ReminderScheduler
+
+TIMEZONE = pytz.timezone("Asia/Novosibirsk")
+
+
+class StubSheets:
+    """Фасад хранилища с фиксированным списком записей"""
+
+    def __init__(self, exams: list):
+        self.exams = exams
+        self.row_lock = asyncio.Lock()
+        self.marked = []
+
+    async def wait_for_quota(self, priority=None):
+        pass
+
+    async def get_all_exams_for_reminders(self):
+        return list(self.exams)
+
+    async def mark_reminders_sent(self, items: list) -> dict:
+        self.marked.extend(items)
+        return {}
+
+
+# Будильник отправляет через бота приложения (FakeTelegramRequest), а отметка в таблице — признак отправки
+
+
+def exam(row_number: int, minutes_ahead: float) -> dict:
+    return {
+        "row_number": row_number,
+        "telegram_id": str(1000 + row_number),
+        "exam_datetime": datetime.now(pytz.UTC).astimezone(TIMEZONE) + timedelta(minutes=minutes_ahead),
+        "full_name": "Студент",
+        "day_name": "",
+        "reminder_1h_sent": False,
+        "reminder_15m_sent": False,
+    }
+
+
+async def run_with_job_queue(scenario):
+    application = (
+        ApplicationBuilder()
+        .token("123456:TEST")
+        .request(FakeTelegramRequest())
+        .get_updates_request(FakeTelegramRequest())
+        .build()
+    )
+    async with application:
+        await application.start()
+        try:
+            await scenario(application.job_queue)
+        finally:
+            await application.stop()
+
+
+def test_overdue_reminder_is_sent_and_rebuild_survives():
+    # Запись за 55 минут до экзамена: напоминание «за час» просрочено на 5 минут, но в окне досылки
+    sheets = StubSheets([exam(2, 55)])
+    scheduler = ReminderScheduler()
+
+    async def scenario(job_queue):
+        scheduler.initialize(sheets, FakeBot(), job_queue)
+        await scheduler.start()
+        # «За час» просрочено, «за 15 минут» — в будущем
+        assert await scheduler.rebuild() == 2
+        await asyncio.sleep(0.5)
+        assert sheets.marked == [(2, "1h")]
+
+        # Повторная пересборка с новым просроченным напоминанием не падает на снятой задаче
+        sheets.exams = [dict(exam(2, 55), reminder_1h_sent=True), exam(3, 52)]
+        assert await scheduler.rebuild() == 3
+        await asyncio.sleep(0.5)
+        assert sheets.marked == [(2, "1h"), (3, "1h")]
+
+    asyncio.run(run_with_job_queue(scenario))
+
+
+def test_stale_wake_job_does_not_break_arm():
+    sheets = StubSheets([exam(2, 120)])
+    scheduler = ReminderScheduler()
+
+    async def scenario(job_queue):
+        scheduler.initialize(sheets, FakeBot(), job_queue)
+        await scheduler.start()
+        await scheduler.rebuild()
+        # Задачу будильника уже убрал сам планировщик (выполнена или пропущена)
+        scheduler._wake_job.job.remove()
+        assert await scheduler.rebuild() == 2
+        assert scheduler._wake_job is not None
+
+    asyncio.run(run_with_job_queue(scenario))
@@ -0,0 +1,54 @@
+"""Пересчёт занятых мест SeatCounter при одновременных вызовах"""
+import asyncio
+
+from seats import SeatCounter
+
+SLOT_KEY = "20.05.2026 11:00"
+
+
+class GatedSheets:
+    """Фасад хранилища, чтение которого ждёт разрешения теста"""
+
+    def __init__(self):
+        self.row_lock = asyncio.Lock()
+        self.read_allowed = asyncio.Event()
+        self.reads = 0
+
+    async def wait_for_quota(self, priority=None):
+        pass
+
+    async def get_all_exams_for_reminders(self):
+        self.reads += 1
+        await self.read_allowed.wait()
+        return []
+
+
+class EmptyJournal:
+    def pending_rows(self) -> list:
+        return []
+
+
+def test_overlapping_rebuilds_keep_reservation():
+    async def scenario():
+        seats = SeatCounter()
+        sheets = GatedSheets()
+        seats.initialize(sheets, EmptyJournal())
+        sheets.read_allowed.set()
+        await seats.rebuild()
+        sheets.read_allowed.clear()
+
+        # Задача job_queue и /refresh_slots пересчитывают места одновременно
+        first = asyncio.create_task(seats.rebuild())
+        second = asyncio.create_task(seats.rebuild())
+        await asyncio.sleep(0.01)
+        assert seats.reserve(SLOT_KEY, 1)
+
+        sheets.read_allowed.set()
+        await asyncio.gather(first, second)
+
+        assert seats.booked(SLOT_KEY) == 1
+        assert not seats.reserve(SLOT_KEY, 1)
+        # Второй вызов дождался пересчёта первого, а не читал таблицу ещё раз
+        assert sheets.reads == 2
+
+    asyncio.run(scenario())
@@ -0,0 +1,71 @@
+"""Порядок обновлений одного пользователя и слоты обработки ChatOrderedUpdateProcessor"""
+import asyncio
+from datetime import datetime
+
+from telegram import Chat, Message, Update, User
+
+from update_processor import ChatOrderedUpdateProcessor
+
+
+def message_update(update_id: int, user_id: int) -> Update:
+    message = Message(
+        message_id=update_id,
+        date=datetime.now(),
+        chat=Chat(id=user_id, type=Chat.PRIVATE),
+        from_user=User(id=user_id, first_name="Студент", is_bot=False),
+        text="/start",
+    )
+    return Update(update_id=update_id, message=message)
+
+
+def test_flooding_user_does_not_block_other_users():
+    async def scenario():
+        processor = ChatOrderedUpdateProcessor(max_concurrent_updates=2)
+        release_flooder = asyncio.Event()
+        handled = []
+
+        async def handle(update_id: int, wait: asyncio.Event | None = None):
+            if wait is not None:
+                await wait.wait()
+            handled.append(update_id)
+
+        # Как Application: каждое обновление — отдельная задача через process_update
+        tasks = [
+            asyncio.create_task(processor.process_update(message_update(i, 1), handle(i, release_flooder)))
+            for i in range(1, 11)
+        ]
+        await asyncio.sleep(0)
+        other = asyncio.create_task(processor.process_update(message_update(100, 2), handle(100)))
+
+        # Один пользователь занимает не больше одного слота, второй слот свободен для других
+        await asyncio.wait_for(other, timeout=1)
+        assert handled == [100]
+
+        release_flooder.set()
+        await asyncio.wait_for(asyncio.gather(*tasks), timeout=1)
+        assert handled == [100] + list(range(1, 11))
+        assert not processor._queues
+
+    asyncio.run(scenario())
+
+
+def test_slots_limit_concurrent_updates():
+    async def scenario():
+        processor = ChatOrderedUpdateProcessor(max_concurrent_updates=2)
+        running = 0
+        peak = 0
+
+        async def handle():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        await asyncio.gather(*(
+            processor.process_update(message_update(user_id, user_id), handle()) for user_id in range(1, 7)
+        ))
+        assert peak == 2
+        assert processor.max_concurrent_updates == 2
+
+    asyncio.run(scenario())
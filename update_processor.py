@@ -0,0 +1,77 @@
+import asyncio
+import logging
+import os
+import sys
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Параллельная обработка обновлений с сохранением порядка для каждого пользователя.
+    Обновления разных пользователей обрабатываются одновременно (не больше BOT_MAX_CONCURRENT_UPDATES),
+    а обновления одного пользователя — строго по очереди: нажатия кнопок одного диалога не обгоняют
+    друг друга, и его user_data и состояние ConversationHandler не меняются из двух обработчиков сразу.
+    Обновления без пользователя упорядочиваются по чату, без пользователя и чата — не упорядочиваются.
+
+    Слот обработки выдаётся обновлению, только когда подошла его очередь: обновления, ждущие
+    предыдущих обновлений того же пользователя, слотов не занимают и не задерживают других пользователей.
+    Семафор базового класса берётся раньше do_process_update (то есть раньше очереди пользователя),
+    поэтому он ничего не ограничивает, а слоты выдаёт собственный семафор.
+    """
+
+    def __init__(self, max_concurrent_updates: int | None = None):
+        if max_concurrent_updates is None:
+            max_concurrent_updates = max(1, int(os.getenv("BOT_MAX_CONCURRENT_UPDATES", "32")))
+        # Базовый класс создаёт свой семафор по свойству max_concurrent_updates: на время
+        # super().__init__ оно без ограничения, а настоящее число слотов — у собственного семафора
+        self._slot_count = sys.maxsize
+        super().__init__(sys.maxsize)
+        self._slot_count = max_concurrent_updates
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        # Ключ очереди -> [asyncio.Lock, число обновлений в очереди]; запись удаляется, когда очередь пуста
+        self._queues = {}
+
+    @property
+    def max_concurrent_updates(self) -> int:
+        return self._slot_count
+
+    @staticmethod
+    def sequence_key(update: object):
+        if isinstance(update, Update):
+            if update.effective_user is not None:
+                return "user", update.effective_user.id
+            if update.effective_chat is not None:
+                return "chat", update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        key = self.sequence_key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = [asyncio.Lock(), 0]
+        queue[1] += 1
+        try:
+            # asyncio.Lock пропускает ожидающих в порядке очереди, то есть в порядке поступления обновлений
+            async with queue[0]:
+                async with self._slots:
+                    await coroutine
+        finally:
+            queue[1] -= 1
+            if queue[1] == 0:
+                del self._queues[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        if self._queues:
+            logger.info(f"Остановка обработки обновлений: в очередях пользователей осталось {len(self._queues)}")